@@ -0,0 +1,164 @@
+"""
+Vectorized torch implementations of the pointnet2 ops, used for cpu tensors (or when the cuda ops are not compiled).
+The forward/backward follow the cuda kernels in lib/src, including the index conventions:
+indices are returned as int32, ball query keeps the first nsample points found (in index order)
+and pads the empty slots with the first one.
+"""
+import torch
+
+
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield start, min(start + chunk_size, n)
+
+
+def _sqdist(x, y):
+    """
+    :param x: (B, N, 3)
+    :param y: (B, M, 3)
+    :return: (B, N, M)
+    """
+    return ((x[:, :, None] - y[:, None]) ** 2).sum(-1)
+
+
+def furthest_point_sample(xyz, npoint):
+    """
+    O(N*npoint) farthest point sampling, the min distance to the sampled set is updated in place,
+    all the batches are processed at once, the first sampled point is the first point (same as cuda)
+
+    :param xyz: (B, N, 3)
+    :param npoint: int
+    :return: (B, npoint) int32
+    """
+    B, N, _ = xyz.shape
+    batch_index = torch.arange(B, device=xyz.device)
+    output = torch.zeros(B, npoint, dtype=torch.int32, device=xyz.device)
+    min_dist = torch.full((B, N), 1e10, dtype=xyz.dtype, device=xyz.device)
+    farthest = torch.zeros(B, dtype=torch.long, device=xyz.device)
+    for i in range(npoint):
+        output[:, i] = farthest
+        centroid = xyz[batch_index, farthest].unsqueeze(1)  # Bx1x3
+        dist = ((xyz - centroid) ** 2).sum(-1)
+        torch.minimum(min_dist, dist, out=min_dist)
+        farthest = min_dist.argmax(-1)
+    return output
+
+
+def gather_points(features, idx):
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint)
+    :return: (B, C, npoint)
+    """
+    B, C, N = features.shape
+    idx = idx.long().unsqueeze(1).expand(B, C, idx.shape[1])
+    return features.gather(2, idx)
+
+
+def gather_points_grad(grad_out, idx, N):
+    """
+    :param grad_out: (B, C, npoint)
+    :param idx: (B, npoint)
+    :param N: int
+    :return: (B, C, N)
+    """
+    B, C, npoint = grad_out.shape
+    idx = idx.long().unsqueeze(1).expand(B, C, npoint)
+    grad_features = grad_out.new_zeros(B, C, N)
+    return grad_features.scatter_add_(2, idx, grad_out)
+
+
+def knn(k, unknown, known, chunk_size=1024):
+    """
+    :param k: int
+    :param unknown: (B, N, 3)
+    :param known: (B, M, 3)
+    :param chunk_size: number of unknown points processed at a time
+    :return: (B, N, k) squared distance, (B, N, k) int32 index, sorted ascending
+    """
+    B, N, _ = unknown.shape
+    dist2_list, idx_list = [], []
+    for start, end in _chunks(N, chunk_size):
+        dist2, idx = _sqdist(unknown[:, start:end], known).topk(
+            k, dim=2, largest=False
+        )
+        dist2_list.append(dist2)
+        idx_list.append(idx)
+    return torch.cat(dist2_list, 1), torch.cat(idx_list, 1).int()
+
+
+def three_interpolate(features, idx, weight):
+    """
+    :param features: (B, C, M)
+    :param idx: (B, n, 3)
+    :param weight: (B, n, 3)
+    :return: (B, C, n)
+    """
+    B, C, M = features.shape
+    n = idx.shape[1]
+    grouped = gather_points(features, idx.reshape(B, n * 3)).view(B, C, n, 3)
+    return (grouped * weight.unsqueeze(1)).sum(-1)
+
+
+def three_interpolate_grad(grad_out, idx, weight, M):
+    """
+    :param grad_out: (B, C, n)
+    :param idx: (B, n, 3)
+    :param weight: (B, n, 3)
+    :param M: int
+    :return: (B, C, M)
+    """
+    B, C, n = grad_out.shape
+    weighted = (grad_out.unsqueeze(-1) * weight.unsqueeze(1)).view(B, C, n * 3)
+    return gather_points_grad(weighted, idx.reshape(B, n * 3), M)
+
+
+def group_points(features, idx):
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint, nsample)
+    :return: (B, C, npoint, nsample)
+    """
+    B, npoint, nsample = idx.shape
+    C = features.shape[1]
+    return gather_points(features, idx.reshape(B, -1)).view(B, C, npoint, nsample)
+
+
+def group_points_grad(grad_out, idx, N):
+    """
+    :param grad_out: (B, C, npoint, nsample)
+    :param idx: (B, npoint, nsample)
+    :param N: int
+    :return: (B, C, N)
+    """
+    B, C, npoint, nsample = grad_out.shape
+    return gather_points_grad(
+        grad_out.reshape(B, C, npoint * nsample), idx.reshape(B, -1), N
+    )
+
+
+def ball_query(radius, nsample, xyz, new_xyz, chunk_size=1024):
+    """
+    the first nsample points (in index order) within the radius,
+    the empty slots are filled with the first point found, all zero if no point is found
+
+    :param radius: float
+    :param nsample: int
+    :param xyz: (B, N, 3)
+    :param new_xyz: (B, npoint, 3)
+    :param chunk_size: number of query points processed at a time
+    :return: (B, npoint, nsample) int32
+    """
+    B, npoint, _ = new_xyz.shape
+    idx = torch.zeros(B, npoint, nsample, dtype=torch.long, device=xyz.device)
+    count = torch.zeros(B, npoint, dtype=torch.long, device=xyz.device)
+    for start, end in _chunks(npoint, chunk_size):
+        within = _sqdist(new_xyz[:, start:end], xyz) < radius ** 2  # BxSxN
+        rank = within.cumsum(-1) - 1
+        keep = within & (rank < nsample)
+        b, s, k = keep.nonzero(as_tuple=True)
+        idx[b, s + start, rank[b, s, k]] = k
+        count[:, start:end] = keep.sum(-1)
+    slot = torch.arange(nsample, device=xyz.device).view(1, 1, -1)
+    idx = torch.where(slot < count.unsqueeze(-1), idx, idx[..., :1])
+    return idx.int()
@@ -6,10 +6,17 @@ from typing import Tuple
 try:
     import pointnet2_cuda as pointnet2
 except:
-    print("pointnet2 load failed, please compile it first: python pointnet2/lib/setup.py install")
-    raise ImportError
+    print("pointnet2 cuda ops are not compiled, the cpu implementation is used, to compile: python pointnet2/lib/setup.py install")
+    pointnet2 = None
 
+from pointnet2.lib import pointnet2_cpu
 from robot.utils.knn_utils import AnisoKNN
+
+
+def use_cuda_op(tensor):
+    """the cuda kernels are used for cuda tensors if compiled, otherwise the vectorized torch implementation"""
+    return pointnet2 is not None and tensor.is_cuda
+
 class FurthestPointSampling(Function):
 
     @staticmethod
@@ -24,6 +31,8 @@ class FurthestPointSampling(Function):
              output: (B, npoint) tensor containing the set
         """
         assert xyz.is_contiguous()
+        if not use_cuda_op(xyz):
+            return pointnet2_cpu.furthest_point_sample(xyz, npoint)
 
         B, N, _ = xyz.size()
         output = torch.cuda.IntTensor(B, npoint)
@@ -56,17 +65,20 @@ class GatherOperation(Function):
 
         B, npoint = idx.size()
         _, C, N = features.size()
+        ctx.for_backwards = (idx, C, N)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.gather_points(features, idx)
         output = torch.cuda.FloatTensor(B, C, npoint)
 
         pointnet2.gather_points_wrapper(B, C, N, npoint, features, idx, output)
-
-        ctx.for_backwards = (idx, C, N)
         return output
 
     @staticmethod
     def backward(ctx, grad_out):
         idx, C, N = ctx.for_backwards
         B, npoint = idx.size()
+        if not use_cuda_op(grad_out):
+            return pointnet2_cpu.gather_points_grad(grad_out.contiguous(), idx, N), None
 
         grad_features = Variable(torch.cuda.FloatTensor(B, C, N).zero_())
         grad_out_data = grad_out.data.contiguous()
@@ -92,6 +104,10 @@ class KNN(Function):
         assert unknown.is_contiguous()
         assert known.is_contiguous()
 
+        if not use_cuda_op(unknown):
+            dist2, idx = pointnet2_cpu.knn(k, unknown, known)
+            return torch.sqrt(dist2), idx
+
         B, N, _ = unknown.size()
         m = known.size(1)
         dist2 = torch.cuda.FloatTensor(B, N, k)
@@ -121,6 +137,10 @@ class ThreeNN(Function):
         assert unknown.is_contiguous()
         assert known.is_contiguous()
 
+        if not use_cuda_op(unknown):
+            dist2, idx = pointnet2_cpu.knn(3, unknown, known)
+            return torch.sqrt(dist2), idx
+
         B, N, _ = unknown.size()
         m = known.size(1)
         dist2 = torch.cuda.FloatTensor(B, N, 3)
@@ -157,6 +177,8 @@ class ThreeInterpolate(Function):
         B, c, m = features.size()
         n = idx.size(1)
         ctx.three_interpolate_for_backward = (idx, weight, m)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.three_interpolate(features, idx, weight)
         output = torch.cuda.FloatTensor(B, c, n)
 
         pointnet2.three_interpolate_wrapper(B, c, m, n, features, idx, weight, output)
@@ -174,6 +196,11 @@ class ThreeInterpolate(Function):
         """
         idx, weight, m = ctx.three_interpolate_for_backward
         B, c, n = grad_out.size()
+        if not use_cuda_op(grad_out):
+            grad_features = pointnet2_cpu.three_interpolate_grad(
+                grad_out.contiguous(), idx, weight, m
+            )
+            return grad_features, None, None
 
         grad_features = Variable(torch.cuda.FloatTensor(B, c, m).zero_())
         grad_out_data = grad_out.data.contiguous()
@@ -201,11 +228,12 @@ class GroupingOperation(Function):
         idx = idx.int()
         B, nfeatures, nsample = idx.size()
         _, C, N = features.size()
+        ctx.for_backwards = (idx, N)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.group_points(features, idx)
         output = torch.cuda.FloatTensor(B, C, nfeatures, nsample)
 
         pointnet2.group_points_wrapper(B, C, N, nfeatures, nsample, features, idx, output)
-
-        ctx.for_backwards = (idx, N)
         return output
 
     @staticmethod
@@ -219,6 +247,8 @@ class GroupingOperation(Function):
         idx, N = ctx.for_backwards
 
         B, C, npoint, nsample = grad_out.size()
+        if not use_cuda_op(grad_out):
+            return pointnet2_cpu.group_points_grad(grad_out.contiguous(), idx, N), None
         grad_features = Variable(torch.cuda.FloatTensor(B, C, N).zero_())
 
         grad_out_data = grad_out.data.contiguous()
@@ -245,6 +275,9 @@ class BallQuery(Function):
         assert new_xyz.is_contiguous()
         assert xyz.is_contiguous()
 
+        if not use_cuda_op(xyz):
+            return pointnet2_cpu.ball_query(radius, nsample, xyz, new_xyz)
+
         B, N, _ = xyz.size()
         npoint = new_xyz.size(1)
         idx = torch.cuda.IntTensor(B, npoint, nsample).zero_()
@@ -0,0 +1,147 @@
+"""
+Timing, sweeping and baseline comparison shared by the benchmark suites.
+
+A benchmark result is a json-serializable dict
+    {"suite", "name", "params", "median_ms", "min_ms", "mean_ms", "std_ms", "repeat"} (+ suite specific metrics),
+identified by key(result) = "suite/name/param=value/...", so results of different runs can be matched.
+"""
+import os
+import json
+import time
+import platform
+import itertools
+import subprocess
+import numpy as np
+import torch
+
+
+def sync(device=None):
+    if torch.cuda.is_available() and (device is None or torch.device(device).type == "cuda"):
+        torch.cuda.synchronize()
+
+
+def time_fn(fn, repeat=5, warmup=1, device=None):
+    """
+    wall-clock time of fn, cuda is synchronized before and after each call
+
+    :param fn: function without argument
+    :param repeat: number of timed calls
+    :param warmup: number of untimed calls, e.g. for the keops compilation / allocator warmup
+    :param device: the device fn runs on
+    :return: {"median_ms", "min_ms", "mean_ms", "std_ms", "repeat"}, the output of the last call
+    """
+    output = None
+    for _ in range(warmup):
+        output = fn()
+    times = []
+    for _ in range(repeat):
+        sync(device)
+        start = time.perf_counter()
+        output = fn()
+        sync(device)
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    stats = {
+        "median_ms": float(np.median(times)),
+        "min_ms": float(times.min()),
+        "mean_ms": float(times.mean()),
+        "std_ms": float(times.std()),
+        "repeat": repeat,
+    }
+    return stats, output
+
+
+def sweep(**param_lists):
+    """
+    :param param_lists: name=list of values
+    :return: list of dicts, the cartesian product of the values
+    """
+    names = list(param_lists.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[param_lists[name] for name in names])
+    ]
+
+
+def key(result):
+    params = "/".join(
+        "{}={}".format(name, value) for name, value in sorted(result["params"].items())
+    )
+    return "{}/{}/{}".format(result["suite"], result["name"], params)
+
+
+def environment_info():
+    try:
+        commit = (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "num_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else "",
+    }
+
+
+def save_results(fpath, results, args=None):
+    """
+    :param fpath: output json
+    :param results: list of benchmark results
+    :param args: json-serializable run settings, e.g. the command line arguments
+    """
+    folder = os.path.dirname(fpath)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(fpath, "w") as f:
+        json.dump(
+            {"environment": environment_info(), "args": args or {}, "results": results},
+            f,
+            indent=2,
+        )
+
+
+def load_results(fpath):
+    with open(fpath) as f:
+        return json.load(f)["results"]
+
+
+def compare_to_baseline(results, baseline_results, threshold=1.2, metric="median_ms"):
+    """
+    a result regresses if it is more than threshold times slower than the baseline
+
+    :param results: list of benchmark results
+    :param baseline_results: list of benchmark results of the baseline run
+    :param threshold: allowed slowdown ratio
+    :param metric: the compared metric
+    :return: list of {"key", "baseline", "current", "ratio", "regression"} for the results found in the baseline
+    """
+    baseline = {key(result): result for result in baseline_results}
+    comparison = []
+    for result in results:
+        ref = baseline.get(key(result))
+        if ref is None or metric not in ref or metric not in result:
+            continue
+        ratio = result[metric] / max(ref[metric], 1e-12)
+        comparison.append(
+            {
+                "key": key(result),
+                "baseline": ref[metric],
+                "current": result[metric],
+                "ratio": ratio,
+                "regression": ratio > threshold,
+            }
+        )
+    return comparison
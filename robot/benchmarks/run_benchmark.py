@@ -0,0 +1,92 @@
+"""
+Run the benchmark suites and compare them against a baseline.
+
+Examples:
+    # record a baseline on the node, the end-to-end registrations are run only if "registration" is listed
+    python robot/benchmarks/run_benchmark.py --suite kernel sinkhorn --output baseline.json
+    # check a change against it, exit with 1 if any benchmark is more than 20% slower
+    python robot/benchmarks/run_benchmark.py --suite kernel sinkhorn --output current.json --baseline baseline.json --threshold 1.2
+"""
+import os, sys
+
+sys.path.insert(0, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath(".."))
+sys.path.insert(0, os.path.abspath("../.."))
+import argparse
+import torch
+import robot.global_variable
+from robot.benchmarks.suites import SUITES, PRESETS
+from robot.benchmarks.benchmark_utils import (
+    save_results,
+    load_results,
+    compare_to_baseline,
+    key,
+)
+
+
+def run_benchmark(suites, preset="small", repeat=5, registration_repeat=1, device="cpu"):
+    results = []
+    for suite in suites:
+        print("running the {} benchmark".format(suite))
+        suite_repeat = registration_repeat if suite == "registration" else repeat
+        suite_results = SUITES[suite](preset=preset, repeat=suite_repeat, device=device)
+        for result in suite_results:
+            print("{}: {:.3f} ms".format(key(result), result["median_ms"]))
+        results += suite_results
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the kernels, ot and registrations")
+    parser.add_argument(
+        "--suite",
+        nargs="+",
+        default=["kernel", "knn", "sampler", "sinkhorn"],
+        choices=list(SUITES.keys()),
+        help="the suites to run",
+    )
+    parser.add_argument("--preset", default="small", choices=list(PRESETS.keys()))
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls")
+    parser.add_argument(
+        "--registration_repeat", type=int, default=1, help="number of timed registrations"
+    )
+    parser.add_argument(
+        "--device",
+        default="cuda:0" if torch.cuda.is_available() else "cpu",
+        help="torch device",
+    )
+    parser.add_argument("--num_threads", type=int, default=-1, help="torch cpu threads, -1 for the torch default")
+    parser.add_argument("--output", default="benchmark.json", help="the result json")
+    parser.add_argument("--baseline", default="", help="the baseline result json")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="allowed slowdown ratio against the baseline"
+    )
+    args = parser.parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    results = run_benchmark(
+        args.suite, args.preset, args.repeat, args.registration_repeat, args.device
+    )
+    save_results(args.output, results, vars(args))
+    print("the results are saved into {}".format(args.output))
+    if args.baseline:
+        comparison = compare_to_baseline(
+            results, load_results(args.baseline), args.threshold
+        )
+        for item in comparison:
+            print(
+                "{}{}: {:.3f} ms -> {:.3f} ms ({:.2f}x)".format(
+                    "[regression] " if item["regression"] else "",
+                    item["key"],
+                    item["baseline"],
+                    item["current"],
+                    item["ratio"],
+                )
+            )
+        regressions = [item for item in comparison if item["regression"]]
+        print(
+            "{} of {} benchmarks regress beyond {}x".format(
+                len(regressions), len(comparison), args.threshold
+            )
+        )
+        sys.exit(1 if regressions else 0)
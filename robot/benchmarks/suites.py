@@ -0,0 +1,267 @@
+"""
+Benchmark suites, each suite is a function(preset, repeat, device) returning a list of benchmark results.
+
+The sweeps are fixed by the preset ("small" for a quick check, "default" for the regression baselines),
+the inputs are generated from a fixed seed so that the runs are comparable across commits.
+The keops kernels are skipped if pykeops is not available.
+"""
+import os
+import tempfile
+import torch
+from robot.benchmarks.benchmark_utils import time_fn, sweep
+
+PRESETS = {
+    "small": {
+        "kernel": {"N": [1000], "M": [1000], "D": [3], "B": [1]},
+        "knn": {"N": [2000], "M": [2000], "K": [5], "B": [1]},
+        "sampler": {"N": [10000], "B": [1]},
+        "sinkhorn": {"N": [500], "M": [500], "B": [1]},
+    },
+    "default": {
+        "kernel": {"N": [1000, 10000], "M": [1000, 10000], "D": [3], "B": [1, 2]},
+        "knn": {"N": [10000, 50000], "M": [10000, 50000], "K": [5, 10], "B": [1]},
+        "sampler": {"N": [10000, 100000], "B": [1, 2]},
+        "sinkhorn": {"N": [1000, 5000], "M": [1000, 5000], "B": [1]},
+    },
+}
+
+KERNEL_ARGS = {
+    "gauss": {"sigma": 0.1},
+    "normalized_gauss": {"sigma": 0.1},
+    "gauss_grad": {"sigma": 0.1},
+    "gauss_lin": {"sigma": 0.1},
+    "multi_gauss": {"sigma_list": [0.05, 0.1, 0.2], "weight_list": [0.2, 0.3, 0.5]},
+    "normalized_multi_gauss": {
+        "sigma_list": [0.05, 0.1, 0.2],
+        "weight_list": [0.2, 0.3, 0.5],
+    },
+    "multi_gauss_grad": {
+        "sigma_list": [0.05, 0.1, 0.2],
+        "weight_list": [0.2, 0.3, 0.5],
+    },
+}
+
+SETTINGS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings")
+
+
+def _points(B, N, D, device, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(B, N, D, generator=generator).to(device)
+
+
+def _kernel_inputs(kernel_type, B, N, M, D, device):
+    x, y = _points(B, N, D, device, 0), _points(B, M, D, device, 1)
+    if kernel_type.endswith("_grad"):
+        px, py = _points(B, N, D, device, 2), _points(B, M, D, device, 3)
+        return px, x, py, y
+    if kernel_type == "gauss_lin":
+        u, v = _points(B, N, D, device, 2), _points(B, M, D, device, 3)
+        return x, y, u, v, _points(B, M, 1, device, 4)
+    return x, y, _points(B, M, D, device, 2)
+
+
+def _kernel_engines():
+    from robot.kernels.torch_kernels import TorchKernel
+    from robot.kernels.tiled_kernels import TiledTorchKernel
+
+    engines = {
+        "torch": (
+            TorchKernel,
+            ["gauss", "multi_gauss", "gauss_grad", "multi_gauss_grad", "gauss_lin"],
+        ),
+        "tiled": (TiledTorchKernel, list(KERNEL_ARGS.keys())),
+    }
+    try:
+        from robot.kernels.keops_kernels import LazyKeopsKernel
+
+        engines["keops"] = (LazyKeopsKernel, list(KERNEL_ARGS.keys()))
+    except ImportError:
+        pass
+    return engines
+
+
+def kernel_suite(preset="small", repeat=5, device="cpu"):
+    """
+    forward reduction of every kernel type of the torch / tiled / keops kernels,
+    the dense torch kernel is skipped beyond 1e8 pairs
+    """
+    results = []
+    for engine, (kernel_class, kernel_types) in _kernel_engines().items():
+        for kernel_type in kernel_types:
+            kernel = kernel_class(kernel_type=kernel_type, **KERNEL_ARGS[kernel_type])
+            for params in sweep(**PRESETS[preset]["kernel"]):
+                if engine == "torch" and params["B"] * params["N"] * params["M"] > 1e8:
+                    continue
+                inputs = _kernel_inputs(kernel_type, device=device, **params)
+                stats, _ = time_fn(lambda: kernel(*inputs), repeat, device=device)
+                results.append(
+                    dict(
+                        stats,
+                        suite="kernel",
+                        name="{}/{}".format(engine, kernel_type),
+                        params=params,
+                    )
+                )
+    return results
+
+
+def knn_suite(preset="small", repeat=5, device="cpu"):
+    """
+    brute force keops knn against the grid index, the index is built in the warmup call and reused as in an iterative solver
+    """
+    from robot.utils.knn_utils import KNN
+
+    results = []
+    for params in sweep(**PRESETS[preset]["knn"]):
+        B, N, M, K = params["B"], params["N"], params["M"], params["K"]
+        pc1, pc2 = _points(B, N, 3, device, 0), _points(B, M, 3, device, 1)
+        for name, knn_args in [
+            ("keops", {}),
+            ("grid", {"index": "grid"}),
+        ]:
+            knn = KNN(return_value=False, **knn_args)
+            stats, _ = time_fn(lambda: knn(pc1, pc2, K), repeat, device=device)
+            results.append(dict(stats, suite="knn", name=name, params=params))
+    return results
+
+
+def sampler_suite(preset="small", repeat=5, device="cpu"):
+    from robot.shape.point_sampler import (
+        batch_grid_sampler,
+        batch_uniform_sampler,
+    )
+
+    samplers = {
+        "grid_0.02": batch_grid_sampler(0.02),
+        "grid_0.05": batch_grid_sampler(0.05),
+        "uniform_1000": batch_uniform_sampler(1000),
+    }
+    results = []
+    for params in sweep(**PRESETS[preset]["sampler"]):
+        points = _points(params["B"], params["N"], 3, device, 0)
+        weights = torch.ones(params["B"], params["N"], 1, device=device)
+        for name, sampler in samplers.items():
+            stats, _ = time_fn(lambda: sampler(points, weights), repeat, device=device)
+            results.append(dict(stats, suite="sampler", name=name, params=params))
+    return results
+
+
+def sinkhorn_suite(preset="small", repeat=5, device="cpu"):
+    """
+    balanced and unbalanced sinkhorn of each backend, the number of sinkhorn iterations is recorded
+    """
+    from robot.utils.sinkhorn_utils import SinkhornEngine
+
+    results = []
+    for params in sweep(**PRESETS[preset]["sinkhorn"]):
+        B, N, M = params["B"], params["N"], params["M"]
+        x, y = _points(B, N, 3, device, 0), _points(B, M, 3, device, 1)
+        a = torch.ones(B, N, device=device) / N
+        b = torch.ones(B, M, device=device) / M
+        for backend in ["tensorized", "online", "multiscale"]:
+            if backend == "tensorized" and B * N * M > 5e7:
+                continue
+            for reach in [None, 1.0]:
+                engine = SinkhornEngine(blur=0.01, reach=reach, scaling=0.8, backend=backend)
+                stats, _ = time_fn(lambda: engine.solve(a, x, b, y), repeat, device=device)
+                name = "{}/{}".format(backend, "balanced" if reach is None else "unbalanced")
+                results.append(
+                    dict(
+                        stats,
+                        suite="sinkhorn",
+                        name=name,
+                        params=params,
+                        n_iter=engine.n_iter,
+                    )
+                )
+    return results
+
+
+def run_registration(setting, data_folder="", device="cpu", record_path=None):
+    """
+    run the optimization based registration of a benchmark setting
+
+    :param setting: ParameterDict, with "name", "source_path", "target_path", "reader", "normalizer", "sampler",
+        "model_name", "model", "solver"
+    :param data_folder: the data paths of the setting are relative to data_folder
+    :param device: torch device
+    :param record_path: the record path of the solver, a temporary folder if None
+    :return: the registered shape pair
+    """
+    from robot.utils.obj_factory import obj_factory
+    from robot.datasets.data_utils import get_obj
+    from robot.shape.shape_pair_utils import create_shape_pair
+    from robot.global_variable import MODEL_POOL
+    from robot.models_reg.multiscale_optimization import build_multi_scale_solver
+
+    get_obj_func = get_obj(
+        setting["reader"], setting["normalizer"], setting["sampler"], device
+    )
+    source_obj, _ = get_obj_func(os.path.join(data_folder, setting["source_path"]))
+    target_obj, _ = get_obj_func(os.path.join(data_folder, setting["target_path"]))
+    source, target = obj_factory("shape_pair_utils.create_source_and_target_shape()")(
+        {"source": source_obj, "target": target_obj}
+    )
+    shape_pair = create_shape_pair(source, target)
+    shape_pair.pair_name = setting["name"]
+    solver_opt = setting["solver"]
+    solver_opt["record_path"] = record_path or tempfile.mkdtemp()
+    model = MODEL_POOL[setting["model_name"]](setting["model"])
+    solver = build_multi_scale_solver(solver_opt, model)
+    return solver(shape_pair)
+
+
+def registration_suite(preset="small", repeat=1, device="cpu", settings=None):
+    """
+    end-to-end registration of the settings in robot/benchmarks/settings, the final ot distance to the target
+    is recorded so that a speedup degrading the registration can be noticed
+
+    :param settings: list of setting json paths, all the settings in robot/benchmarks/settings if None
+    """
+    import robot.global_variable
+    from robot.utils.module_parameters import ParameterDict
+    from robot.metrics.reg_losses import GeomDistance
+
+    if settings is None:
+        settings = sorted(
+            os.path.join(SETTINGS_FOLDER, fname)
+            for fname in os.listdir(SETTINGS_FOLDER)
+            if fname.endswith(".json")
+        )
+    sim_opt = ParameterDict()
+    sim_opt["attr"] = "points"
+    sim = GeomDistance(sim_opt)
+    results = []
+    for setting_path in settings:
+        setting = ParameterDict()
+        setting.load_JSON(setting_path)
+        setting["name"] = os.path.splitext(os.path.basename(setting_path))[0]
+        data_folder = os.path.dirname(setting_path)
+        stats, shape_pair = time_fn(
+            lambda: run_registration(setting, data_folder, device),
+            repeat,
+            warmup=0,
+            device=device,
+        )
+        with torch.no_grad():
+            ot_distance = sim(shape_pair.flowed, shape_pair.target).mean().item()
+        results.append(
+            dict(
+                stats,
+                suite="registration",
+                name=setting["name"],
+                params={},
+                ot_distance=ot_distance,
+                npoints=[shape_pair.source.npoints, shape_pair.target.npoints],
+            )
+        )
+    return results
+
+
+SUITES = {
+    "kernel": kernel_suite,
+    "knn": knn_suite,
+    "sampler": sampler_suite,
+    "sinkhorn": sinkhorn_suite,
+    "registration": registration_suite,
+}
@@ -0,0 +1,320 @@
+"""
+Memory-mapped columnar store of preprocessed shapes.
+
+Each attribute of the case dicts (e.g. points, weights, pointfea, extra_info/transform/shift) is saved into one flat
+file, the cases are concatenated along the first axis and an index records the offsets of each case.
+The store is built once (see the command line below) and opened read-only by the dataloader workers,
+reading a case only slices the memory-mapped files, the pages are shared by all the workers through the os page cache.
+
+python mmap_store.py --data_path /path/to/data/train --output_path /path/to/store/train \
+    --reader "lung_dataloader_utils.lung_reader()" --normalizer "lung_dataloader_utils.lung_normalizer(scale=[100,100,100])"
+"""
+import os
+import json
+import numpy as np
+from multiprocessing import get_all_start_methods, get_context
+
+INDEX_FILE = "store_index.json"
+NESTED_SEP = "/"
+
+_preprocess_fn = None
+_stats_fn = None
+
+
+def _flatten_dict(case_dict, prefix=""):
+    flat = {}
+    for key, item in case_dict.items():
+        name = prefix + key
+        if isinstance(item, dict):
+            flat.update(_flatten_dict(item, name + NESTED_SEP))
+        else:
+            flat[name] = item
+    return flat
+
+
+def _unflatten_dict(flat):
+    case_dict = {}
+    for name, item in flat.items():
+        keys = name.split(NESTED_SEP)
+        cur = case_dict
+        for key in keys[:-1]:
+            cur = cur.setdefault(key, {})
+        cur[keys[-1]] = item
+    return case_dict
+
+
+def _attr_file_name(attr):
+    return attr.replace(NESTED_SEP, "__") + ".dat"
+
+
+class MMapStoreWriter(object):
+    """
+    append the case dicts one by one, each attribute is streamed into its own flat file
+    """
+
+    def __init__(self, store_path, build_info=None):
+        os.makedirs(store_path, exist_ok=True)
+        self.store_path = store_path
+        self.build_info = build_info if build_info is not None else {}
+        self.names = []
+        self.attrs = {}
+        self.files = {}
+
+    def append(self, name, case_dict):
+        case_id = len(self.names)
+        self.names.append(name)
+        for attr, item in _flatten_dict(case_dict).items():
+            item = np.ascontiguousarray(item)
+            is_scalar = item.ndim == 0
+            item = item.reshape(1) if is_scalar else item
+            if attr not in self.attrs:
+                self.attrs[attr] = {
+                    "dtype": item.dtype.str,
+                    "tail_shape": list(item.shape[1:]),
+                    "scalar": is_scalar,
+                    "offsets": [],
+                    "size": 0,
+                }
+                self.files[attr] = open(
+                    os.path.join(self.store_path, _attr_file_name(attr)), "wb"
+                )
+            info = self.attrs[attr]
+            assert (
+                list(item.shape[1:]) == info["tail_shape"]
+                and item.dtype.str == info["dtype"]
+            ), "attribute {} of {} is not consistent with the previous cases".format(
+                attr, name
+            )
+            # a case may miss an attribute, its offsets are then [-1, -1]
+            info["offsets"] += [[-1, -1]] * (case_id - len(info["offsets"]))
+            info["offsets"].append([info["size"], info["size"] + item.shape[0]])
+            info["size"] += item.shape[0]
+            self.files[attr].write(item.tobytes())
+
+    def close(self):
+        for attr, info in self.attrs.items():
+            info["offsets"] += [[-1, -1]] * (len(self.names) - len(info["offsets"]))
+            self.files[attr].close()
+        index = {"names": self.names, "attrs": self.attrs, "build_info": self.build_info}
+        with open(os.path.join(self.store_path, INDEX_FILE), "w") as f:
+            json.dump(index, f)
+
+
+def _preprocess_case(item):
+    name, file_info = item
+    case_dict = _preprocess_fn(file_info)
+    return name, case_dict, os.getpid(), _stats_fn() if _stats_fn is not None else None
+
+
+def build_mmap_store(
+    file_info_dict,
+    store_path,
+    preprocess_fn,
+    num_workers=12,
+    build_info=None,
+    stats_fn=None,
+    worker_stats=None,
+):
+    """
+    preprocess the files in parallel and stream the results into the store
+
+    :param file_info_dict: {name: file_info}, the file_info is the input of the preprocess_fn
+    :param store_path: output folder
+    :param preprocess_fn: function(file_info), return a (nested) dict of arrays
+    :param num_workers: number of processes
+    :param build_info: dict, recorded into the store index, e.g. the reader and normalizer settings
+    :param stats_fn: function(), the cumulative statistics of the worker, e.g. PreprocessCache.stats
+    :param worker_stats: dict, filled with {pid: the last stats_fn() of the worker}
+    :return: MMapShapeStore
+    """
+    global _preprocess_fn, _stats_fn
+    # inherited by the forked workers, the closures need no pickling
+    _preprocess_fn, _stats_fn = preprocess_fn, stats_fn
+    writer = MMapStoreWriter(store_path, build_info)
+    items = list(file_info_dict.items())
+    if num_workers > 1 and "fork" in get_all_start_methods():
+        with get_context("fork").Pool(num_workers) as pool:
+            results = pool.imap(_preprocess_case, items, chunksize=4)
+            for name, case_dict, pid, stats in results:
+                writer.append(name, case_dict)
+                if worker_stats is not None and stats is not None:
+                    worker_stats[pid] = stats
+    else:
+        for name, case_dict, pid, stats in map(_preprocess_case, items):
+            writer.append(name, case_dict)
+            if worker_stats is not None and stats is not None:
+                worker_stats[pid] = stats
+    writer.close()
+    print("the store is built, total {} shapes saved into {}".format(len(items), store_path))
+    return MMapShapeStore(store_path)
+
+
+class MMapShapeStore(object):
+    """
+    read-only access to a store built by build_mmap_store,
+    the files are mapped lazily in each process (so the store can be passed to the dataloader workers),
+    the returned arrays are copy-on-write views, they can be modified in memory without touching the files
+
+    Examples:
+        >>> store = MMapShapeStore(store_path)
+        >>> case_dict = store.get("copd1_insp")
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.names = index["names"]
+        self.build_info = index["build_info"]
+        self.attrs = index["attrs"]
+        self.offsets = {
+            attr: np.array(info["offsets"], dtype=np.int64)
+            for attr, info in self.attrs.items()
+        }
+        self.name_to_id = {name: i for i, name in enumerate(self.names)}
+        self._arrays = None
+
+    @staticmethod
+    def exists(store_path):
+        return os.path.isfile(os.path.join(store_path, INDEX_FILE))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def _open(self):
+        self._arrays = {}
+        for attr, info in self.attrs.items():
+            shape = tuple([info["size"]] + info["tail_shape"])
+            self._arrays[attr] = (
+                np.memmap(
+                    os.path.join(self.store_path, _attr_file_name(attr)),
+                    dtype=np.dtype(info["dtype"]),
+                    mode="c",
+                    shape=shape,
+                )
+                if info["size"] > 0
+                else np.zeros(shape, dtype=np.dtype(info["dtype"]))
+            )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.name_to_id
+
+    def get(self, name):
+        """
+        :param name: the case name or the case id
+        :return: (nested) dict of arrays
+        """
+        if self._arrays is None:
+            self._open()
+        case_id = self.name_to_id[name] if isinstance(name, str) else name
+        flat = {}
+        for attr, info in self.attrs.items():
+            start, end = self.offsets[attr][case_id]
+            if start < 0:
+                continue
+            item = self._arrays[attr][start:end]
+            flat[attr] = item[0] if info["scalar"] else item
+        return _unflatten_dict(flat)
+
+
+def remove_mmap_store(store_path):
+    """remove the index and the attribute files of the store, the index first so a partial removal is never read"""
+    store = MMapShapeStore(store_path)
+    os.remove(os.path.join(store_path, INDEX_FILE))
+    for attr in store.attrs:
+        attr_path = os.path.join(store_path, _attr_file_name(attr))
+        if os.path.isfile(attr_path):
+            os.remove(attr_path)
+
+
+def open_mmap_store(store_path, file_info_dict, preprocess_fn, build_info, **build_args):
+    """
+    open the store, it is (re)built if it doesn't exist, was built with another build_info
+    (e.g. another reader or normalizer) or misses a shape of file_info_dict
+
+    :param store_path: the store folder
+    :param file_info_dict: {name: file_info}, the shapes expected in the store
+    :param preprocess_fn: function(file_info), return a (nested) dict of arrays
+    :param build_info: dict, the settings the store should be built with
+    :param build_args: the other arguments of build_mmap_store
+    :return: MMapShapeStore
+    """
+    if MMapShapeStore.exists(store_path):
+        store = MMapShapeStore(store_path)
+        missing = [name for name in file_info_dict if name not in store]
+        if store.build_info == build_info and not missing:
+            return store
+        reason = (
+            "it was built with {}".format(store.build_info)
+            if store.build_info != build_info
+            else "{} shapes are missing".format(len(missing))
+        )
+        print("the store in {} is rebuilt, {}".format(store_path, reason))
+        remove_mmap_store(store_path)
+    return build_mmap_store(
+        file_info_dict, store_path, preprocess_fn, build_info=build_info, **build_args
+    )
+
+
+def collect_file_info(data_path):
+    """
+    collect the shapes listed in shape_data.json or pair_data.json of a phase folder
+
+    :param data_path: e.g. data_root_path/train
+    :return: {name: file_info}
+    """
+    from robot.datasets.data_utils import read_json_into_list
+
+    file_info_dict = {}
+    if os.path.isfile(os.path.join(data_path, "shape_data.json")):
+        _, file_info_list = read_json_into_list(os.path.join(data_path, "shape_data.json"))
+    else:
+        _, pair_info_list = read_json_into_list(os.path.join(data_path, "pair_data.json"))
+        file_info_list = [
+            pair_info[key] for pair_info in pair_info_list for key in ["source", "target"]
+        ]
+    for file_info in file_info_list:
+        file_info_dict.setdefault(file_info["name"], file_info)
+    return file_info_dict
+
+
+def preprocess_with(reader_obj, normalizer_obj):
+    from robot.utils.obj_factory import obj_factory
+
+    reader = obj_factory(reader_obj)
+    normalizer = obj_factory(normalizer_obj) if normalizer_obj else None
+
+    def preprocess(file_info):
+        case_dict = reader(file_info)
+        return normalizer(case_dict) if normalizer is not None else case_dict
+
+    return preprocess
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="build a memory-mapped store of the preprocessed shapes"
+    )
+    parser.add_argument(
+        "--data_path", required=True, type=str,
+        help="the phase folder including shape_data.json or pair_data.json",
+    )
+    parser.add_argument("--output_path", required=True, type=str, help="the store folder")
+    parser.add_argument("--reader", required=True, type=str, help="reader obj string")
+    parser.add_argument("--normalizer", default="", type=str, help="normalizer obj string")
+    parser.add_argument("--num_workers", default=12, type=int, help="number of processes")
+    args = parser.parse_args()
+    build_mmap_store(
+        collect_file_info(args.data_path),
+        args.output_path,
+        preprocess_with(args.reader, args.normalizer),
+        num_workers=args.num_workers,
+        build_info={"reader": args.reader, "normalizer": args.normalizer},
+    )
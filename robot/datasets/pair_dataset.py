@@ -8,6 +8,8 @@ import numpy as np
 from robot.datasets.data_utils import read_json_into_list, split_dict
 from torch.utils.data import Dataset
 from robot.utils.obj_factory import obj_factory
+from robot.datasets.mmap_store import open_mmap_store
+from robot.datasets.preprocess_cache import PreprocessCache, report_preprocess_cache
 from multiprocessing import *
 
 blosc.set_nthreads(1)
@@ -63,6 +65,31 @@ class RegistrationPairDataset(Dataset):
         self.normalizer = obj_factory(
             option[("normalizer", "", "a normalizer instance")]
         )
+        preprocess_cache_path = option[
+            (
+                "preprocess_cache_path",
+                "",
+                "if set, the preprocessed shapes are cached on disk, keyed by the file content and the reader/normalizer setting, the cache can be shared by different runs",
+            )
+        ]
+        preprocess_cache_max_size_gb = option[
+            (
+                "preprocess_cache_max_size_gb",
+                50.0,
+                "the least recently used entries are evicted when the preprocess cache exceeds this size",
+            )
+        ]
+        self.preprocess_cache = (
+            PreprocessCache(
+                preprocess_cache_path,
+                config="reader:{}|normalizer:{}".format(
+                    option["reader"], option["normalizer"]
+                ),
+                max_size_gb=preprocess_cache_max_size_gb,
+            )
+            if preprocess_cache_path
+            else None
+        )
         pair_postprocess_obj = option[
             ("pair_postprocess_obj", "", "a pair_postprocess instance")
         ]
@@ -93,8 +120,17 @@ class RegistrationPairDataset(Dataset):
                 " during the training, increase the dataset size to  factor*len(dataset) ",
             )
         ]
-
-        if self.load_into_memory:
+        mmap_store_path = option[
+            (
+                "mmap_store_path",
+                "",
+                "if set, read the preprocessed shapes from the memory-mapped store in mmap_store_path/phase (built by datasets/mmap_store.py, or here if it doesn't exist) instead of loading them into memory",
+            )
+        ]
+        self.store = None
+        if mmap_store_path:
+            self._init_mmap_store(os.path.join(mmap_store_path, phase))
+        elif self.load_into_memory:
             self._init_data_pool()
 
     def get_file_list(self):
@@ -123,6 +159,7 @@ class RegistrationPairDataset(Dataset):
         """"""
         manager = Manager()
         data_dic = manager.dict()
+        cache_stats = manager.dict()
         data_info_dic = {}
         _pair_name_list = []
         for pair_info in self.pair_info_list:
@@ -145,6 +182,7 @@ class RegistrationPairDataset(Dataset):
                 args=(
                     dict_splits[i],
                     data_dic,
+                    cache_stats,
                 ),
             )
             p.start()
@@ -158,6 +196,7 @@ class RegistrationPairDataset(Dataset):
             )
         )
         data_dic = dict(data_dic)
+        report_preprocess_cache(cache_stats.values())
 
         # organize data into pair list
         for pair_name in _pair_name_list:
@@ -165,6 +204,35 @@ class RegistrationPairDataset(Dataset):
             tname = pair_name[1]
             self.pair_list.append([data_dic[sname], data_dic[tname]])
 
+    def _init_mmap_store(self, store_path):
+        """
+        open the memory-mapped store, the shapes are shared by the dataloader workers through the os page cache
+        :param store_path: path of the store of the current phase, it is rebuilt if it is stale
+        """
+        data_info_dic = {}
+        for pair_info in self.pair_info_list:
+            for file_info in [pair_info["source"], pair_info["target"]]:
+                data_info_dic.setdefault(file_info["name"], file_info)
+        num_of_workers = 12 if len(data_info_dic) > 12 else 2
+        cache_stats = {}
+        self.store = open_mmap_store(
+            store_path,
+            data_info_dic,
+            self._preprocess_data,
+            build_info={
+                "reader": self.reg_option["reader"],
+                "normalizer": self.reg_option["normalizer"],
+            },
+            num_workers=num_of_workers,
+            stats_fn=self.preprocess_cache.stats if self.preprocess_cache is not None else None,
+            worker_stats=cache_stats,
+        )
+        report_preprocess_cache(cache_stats.values())
+
+    def _load_shape(self, file_info):
+        """read the shape from the store, open_mmap_store guarantees that all the shapes of the phase are included"""
+        return self.store.get(file_info["name"])
+
     def _preprocess_data(self, file_info):
         """
         preprocess the data :
@@ -173,15 +241,21 @@ class RegistrationPairDataset(Dataset):
         :param path: data_path
         :return: data_dict, shape_type
         """
+        if self.preprocess_cache is not None:
+            return self.preprocess_cache(file_info, self._read_and_normalize)
+        return self._read_and_normalize(file_info)
+
+    def _read_and_normalize(self, file_info):
         case_dict = self.reader(file_info)
         case_dict = self.normalizer(case_dict)
         return case_dict
 
-    def _data_into_zipnp(self, data_path_dic, data_dict):
+    def _data_into_zipnp(self, data_path_dic, data_dict, cache_stats):
         """
         compress the data into zip to save memory
         :param data_path_dic:
         :param data_dict:
+        :param cache_stats: the preprocess cache statistics of the worker are put into it, keyed by the pid
         :return:
         """
         def zip_fn(item):
@@ -192,6 +266,8 @@ class RegistrationPairDataset(Dataset):
         for fn in tqdm(data_path_dic):
             case_dict = self._preprocess_data(data_path_dic[fn])
             data_dict[fn] = {key: zip_fn(case_dict[key]) for key in case_dict}
+        if self.preprocess_cache is not None:
+            cache_stats[os.getpid()] = self.preprocess_cache.stats()
 
     def _inverse_name(self, name):
         """get the name of the inversed registration pair"""
@@ -240,7 +316,10 @@ class RegistrationPairDataset(Dataset):
         pair_info = self.pair_info_list[idx]
         pair_name = self.pair_name_list[idx]
         source_info, target_info = pair_info["source"], pair_info["target"]
-        if not self.load_into_memory:
+        if self.store is not None:
+            source_dict = self._load_shape(source_info)
+            target_dict = self._load_shape(target_info)
+        elif not self.load_into_memory:
             source_dict = self._preprocess_data(source_info)
             target_dict = self._preprocess_data(target_info)
         else:
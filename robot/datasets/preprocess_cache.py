@@ -0,0 +1,157 @@
+"""
+Content-addressed on-disk cache of the preprocessed shapes.
+
+The key of a shape is the hash of its file content together with the reader/normalizer setting (obj_factory strings),
+so the cache can be shared by the runs on the same data (e.g. hyper-parameter sweeps), and a changed file or
+a changed preprocessing never hits a stale entry. The least recently used entries are evicted when
+the cache grows beyond the size limit.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from robot.datasets.mmap_store import _flatten_dict, _unflatten_dict
+
+CACHE_SUFFIX = ".npz"
+
+
+def file_hash(path, block_size=1 << 20):
+    hasher = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class PreprocessCache(object):
+    """
+    e.g. cache = PreprocessCache(cache_path, config="reader:...|normalizer:...", max_size_gb=50)
+         case_dict = cache(file_info, preprocess_fn)
+    """
+
+    def __init__(self, cache_path, config="", max_size_gb=50.0):
+        """
+        :param cache_path: folder of the cache, can be shared by different runs
+        :param config: string that identifies the preprocessing, e.g. the reader and the normalizer obj strings
+        :param max_size_gb: the least recently used entries are removed when the cache is larger than this
+        """
+        os.makedirs(cache_path, exist_ok=True)
+        self.cache_path = cache_path
+        self.config_hash = hashlib.sha1(config.encode()).hexdigest()
+        self.max_size = int(max_size_gb * (1 << 30))
+        self._file_hashes = {}
+        self.n_hit = 0
+        self.n_miss = 0
+        self.n_evict = 0
+        self.size = self._scan()[1]
+
+    def _scan(self):
+        entries = []
+        for fname in os.listdir(self.cache_path):
+            if fname.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_path, fname))
+                except FileNotFoundError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+        return entries, sum(entry[1] for entry in entries)
+
+    def key(self, file_info):
+        """
+        :param file_info: dict including "data_path", the other items (except the name) are also part of the key
+        :return: hex string
+        """
+        path = file_info["data_path"]
+        stat = os.stat(path)
+        stamp = (path, stat.st_size, stat.st_mtime_ns)
+        if stamp not in self._file_hashes:
+            self._file_hashes[stamp] = file_hash(path)
+        extra = {k: v for k, v in file_info.items() if k not in ["name", "data_path"]}
+        content = "|".join(
+            [self._file_hashes[stamp], self.config_hash, json.dumps(extra, sort_keys=True)]
+        )
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_path, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        path = self._entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                case_dict = _unflatten_dict({name: data[name] for name in data.files})
+        except (FileNotFoundError, OSError, ValueError):  # missing, evicted or partially written
+            return None
+        os.utime(path)  # mark as recently used
+        return case_dict
+
+    def save(self, key, case_dict):
+        path = self._entry_path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **_flatten_dict(case_dict))
+        os.replace(tmp_path, path)  # atomic, concurrent runs never read a partial entry
+        self.size += os.path.getsize(path)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """remove the least recently used entries until the cache is below 90% of the size limit"""
+        entries, self.size = self._scan()
+        for _, size, fname in sorted(entries):
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_path, fname))
+                self.n_evict += 1
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def __call__(self, file_info, preprocess_fn):
+        """
+        :param file_info: dict including "data_path"
+        :param preprocess_fn: function(file_info), return a (nested) dict of arrays, called on a cache miss
+        :return: (nested) dict of arrays
+        """
+        key = self.key(file_info)
+        case_dict = self.load(key)
+        if case_dict is not None:
+            self.n_hit += 1
+            return case_dict
+        self.n_miss += 1
+        case_dict = preprocess_fn(file_info)
+        self.save(key, case_dict)
+        return case_dict
+
+    def stats(self):
+        total = self.n_hit + self.n_miss
+        return {
+            "hit": self.n_hit,
+            "miss": self.n_miss,
+            "hit_rate": self.n_hit / total if total else 0.0,
+            "evict": self.n_evict,
+            "size_gb": self.size / (1 << 30),
+        }
+
+    def __repr__(self):
+        return "PreprocessCache({}): {}".format(self.cache_path, self.stats())
+
+
+def report_preprocess_cache(stats_list):
+    """
+    print one summary line of a cache used by several processes
+
+    :param stats_list: PreprocessCache.stats() of each process
+    """
+    stats_list = list(stats_list)
+    if not stats_list:
+        return
+    n_hit = sum(stats["hit"] for stats in stats_list)
+    n_miss = sum(stats["miss"] for stats in stats_list)
+    n_evict = sum(stats["evict"] for stats in stats_list)
+    print(
+        "preprocess cache hit {}, miss {}, evict {}, hit rate {:.2f}".format(
+            n_hit, n_miss, n_evict, n_hit / max(n_hit + n_miss, 1)
+        )
+    )
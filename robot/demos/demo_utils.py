@@ -14,47 +14,36 @@ def detect_folding(
 def get_omt_mapping(
     gemloss_setting, source, target, fea_to_map, p=2, mode="hard", confid=0.1
 ):
-    """"""
+    """
+    map the source features onto the target points through the ot plan, P_j = P_ij / b_j
+
+    :param p: not used, the cost order is the one of the solver
+    """
     # here we assume batch_sz = 1
-    from robot.metrics.reg_losses import GeomDistance
-    from pykeops.torch import LazyTensor
+    from robot.utils.sinkhorn_utils import sinkhorn_engine
 
-    geom_obj = gemloss_setting["geom_obj"].replace(")", ",potentials=True)")
-    blur_arg_filtered = filter(lambda x: "blur" in x, geom_obj.split(","))
-    blur = eval(list(blur_arg_filtered)[0].replace("blur", "").replace("=", ""))
-    geomloss = obj_factory(geom_obj)
+    solver = sinkhorn_engine(gemloss_setting["geom_obj"])
     attr = gemloss_setting[("attr", "points", "attribute used to compute the loss")]
     attr1 = getattr(source, attr)
     attr2 = getattr(target, attr)
     weight1 = source.weights[:, :, 0]  # remove the last dim
     weight2 = target.weights[:, :, 0]  # remove the last dim
-    F_i, G_j = geomloss(
-        weight1, attr1, weight2, attr2
-    )  # todo batch sz of input and output in geomloss is not consistent
-
-    N, M, D = source.points.shape[1], target.points.shape[1], source.points.shape[2]
-    a_i, x_i = LazyTensor(source.weights.view(N, 1, 1)), LazyTensor(
-        attr1.view(N, 1, -1)
-    )
-    b_j, y_j = LazyTensor(target.weights.view(1, M, 1)), LazyTensor(
-        attr2.view(1, M, -1)
-    )
-    F_i, G_j = LazyTensor(F_i.view(N, 1, 1)), LazyTensor(G_j.view(1, M, 1))
-    C_ij = (1 / p) * ((x_i - y_j) ** p).sum(-1)  # (N,M,1) cost matrix
-    eps = blur ** p  # temperature epsilon
-    P_j = ((F_i + G_j - C_ij) / eps).exp() * (a_i)  # (N,M,1) transport plan
+    # the plan is reduced over the source, work on the transposed plan P^T_ji
+    result = solver.solve(weight1, attr1, weight2, attr2).transpose()
+    N = source.points.shape[1]
+    fea_to_map = fea_to_map.view(1, N, -1)
     if mode == "soft":
-        fea_to_map = LazyTensor(fea_to_map.view(N, 1, -1))  # Nx1xfea_dim
-        mapped_fea = (P_j * fea_to_map).sum_reduction(0)  # (N,M,fea_dim)-> (M,fea_dim)
+        mapped_fea = result.apply(fea_to_map)[0] / weight2[0, :, None]  # (M,fea_dim)
     elif mode == "hard":
-        P_j_max, P_j_index = P_j.max_argmax(0)
-        mapped_fea = fea_to_map[P_j_index][:, 0]
-        below_thre_index = (P_j_max < confid)[:, 0]
-        mapped_fea[below_thre_index] = 0
+        P_j_index = result.fused_map(fea_to_map)[2][0]  # argmax over N, (M,)
+        cost = (attr2[0] - attr1[0, P_j_index]).norm(dim=-1) ** result.p / result.p
+        P_j_max = weight1[0, P_j_index] * (
+            (result.g[0, P_j_index] + result.f[0] - cost) / result.eps
+        ).exp()
+        mapped_fea = fea_to_map[0, P_j_index]
+        mapped_fea[P_j_max < confid] = 0
     elif mode == "prob":
-        # P_j_max, P_j_index = P_j.max_argmax(0)
-        # mapped_fea = P_j_max
-        mapped_fea = P_j.sum_reduction(0)
+        mapped_fea = (result.marginals()[0][0] / weight2[0])[:, None]
     else:
         raise ValueError("mode {} not defined, support: soft/ hard/ prob".format(mode))
     return mapped_fea
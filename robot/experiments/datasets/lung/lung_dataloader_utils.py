@@ -8,8 +8,8 @@ from random import Random
 from robot.datasets.vtk_utils import read_vtk
 import numpy as np
 import torch
-from torch_scatter import scatter
-from robot.shape.point_sampler import grid_sampler, uniform_sampler
+from robot.shape.point_sampler import uniform_sampler
+from robot.shape.voxel_utils import voxel_downsample
 from robot.shape.shape_utils import get_scale_and_center
 from robot.datasets.data_utils import compute_interval, get_obj
 from robot.experiments.datasets.lung.lung_data_analysis import matching_np_radius
@@ -106,11 +106,10 @@ def lung_sampler(method="uniform", sampled_by_weight=True, **args):
             points = torch.Tensor(data_dict["points"])
             weights = torch.Tensor(data_dict["weights"])
             pointfea = torch.Tensor(data_dict["pointfea"])
-            sampler = grid_sampler(scale)
-            points, cluster_weights, index = sampler(points, weights)
             # here we assume the pointfea is summable
-            pointfea = scatter(pointfea * weights, index, dim=0)
-            pointfea = pointfea / cluster_weights
+            points, cluster_weights, (pointfea,), _, index = voxel_downsample(
+                points, scale, weights, [pointfea]
+            )
             # otherwise random sample one from each voxel grid
             # todo complete random sample code by unique sampling from index
             data_dict["points"] = points.numpy()
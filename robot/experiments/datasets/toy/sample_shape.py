@@ -2,7 +2,6 @@ import os
 from robot.datasets.vtk_utils import read_vtk
 import numpy as np
 import torch
-from torch_scatter import scatter
 from robot.shape.point_sampler import grid_sampler, uniform_sampler
 from robot.utils.visualizer import visualize_point_fea, visualize_point_pair_overlap
 from robot.utils.shape_visual_utils import make_sphere
@@ -1,6 +1,7 @@
 import numpy as np
 import torch
 from pykeops.torch import Vi, Vj, Pm, LazyTensor
+from robot.utils.profiler import profile_span
 
 ##################  Lazy Tensor  #######################
 
@@ -256,6 +257,7 @@ class LazyKeopsKernel(object):
 
         return conv
 
+    @profile_span("kernel_reduction")
     def __call__(self, *data_args):
         return self.kernel(*data_args)
 
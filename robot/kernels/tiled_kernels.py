@@ -0,0 +1,409 @@
+import numpy as np
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+def tiled_reduction(block_fn, row_args, col_args, tile_size=2048, checkpointed=True):
+    """
+    sum reduction over the column axis, computed in fixed size tiles over N and M,
+    the block function only ever sees a tile_size x tile_size block,
+    if checkpointed, the activations of each block are recomputed in backward instead of being stored
+
+    :param block_fn: function(*row_tiles, *col_tiles), return torch.Tensor, BxTxd
+    :param row_args: list of torch.Tensor, BxNx*
+    :param col_args: list of torch.Tensor, BxMx*
+    :param tile_size: int, tile size over both N and M
+    :param checkpointed: bool, recompute the block in backward
+    :return: torch.Tensor, BxNxd
+    """
+    N, M = row_args[0].shape[1], col_args[0].shape[1]
+    checkpointed = checkpointed and _requires_grad(row_args + col_args)
+    output_list = []
+    for i in range(0, N, tile_size):
+        row_tiles = [arg[:, i : i + tile_size] for arg in row_args]
+        output = 0.0
+        for j in range(0, M, tile_size):
+            col_tiles = [arg[:, j : j + tile_size] for arg in col_args]
+            output = output + _call_block(
+                block_fn, row_tiles + col_tiles, checkpointed
+            )
+        output_list.append(output)
+    return torch.cat(output_list, 1)
+
+
+def tiled_softmax_reduction(
+    logit_fn, row_args, col_args, b, tile_size=2048, checkpointed=True
+):
+    """
+    softmax weighted sum over the column axis, sum_j softmax_j(logit_ij) b_j,
+    computed in fixed size tiles with a streaming log-sum-exp, the full BxNxM logit is never built
+
+    :param logit_fn: function(*row_tiles, *col_tiles), return torch.Tensor, BxTxS logit
+    :param row_args: list of torch.Tensor, BxNx*
+    :param col_args: list of torch.Tensor, BxMx*
+    :param b: torch.Tensor, BxMxd, input val
+    :param tile_size: int, tile size over both N and M
+    :param checkpointed: bool, recompute the block in backward
+    :return: torch.Tensor, BxNxd
+    """
+    N, M = row_args[0].shape[1], col_args[0].shape[1]
+    checkpointed = checkpointed and _requires_grad(row_args + col_args + [b])
+
+    def block_fn(*args):
+        logit = logit_fn(*args[:-1])  # BxTxS
+        b_tile = args[-1]
+        log_max = logit.max(2, keepdim=True)[0].detach()  # BxTx1
+        prob = (logit - log_max).exp()
+        return log_max, prob.sum(2, keepdim=True), prob @ b_tile
+
+    output_list = []
+    for i in range(0, N, tile_size):
+        row_tiles = [arg[:, i : i + tile_size] for arg in row_args]
+        log_max, normalizer, output = None, None, None
+        for j in range(0, M, tile_size):
+            col_tiles = [arg[:, j : j + tile_size] for arg in col_args]
+            _log_max, _normalizer, _output = _call_block(
+                block_fn, row_tiles + col_tiles + [b[:, j : j + tile_size]], checkpointed
+            )
+            if log_max is None:
+                log_max, normalizer, output = _log_max, _normalizer, _output
+                continue
+            new_log_max = torch.max(log_max, _log_max)
+            prev_scale, cur_scale = (
+                (log_max - new_log_max).exp(),
+                (_log_max - new_log_max).exp(),
+            )
+            normalizer = normalizer * prev_scale + _normalizer * cur_scale
+            output = output * prev_scale + _output * cur_scale
+            log_max = new_log_max
+        output_list.append(output / normalizer)
+    return torch.cat(output_list, 1)
+
+
+def tiled_softmax_topk_reduction(
+    logit_fn, row_args, col_args, b, K=1, tile_size=2048, checkpointed=True
+):
+    """
+    one sweep over the logit that returns, for each row, the log-sum-exp, the softmax weighted sum of b
+    and the top-K columns, computed in fixed size tiles as tiled_softmax_reduction
+
+    :param logit_fn: function(*row_tiles, *col_tiles), return torch.Tensor, BxTxS logit
+    :param row_args: list of torch.Tensor, BxNx*
+    :param col_args: list of torch.Tensor, BxMx*
+    :param b: torch.Tensor, BxMxd, input val
+    :param K: int, number of the largest logit to track
+    :param tile_size: int, tile size over both N and M
+    :param checkpointed: bool, recompute the block in backward
+    :return: torch.Tensor, BxN log sum_j exp(logit_ij), torch.Tensor, BxNxd sum_j softmax_j(logit_ij) b_j,
+        torch.LongTensor, BxNxK column index of the K largest logit (descending)
+    """
+    N, M = row_args[0].shape[1], col_args[0].shape[1]
+    checkpointed = checkpointed and _requires_grad(row_args + col_args + [b])
+
+    def block_fn(*args):
+        logit = logit_fn(*args[:-1])  # BxTxS
+        b_tile = args[-1]
+        log_max = logit.max(2, keepdim=True)[0].detach()  # BxTx1
+        prob = (logit - log_max).exp()
+        topk_logit, topk_index = logit.detach().topk(min(K, logit.shape[2]), dim=2)
+        return log_max, prob.sum(2, keepdim=True), prob @ b_tile, topk_logit, topk_index
+
+    log_normalizer_list, output_list, topk_list = [], [], []
+    for i in range(0, N, tile_size):
+        row_tiles = [arg[:, i : i + tile_size] for arg in row_args]
+        log_max, normalizer, output, topk_logit, topk_index = [None] * 5
+        for j in range(0, M, tile_size):
+            col_tiles = [arg[:, j : j + tile_size] for arg in col_args]
+            _log_max, _normalizer, _output, _topk_logit, _topk_index = _call_block(
+                block_fn, row_tiles + col_tiles + [b[:, j : j + tile_size]], checkpointed
+            )
+            _topk_index = _topk_index + j
+            if log_max is None:
+                log_max, normalizer, output = _log_max, _normalizer, _output
+                topk_logit, topk_index = _topk_logit, _topk_index
+                continue
+            new_log_max = torch.max(log_max, _log_max)
+            prev_scale, cur_scale = (
+                (log_max - new_log_max).exp(),
+                (_log_max - new_log_max).exp(),
+            )
+            normalizer = normalizer * prev_scale + _normalizer * cur_scale
+            output = output * prev_scale + _output * cur_scale
+            log_max = new_log_max
+            topk_logit, order = torch.cat([topk_logit, _topk_logit], 2).topk(
+                min(K, topk_logit.shape[2] + _topk_logit.shape[2]), dim=2
+            )
+            topk_index = torch.cat([topk_index, _topk_index], 2).gather(2, order)
+        log_normalizer_list.append((log_max + normalizer.log())[..., 0])
+        output_list.append(output / normalizer)
+        topk_list.append(topk_index)
+    return (
+        torch.cat(log_normalizer_list, 1),
+        torch.cat(output_list, 1),
+        torch.cat(topk_list, 1),
+    )
+
+
+def _requires_grad(tensors):
+    return torch.is_grad_enabled() and any(
+        tensor.requires_grad for tensor in tensors
+    )
+
+
+def _call_block(block_fn, args, checkpointed):
+    if checkpointed:
+        return checkpoint(block_fn, *args, use_reentrant=False)
+    return block_fn(*args)
+
+
+def _sqdist(x, y):
+    """
+    :param x: torch.Tensor, BxTxD
+    :param y: torch.Tensor, BxSxD
+    :return: torch.Tensor, BxTxS
+    """
+    return ((x[:, :, None] - y[:, None]) ** 2).sum(-1)
+
+
+class TiledTorchKernel(object):
+    """
+    Pure torch kernel,  support batch
+    the reductions are computed block by block over N and M so the memory is bounded by tile_size^2,
+    it works on both cpu (multi-thread via torch intra-op parallelism) and gpu, no compilation is needed
+    """
+
+    def __init__(
+        self, kernel_type="gauss", tile_size=2048, checkpointed=True, **kernel_args
+    ):
+        assert kernel_type in [
+            "gauss",
+            "multi_gauss",
+            "normalized_gauss",
+            "normalized_multi_gauss",
+            "gauss_grad",
+            "multi_gauss_grad",
+            "gauss_lin",
+        ]
+        self.kernel_type = kernel_type
+        self.tile_size = tile_size
+        self.checkpointed = checkpointed
+        self.kernels = {
+            "gauss": self.gauss_kernel,
+            "normalized_gauss": self.normalized_gauss_kernel,
+            "multi_gauss": self.multi_gauss_kernel,
+            "normalized_multi_gauss": self.normalized_multi_gauss_kernel,
+            "gauss_grad": self.gaussian_gradient,
+            "multi_gauss_grad": self.multi_gaussian_gradient,
+            "gauss_lin": self.gauss_lin_kernel,
+        }
+        self.kernel = self.kernels[self.kernel_type](**kernel_args)
+
+    def _reduce(self, block_fn, row_args, col_args):
+        return tiled_reduction(
+            block_fn, row_args, col_args, self.tile_size, self.checkpointed
+        )
+
+    def _softmax_reduce(self, logit_fn, row_args, col_args, b):
+        return tiled_softmax_reduction(
+            logit_fn, row_args, col_args, b, self.tile_size, self.checkpointed
+        )
+
+    def gauss_kernel(self, sigma=0.1):
+        """
+        :param sigma: scalar
+        :return:
+        """
+        sig2 = sigma * (2 ** (1 / 2))
+
+        def block(x, y, b):
+            kernel = (-_sqdist(x / sig2, y / sig2)).exp()  # BxTxS
+            return kernel @ b
+
+        def reduce(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return: torch.Tensor, BxNxd, output
+            """
+            return self._reduce(block, [x], [y, b])
+
+        return reduce
+
+    def normalized_gauss_kernel(self, sigma=0.1):
+        """
+        :param sigma: scalar
+        :return:
+        """
+        sig2 = sigma * (2 ** (1 / 2))
+
+        def logit(x, y):
+            return -_sqdist(x / sig2, y / sig2)
+
+        def reduce(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return: torch.Tensor, BxNxd, output
+            """
+            return self._softmax_reduce(logit, [x], [y], b)
+
+        return reduce
+
+    def multi_gauss_kernel(self, sigma_list=None, weight_list=None):
+        """
+        :param sigma_list: a list of sigma
+        :param weight_list: corresponding list of weight, sum(weight_list)=1
+        :return:
+        """
+        gamma_list = [1 / (2 * sigma * sigma) for sigma in sigma_list]
+
+        def block(x, y, b):
+            dist2 = _sqdist(x, y)  # BxTxS
+            kernel = 0.0
+            for gamma, weight in zip(gamma_list, weight_list):
+                kernel = kernel + (-dist2 * gamma).exp() * weight
+            return kernel @ b
+
+        def reduce(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return: torch.Tensor, BxNxd, output
+            """
+            return self._reduce(block, [x], [y, b])
+
+        return reduce
+
+    def normalized_multi_gauss_kernel(self, sigma_list=None, weight_list=None):
+        """
+        :param sigma_list: a list of sigma
+        :param weight_list: corresponding list of weight, sum(weight_list)=1
+        :return:
+        """
+
+        def reduce(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return: torch.Tensor, BxNxd, output
+            """
+            D = x.shape[-1]
+            res = 0.0
+            for sigma, weight in zip(sigma_list, weight_list):
+                sig2 = sigma * (2 ** (1 / D))
+                logit = lambda _x, _y, sig2=sig2: -_sqdist(_x / sig2, _y / sig2)
+                res = res + weight * self._softmax_reduce(logit, [x], [y], b)
+            return res
+
+        return reduce
+
+    def gaussian_gradient(self, sigma=0.1):
+        def block(px, x, py, y):
+            diff = x[:, :, None] / sigma - y[:, None] / sigma  # BxTxSxD
+            kernel = (-(diff ** 2).sum(-1) * 0.5).exp()  # BxTxS
+            pyx = px @ py.transpose(2, 1)  # BxTxS
+            return ((kernel * pyx)[..., None] * diff).sum(2)
+
+        def reduce(px, x, py=None, y=None):
+            """
+            :param px: torch.Tensor, BxNxD,  input val1
+            :param x: torch.Tensor, BxNxD, input position1
+            :param py: torch.Tensor, BxMxD input val2
+            :param y: torch.Tensor, BxMxD, input position2
+            :return: torch.Tensor, BxNxD, output
+            """
+            if y is None:
+                y = x
+            if py is None:
+                py = px
+            return (-1 / sigma) * self._reduce(block, [px, x], [py, y])
+
+        return reduce
+
+    def multi_gaussian_gradient(self, sigma_list=None, weight_list=None):
+        """
+        :param sigma_list: a list of sigma
+        :param weight_list: corresponding list of weight, sum(weight_list)=1
+        :return:
+        """
+        gamma_list = [1 / (2 * sigma * sigma) for sigma in sigma_list]
+
+        def block(px, x, py, y):
+            diff = x[:, :, None] - y[:, None]  # BxTxSxD
+            dist2 = (diff ** 2).sum(-1)  # BxTxS
+            kernel = 0.0
+            for gamma, weight in zip(gamma_list, weight_list):
+                kernel = kernel + (-dist2 * gamma).exp() * gamma * weight
+            pyx = px @ py.transpose(2, 1)  # BxTxS
+            return ((kernel * pyx)[..., None] * diff).sum(2)
+
+        def reduce(px, x, py=None, y=None):
+            """
+            :param px: torch.Tensor, BxNxD,  input val1
+            :param x: torch.Tensor, BxNxD, input position1
+            :param py: torch.Tensor, BxMxD input val2
+            :param y: torch.Tensor, BxMxD, input position2
+            :return: torch.Tensor, BxNxD, output
+            """
+            if y is None:
+                y = x
+            if py is None:
+                py = px
+            return (-2) * self._reduce(block, [px, x], [py, y])
+
+        return reduce
+
+    def gauss_lin_kernel(self, sigma=0.1):
+        """
+        :param sigma: scalar
+        :return:
+        """
+        sig2 = sigma * (2 ** (1 / 2))
+
+        def block(x, u, y, v, b):
+            kernel = (-_sqdist(x / sig2, y / sig2)).exp() * (
+                (u @ v.transpose(2, 1)) ** 2
+            )  # BxTxS
+            return kernel @ b
+
+        def reduce(x, y, u, v, b):
+            """
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param u: torch.Tensor, BxNxD, input val1
+            :param v: torch.Tensor, BxMxD, input val2
+            :param b: torch.Tensor, BxMxd, input scalar vector
+            :return: torch.Tensor, BxNxd, output
+            """
+            return self._reduce(block, [x, u], [y, v, b])
+
+        return reduce
+
+    def __call__(self, *data_args):
+        return self.kernel(*data_args)
+
+
+if __name__ == "__main__":
+    from robot.kernels.torch_kernels import TorchKernel
+
+    batch_sz = 2
+    x = torch.rand(batch_sz, 1500, 3)
+    b = torch.rand(batch_sz, 1500, 2)
+    kernel1 = TiledTorchKernel(
+        "multi_gauss",
+        tile_size=512,
+        sigma_list=[0.1, 0.2, 0.3],
+        weight_list=[0.2, 0.3, 0.5],
+    )
+    kernel2 = TorchKernel(
+        "multi_gauss", sigma_list=[0.1, 0.2, 0.3], weight_list=[0.2, 0.3, 0.5]
+    )
+    print(np.abs((kernel1(x, x, b) - kernel2(x, x, b)).numpy()).max())
@@ -6,23 +6,26 @@ import torch
 from pykeops.torch import LazyTensor
 from robot.kernels.keops_kernels import LazyKeopsKernel
 from robot.kernels.torch_kernels import TorchKernel
+from robot.kernels.tiled_kernels import TiledTorchKernel
 from robot.modules_reg.networks.pointconv_util import index_points_group
 from robot.utils.obj_factory import obj_factory
 from robot.global_variable import Shape
 from robot.utils.utils import sigmoid_decay
+from robot.utils.profiler import profile_span
 
 
 class CurrentDistance(object):
     def __init__(self, opt):
         kernel_backend = opt[
-            ("kernel_backend", "torch", "kernel backend can either be 'torch'/'keops'")
+            ("kernel_backend", "torch", "kernel backend can be 'torch'/'keops'/'tiled'")
         ]
         sigma = opt[("sigma", 0.1, "the sigma in gaussian kernel")]
-        self.kernel = (
-            LazyKeopsKernel("gauss", sigma=sigma)
-            if kernel_backend == "keops"
-            else TorchKernel("gauss", sigma=sigma)
-        )
+        if kernel_backend == "keops":
+            self.kernel = LazyKeopsKernel("gauss", sigma=sigma)
+        elif kernel_backend == "tiled":
+            self.kernel = TiledTorchKernel("gauss", sigma=sigma)
+        else:
+            self.kernel = TorchKernel("gauss", sigma=sigma)
 
     def __call__(self, flowed, target):
         assert flowed.type == "PolyLine"
@@ -47,14 +50,15 @@ class CurrentDistance(object):
 class VarifoldDistance(object):
     def __init__(self, opt):
         kernel_backend = opt[
-            ("kernel_backend", "torch", "kernel backend can either be 'torch'/'keops'")
+            ("kernel_backend", "torch", "kernel backend can be 'torch'/'keops'/'tiled'")
         ]
         sigma = opt[("sigma", 0.1, "the sigma in gaussian lin kernel")]
-        self.kernel = (
-            LazyKeopsKernel("gauss_lin", sigma=sigma)
-            if kernel_backend == "keops"
-            else TorchKernel("gauss_lin", sigma=sigma)
-        )
+        if kernel_backend == "keops":
+            self.kernel = LazyKeopsKernel("gauss_lin", sigma=sigma)
+        elif kernel_backend == "tiled":
+            self.kernel = TiledTorchKernel("gauss_lin", sigma=sigma)
+        else:
+            self.kernel = TorchKernel("gauss_lin", sigma=sigma)
 
     def __call__(self, flowed, target, epoch=None):
         assert flowed.type == "SurfaceMesh"
@@ -224,7 +228,7 @@ class GMMLoss:
 
 
 class GeomDistance(object):
-    def __init__(self, opt):
+    def __init__(self, opt, ot_solvers=None):
         self.attr = opt[
             (
                 "attr",
@@ -239,14 +243,44 @@ class GeomDistance(object):
                 "blur argument in ot",
             )
         ]
-        self.gemoloss = obj_factory(geom_obj)
+        # the solver of the model's OTSolverCache is kept across the iterations and reset with the model
+        self.gemoloss = (
+            ot_solvers.get(geom_obj) if ot_solvers is not None else obj_factory(geom_obj)
+        )
 
+    def reset(self):
+        if hasattr(self.gemoloss, "reset"):
+            self.gemoloss.reset()
+
+    @staticmethod
+    def mask_padding(shape, attr, weights):
+        """
+        the padded points are moved onto the first point of their set, so they do not enlarge the diameter
+        estimated by the solver, and their weights are set to zero
+
+        :param shape: Shape with lengths
+        :param attr: BxNxD
+        :param weights: BxN
+        :return: BxNxD, BxN
+        """
+        if shape.lengths is None:
+            return attr, weights
+        lengths = shape.get_lengths().to(attr.device)
+        valid = torch.arange(attr.shape[1], device=attr.device)[None] < lengths[:, None]
+        attr = torch.where(valid[..., None], attr, attr[:, :1])
+        return attr, weights * valid
+
+    @profile_span("ot_loss")
     def __call__(self, flowed, target, epoch=None):
         attr1 = getattr(flowed, self.attr)
         attr2 = getattr(target, self.attr)
         weight1 = flowed.weights[:, :, 0]  # remove the last dim
         weight2 = target.weights[:, :, 0]  # remove the last dim
         grad_enable_record = torch.is_grad_enabled()
+        if flowed.lengths is not None or target.lengths is not None:
+            # padded sets are solved in one batch, the padded points carry zero weight
+            attr1, weight1 = self.mask_padding(flowed, attr1, weight1)
+            attr2, weight2 = self.mask_padding(target, attr2, weight2)
         loss = self.gemoloss(weight1, attr1, weight2, attr2)
         torch.set_grad_enabled(grad_enable_record)
         return loss
@@ -11,6 +11,8 @@ from robot.modules_reg.module_gradient_flow import (
     gradient_flow_guide,
     wasserstein_barycenter_mapping,
 )
+from robot.utils.profiler import profile_span
+from robot.utils.sinkhorn_utils import OTSolverCache
 
 
 class DiscreteFlowOPT(nn.Module):
@@ -110,6 +112,8 @@ class DiscreteFlowOPT(nn.Module):
             else None
         )
         self.drift_buffer = {}
+        self.nn_search = None
+        self.ot_solvers = OTSolverCache()
         if self.gradient_flow_mode:
             print("in gradient flow mode, points drift every iteration")
             self.drift_every_n_iter = 1
@@ -127,6 +131,8 @@ class DiscreteFlowOPT(nn.Module):
         self.local_iter = self.local_iter * 0
         self.global_iter = self.global_iter * 0
         self.drift_buffer = {}
+        self.nn_search = None
+        self.ot_solvers.reset()
 
     def flow(self, shape_pair):
         """
@@ -323,6 +329,7 @@ class DiscreteFlowOPT(nn.Module):
         target.pointfea = target.points
         return flowed, target
 
+    @profile_span("feature_extraction")
     def extract_fea(self, flowed, target):
         """DiscreteFlowOPT supports feature extraction"""
         if not self.pair_feature_extractor:
@@ -388,7 +395,18 @@ class DiscreteFlowOPT(nn.Module):
             ("post_kernel_obj", "", "shape interpolator")
         ]
         post_kernel = obj_factory(post_kernel_obj) if post_kernel_obj else None
-        nn_points,_ = NN(return_value=False, return_pos=True)(flowed.points, target.points)
+        incremental_knn = nn_guided_opt[
+            (
+                "incremental_knn",
+                False,
+                "reuse the nearest neighbors of the last iteration for the points that only move slightly",
+            )
+        ]
+        if self.nn_search is None:
+            self.nn_search = NN(
+                return_value=False, return_pos=True, incremental=incremental_knn
+            )
+        nn_points, _ = self.nn_search(flowed.points, target.points)
         nnflowed = Shape().set_data_with_refer_to(nn_points, flowed)
         if post_kernel is not None:
             disp = nnflowed.points - flowed.points
@@ -498,7 +516,7 @@ class DiscreteFlowOPT(nn.Module):
             pair_shape_transformer = obj_factory(pair_shape_transformer_obj)
             flowed, target = pair_shape_transformer(flowed, target, self.local_iter)
         gradflowed, weight_map_ratio = guide_fn(
-            flowed, target, geomloss_setting, self.local_iter
+            flowed, target, geomloss_setting, self.local_iter, self.ot_solvers
         )
         gradflowed.points = gradflowed.points.detach()
         if post_kernel is not None:
@@ -9,6 +9,9 @@ from robot.modules_reg.module_gradient_flow import wasserstein_barycenter_mappin
 from robot.modules_reg.opt_flowed_eval import opt_flow_model_eval
 from robot.utils.obj_factory import obj_factory
 from torch.autograd import grad
+from robot.utils.profiler import profile_span
+from robot.utils.sinkhorn_utils import OTSolverCache
+from robot.shape.point_pyramid import update_points_from_parent
 
 # from pytorch_memlab import profile
 
@@ -34,7 +37,8 @@ class GradientFlowOPT(nn.Module):
         ]
         self.interp_kernel = obj_factory(interpolator_obj)
         assert self.opt["sim_loss"]["loss_list"] == ["geomloss"]
-        self.sim_loss_fn = GeomDistance(self.opt["sim_loss"]["geomloss"])
+        self.ot_solvers = OTSolverCache()
+        self.sim_loss_fn = GeomDistance(self.opt["sim_loss"]["geomloss"], self.ot_solvers)
         self.geom_loss_opt_for_eval = opt[
             (
                 "geom_loss_opt_for_eval",
@@ -65,6 +69,7 @@ class GradientFlowOPT(nn.Module):
 
     def clean(self):
         self.iter = self.iter * 0
+        self.ot_solvers.reset()
 
     def flow(self, shape_pair):
         flowed_control_points = shape_pair.flowed_control_points
@@ -92,8 +97,17 @@ class GradientFlowOPT(nn.Module):
         reg_param_high.detach_()
         reg_param_high.requires_grad_()
         shape_pair_high.set_reg_param(reg_param_high)
+        # the reg_param is the flowed control points, the pair can be flowed without an optimization step
+        shape_pair_high.set_flowed_control_points(reg_param_high.detach())
         return shape_pair_high
 
+    def update_reg_param_from_parent(
+        self, shape_pair_low, shape_pair_high, source_pyramid, level
+    ):
+        return update_points_from_parent(
+            shape_pair_low, shape_pair_high, source_pyramid, level
+        )
+
     def init_reg_param(self, shape_pair):
         reg_param = shape_pair.get_control_points().clone().detach()
         reg_param.requires_grad_()
@@ -104,6 +118,7 @@ class GradientFlowOPT(nn.Module):
         target.pointfea = target.points
         return flowed, target
 
+    @profile_span("feature_extraction")
     def extract_fea(self, flowed, target):
         """todo disabled, Gradient Flow doesn't support feature extraction"""
         return self.extract_point_fea(flowed, target)
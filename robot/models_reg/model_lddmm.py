@@ -9,6 +9,8 @@ from robot.modules_reg.ode_int import ODEBlock
 from robot.modules_reg.opt_flowed_eval import opt_flow_model_eval
 from robot.utils.utils import sigmoid_decay
 from robot.utils.obj_factory import obj_factory
+from robot.utils.profiler import profile_span
+from robot.utils.sinkhorn_utils import OTSolverCache
 
 
 class LDDMMOPT(nn.Module):
@@ -54,6 +56,7 @@ class LDDMMOPT(nn.Module):
         sim_loss_opt = opt[("sim_loss", {}, "settings for sim_loss_opt")]
         self.sim_loss_fn = Loss(sim_loss_opt)
         self.reg_loss_fn = self.geodesic_distance
+        self.ot_solvers = OTSolverCache()
         self.integrator_opt = self.opt[("integrator", {}, "settings for integrator")]
         self.integrator = ODEBlock(self.integrator_opt)
         self.integrator.set_func(self.lddmm_module)
@@ -112,6 +115,7 @@ class LDDMMOPT(nn.Module):
         self.local_iter = self.local_iter * 0
         self.global_iter = self.global_iter * 0
         self.gradflow_guided_buffer = {}
+        self.ot_solvers.reset()
 
     def shooting(self, shape_pair):
         momentum = shape_pair.reg_param
@@ -224,6 +228,25 @@ class LDDMMOPT(nn.Module):
         shape_pair_high.set_reg_param(reg_param_high)
         return shape_pair_high
 
+    def update_reg_param_from_parent(
+        self, shape_pair_low, shape_pair_high, source_pyramid, level
+    ):
+        """
+        the momentum of each parent is split among its children by their weight fraction,
+        so the total momentum is preserved
+
+        :param source_pyramid: PointPyramid of the source, shape_pair_low is on its level, shape_pair_high on level+1
+        :param level: pyramid level of shape_pair_low
+        """
+        shape_pair_high.get_control_points()  # the dense control points are initialized from the source
+        reg_param_high = (
+            source_pyramid.prolongate(shape_pair_low.reg_param, level)
+            * source_pyramid.weight_ratio(level)
+        ).detach()
+        reg_param_high.requires_grad_()
+        shape_pair_high.set_reg_param(reg_param_high)
+        return shape_pair_high
+
     def wasserstein_gradient_flow_guidence(self, flowed, target):
         """
         wassersten gradient flow has a reasonable behavior only when set self.pair_feature_extractor = None
@@ -323,7 +346,9 @@ class LDDMMOPT(nn.Module):
             geomloss_setting["mode"] = "soft"
             geomloss_setting["attr"] = "pointfea"
             guide_fn = gradient_flow_guide(gradflow_mode)
-            gradflowed, _ = guide_fn(flowed, target, geomloss_setting, self.local_iter)
+            gradflowed, _ = guide_fn(
+                flowed, target, geomloss_setting, self.local_iter, self.ot_solvers
+            )
             if post_kernel_obj is not None:
                 disp = gradflowed.points - flowed.points
                 flowed_points = flowed.points
@@ -341,6 +366,7 @@ class LDDMMOPT(nn.Module):
         target.pointfea = target.points
         return flowed, target
 
+    @profile_span("feature_extraction")
     def extract_fea(self, flowed, target):
         """LDDMMM support feature extraction"""
         if not self.pair_feature_extractor:
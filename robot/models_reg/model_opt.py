@@ -257,19 +257,28 @@ class OptModel(ModelBase):
                 shape_pair, self.batch_info["pair_name"], self._model, self.record_path
             )
         if cache_res:
-            if len(self.caches) == 0:
-                self.caches.update(eval_metrics)
-                self.caches.update({"pair_name": self.batch_info["pair_name"]})
-            else:
-                for metric in eval_metrics:
-                    self.caches[metric] += eval_metrics[metric]
-                self.caches["pair_name"] += self.batch_info["pair_name"]
+            self.cache_res(eval_metrics, self.batch_info["pair_name"])
 
         if len(eval_metrics):
             return np.array(eval_metrics["score"]).mean(), eval_metrics
         else:
             return -1, np.array([-1])
 
+    def cache_res(self, eval_metrics, pair_name):
+        """
+        :param eval_metrics: {metric: list of the batch scores}
+        :param pair_name: list of the batch pair names
+        """
+        if len(self.caches) == 0:
+            self.caches.update(
+                {metric: list(score) for metric, score in eval_metrics.items()}
+            )
+            self.caches.update({"pair_name": list(pair_name)})
+        else:
+            for metric in eval_metrics:
+                self.caches[metric] += list(eval_metrics[metric])
+            self.caches["pair_name"] += list(pair_name)
+
     def get_extra_to_plot(self):
         """
         extra image to be visualized
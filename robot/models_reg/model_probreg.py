@@ -5,6 +5,7 @@ from robot.global_variable import Shape
 from robot.modules_reg.opt_flowed_eval import opt_flow_model_eval
 from robot.modules_reg.module_probreg import ProbReg
 from robot.utils.obj_factory import obj_factory
+from robot.shape.point_pyramid import update_points_from_parent
 
 
 class ProRegOPT(nn.Module):
@@ -98,8 +99,17 @@ class ProRegOPT(nn.Module):
         reg_param_high.detach_()
         reg_param_high.requires_grad_()
         shape_pair_high.set_reg_param(reg_param_high)
+        # the reg_param is the flowed control points, the pair can be flowed without an optimization step
+        shape_pair_high.set_flowed_control_points(reg_param_high.detach())
         return shape_pair_high
 
+    def update_reg_param_from_parent(
+        self, shape_pair_low, shape_pair_high, source_pyramid, level
+    ):
+        return update_points_from_parent(
+            shape_pair_low, shape_pair_high, source_pyramid, level
+        )
+
     def get_factor(self):
         return 1, 1
 
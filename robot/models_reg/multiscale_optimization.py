@@ -4,8 +4,10 @@ from robot.modules_reg.optimizer import optimizer_builder
 from robot.modules_reg.scheduler import scheduler_builder
 from robot.global_variable import SHAPE_SAMPLER_POOL
 from robot.shape.shape_pair_utils import create_shape_pair
+from robot.shape.point_pyramid import PointPyramidCache
 from robot.utils.shape_visual_utils import save_shape_pair_into_files
 from robot.utils.obj_factory import obj_factory
+from robot.utils.profiler import profile_span, profile_context
 
 
 def build_multi_scale_solver(opt, model):
@@ -61,6 +63,17 @@ def build_multi_scale_solver(opt, model):
         if shape_sampler_type == "point_grid"
         else sampler_npoints_list
     )
+    use_point_pyramid = opt[
+        (
+            "use_point_pyramid",
+            False,
+            "for the 'point_grid' sampler, the nested voxel-grid levels are precomputed and cached by the shape content,"
+            " the reg_param is prolongated via the parent indices if the model supports it,"
+            " each level is pooled from the finer one instead of the original points, so the levels may differ slightly",
+        )
+    ]
+    use_point_pyramid = use_point_pyramid and shape_sampler_type == "point_grid"
+    pyramid_cache = PointPyramidCache(max_size=2) if use_point_pyramid else None
     scale_shape_sampler_list = [
         SHAPE_SAMPLER_POOL[shape_sampler_type](scale) for scale in scale_args_list
     ]
@@ -75,6 +88,7 @@ def build_multi_scale_solver(opt, model):
     )
     reg_param_initializer = model.init_reg_param
     param_updater = model.update_reg_param_from_low_scale_to_high_scale
+    parent_param_updater = getattr(model, "update_reg_param_from_parent", None)
     update_shape_pair_after_upsampling = model.flow
     single_scale_solver_list = [
         build_single_scale_solver(
@@ -94,9 +108,31 @@ def build_multi_scale_solver(opt, model):
         )
     )
 
+    def update_param(shape_pair_low, shape_pair_high, source_pyramid, level):
+        """
+        prolongate the reg_param from level to level+1 via the parent indices if the control points
+        are the pyramid points (the source is the pyramid level and the pair is in dense mode),
+        otherwise fall back to the model's interpolation
+        """
+        if (
+            source_pyramid is not None
+            and parent_param_updater is not None
+            and shape_pair_high.source is source_pyramid.level(level + 1)
+            and shape_pair_high.dense_mode
+        ):
+            return parent_param_updater(
+                shape_pair_low, shape_pair_high, source_pyramid, level
+            )
+        return param_updater(shape_pair_low, shape_pair_high)
+
     def solve(shape_pair):
         source, target = shape_pair.source, shape_pair.target
         output_shape_pair = None
+        source_pyramid, target_pyramid = None, None
+        if use_point_pyramid:
+            with profile_span("sampling"):
+                source_pyramid = pyramid_cache.get(source, scale_args_list)
+                target_pyramid = pyramid_cache.get(target, scale_args_list)
         model.clean()
         for i in range(num_scale):
             print(
@@ -104,30 +140,40 @@ def build_multi_scale_solver(opt, model):
                     i, shape_sampler_type, scale_args_list[i]
                 )
             )
-            if scale_args_list[i] > 0:
-                scale_source = scale_shape_sampler_list[i](source)
-                scale_target = scale_shape_sampler_list[i](target)
-                toinput_shape_pair = create_shape_pair(
-                    scale_source, scale_target, pair_name=shape_pair.get_pair_name()
-                )
-            else:
-                toinput_shape_pair = shape_pair
-            reg_param_initializer(toinput_shape_pair)
-            # save_shape_pair_into_files(opt["record_path"], "debugging".format(iter), toinput_shape_pair)
-            if i != 0:
-                toinput_shape_pair = param_updater(
-                    output_shape_pair, toinput_shape_pair
-                )
-                del output_shape_pair
-            output_shape_pair = single_scale_solver_list[i](toinput_shape_pair)
+            with profile_context(scale=scale_args_list[i]):
+                if scale_args_list[i] > 0:
+                    with profile_span("sampling"):
+                        if use_point_pyramid:
+                            scale_source = source_pyramid.level(i)
+                            scale_target = target_pyramid.level(i)
+                        else:
+                            scale_source = scale_shape_sampler_list[i](source)
+                            scale_target = scale_shape_sampler_list[i](target)
+                    toinput_shape_pair = create_shape_pair(
+                        scale_source, scale_target, pair_name=shape_pair.get_pair_name()
+                    )
+                else:
+                    toinput_shape_pair = shape_pair
+                reg_param_initializer(toinput_shape_pair)
+                # save_shape_pair_into_files(opt["record_path"], "debugging".format(iter), toinput_shape_pair)
+                if i != 0:
+                    with profile_span("upsampling"):
+                        toinput_shape_pair = update_param(
+                            output_shape_pair, toinput_shape_pair, source_pyramid, i - 1
+                        )
+                    del output_shape_pair
+                output_shape_pair = single_scale_solver_list[i](toinput_shape_pair)
         if scale_args_list[-1] != -1:
-            output_shape_pair = param_updater(
-                output_shape_pair,
-                create_shape_pair(
-                    source, target, pair_name=output_shape_pair.get_pair_name()
-                ),
-            )
-            output_shape_pair = update_shape_pair_after_upsampling(output_shape_pair)
+            with profile_span("upsampling"):
+                output_shape_pair = update_param(
+                    output_shape_pair,
+                    create_shape_pair(
+                        source, target, pair_name=output_shape_pair.get_pair_name()
+                    ),
+                    source_pyramid,
+                    num_scale - 1,
+                )
+                output_shape_pair = update_shape_pair_after_upsampling(output_shape_pair)
         return output_shape_pair
 
     return solve
@@ -196,8 +242,10 @@ def build_single_scale_general_solver(
 
         def closure():
             optimizer.zero_grad()
-            cur_energy = model(shape_pair)
-            cur_energy.backward()
+            with profile_span("forward"):
+                cur_energy = model(shape_pair)
+            with profile_span("backward"):
+                cur_energy.backward()
             return cur_energy
 
         for iter in range(num_iter):
@@ -298,7 +346,8 @@ def build_single_scale_model_embedded_solver(
         patient_count = 0
         previous_converged_iter = 0.0
         for iter in range(num_iter):
-            cur_energy = model(shape_pair)
+            with profile_span("forward"):
+                cur_energy = model(shape_pair)
             cur_energy = cur_energy.item()
             rel_f = abs(last_energy - cur_energy) / (abs(cur_energy))
             last_energy = cur_energy
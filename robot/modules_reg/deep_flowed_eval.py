@@ -17,7 +17,7 @@ def deep_flow_model_eval(shape_pair, model,buffer, batch_info=None,geom_loss_opt
     source_points = shape_pair.source.points
     if cur_epoch==0:
         print("In the first epoch, the validation/debugging output is the baseline ot mapping")
-        shape_pair.flowed= Shape().set_data_with_refer_to(source_points,shape_pair.source)
+        shape_pair.flowed= shape_pair.source.view(points=source_points)
     if mapping_strategy=="barycenter":
         mapped_target_index,mapped_topK_target_index, mapped_position = wasserstein_barycenter_mapping(shape_pair.flowed, shape_pair.target, geomloss_setting)  # BxN
         wasserstein_dist = torch.Tensor([-1] * shape_pair.nbatch) # todo return distance via wasserstein_barycenter_mapping
@@ -33,7 +33,7 @@ def deep_flow_model_eval(shape_pair, model,buffer, batch_info=None,geom_loss_opt
         smoothed_disp = aniso_post_kernel(flowed_points, flowed_points, disp, shape_pair.flowed.weights)
         mapped_position = flowed_points + smoothed_disp
         for _ in range(1,finetune_iter):
-            cur_flowed = Shape().set_data_with_refer_to(mapped_position, shape_pair.flowed)
+            cur_flowed = shape_pair.flowed.view(points=mapped_position)
             if mapping_strategy != "nn":
                 mapped_target_index, mapped_topK_target_index, mapped_position = wasserstein_barycenter_mapping(
                     cur_flowed, shape_pair.target, geomloss_setting)  # BxN
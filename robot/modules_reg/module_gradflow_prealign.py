@@ -1,9 +1,44 @@
+import itertools
+import numpy as np
 import torch
 import torch.nn as nn
 from robot.global_variable import Shape
 from robot.utils.obj_factory import obj_factory
+from robot.utils.sinkhorn_utils import OTSolverCache
+from robot.utils.procrustes_utils import RobustTransformEstimator, compose_transform
 from robot.modules_reg.module_gradient_flow import gradient_flow_guide
 from robot.shape.point_sampler import point_fps_sampler
+from robot.utils.profiler import profile_span
+
+
+def init_rotation_candidates(D, sampling="cube", n_rotation=64):
+    """
+    :param D: 2 or 3
+    :param sampling: "cube", the rotations that map the cube onto itself, 24 in 3D (4 in 2D);
+        "random", n_rotation rotations, uniformly sampled in SO(3) (evenly spaced angles in 2D)
+    :param n_rotation: number of rotations for the random sampling
+    :return: RxDxD rotation matrices
+    """
+    assert sampling in ["cube", "random"]
+    if sampling == "cube":
+        rotations = []
+        for perm in itertools.permutations(range(D)):
+            for signs in itertools.product([1.0, -1.0], repeat=D):
+                r = np.zeros([D, D])
+                r[range(D), perm] = signs
+                if np.linalg.det(r) > 0:
+                    rotations.append(r)
+        rotations = np.stack(rotations)
+    elif D == 2:
+        angle = np.linspace(0, 2 * np.pi, n_rotation, endpoint=False)
+        rotations = np.stack(
+            [np.cos(angle), -np.sin(angle), np.sin(angle), np.cos(angle)], 1
+        ).reshape(-1, 2, 2)
+    else:
+        from scipy.spatial.transform import Rotation as R
+
+        rotations = R.random(n_rotation, random_state=0).as_matrix()
+    return torch.tensor(rotations.astype(np.float32))
 
 
 class GradFlowPreAlign(nn.Module):
@@ -44,81 +79,35 @@ class GradFlowPreAlign(nn.Module):
             if pair_feature_extractor_obj
             else None
         )
+        self.ot_solvers = OTSolverCache()
         self.get_correspondence_shape = self.solve_correspondence_via_gradflow()
-        self.solver = (
-            self.solve_affine if self.method_name == "affine" else self.solve_rigid
+        self.robust_loss = opt[
+            (
+                "robust_loss",
+                "l2",
+                "l2 / huber / geman_mcclure / truncated, robust loss of the transform fitting, solved by irls",
+            )
+        ]
+        self.robust_scale = opt[
+            ("robust_scale", 0.05, "residual scale of the robust loss")
+        ]
+        self.n_irls_iter = opt[
+            ("n_irls_iter", 10, "max number of reweighting iterations of the robust loss")
+        ]
+        transform_type = (
+            "affine"
+            if self.method_name == "affine"
+            else "similarity"
+            if self.eval_scale_for_rigid
+            else "rigid"
+        )
+        self.solver = RobustTransformEstimator(
+            transform_type, self.robust_loss, self.robust_scale, self.n_irls_iter
         )
 
     def set_mode(self, mode):
         self.prealign = True
 
-    def solve_affine(self,x, y, w):
-        """
-        :param x: BxNxD
-        :param y: BxNxD
-        :param w: BxNx1
-        :return:
-        """
-        # Optimal affine transform: ================================================
-        # A = (X^T  @ diag(w) @ X)^-1   @   (X^T  @ diag(w) @ y)
-        #    (B,D+1,N)  (B,N,N)  (B,N,D+1)       (B,D+1,N)  (B,N,N)  (B,N,D)
-        #
-        #   =        Xt_wX    \      Xt_yw
-        #           (B,D+1,D+1)       (B,D+1, D)
-        # (x, y, z, 1) array to work easily with affine transforms:
-        X = torch.cat((x, torch.ones_like(x[:, :, :1])), dim=2)  # (B,N, D+1)
-
-        Xt_wX = X.transpose(2, 1) @ (w * X)  # (B,D+1, N) @ (B,N, D+1) = (B,D+1, D+1)
-        Xt_wy = X.transpose(2, 1) @ (w * y)  # (B,D+1, N) @ (B,N, D)   = (B,D+1, D)
-
-        # Affine transformation:
-        A = torch.solve(Xt_wy, Xt_wX).solution  # (B,D+1, D)
-        return A, X @ A
-
-    def solve_rigid(self, x, y, w):
-        """
-
-        :param x: BxNxD
-        :param y: BxNxD
-        :param w: BxNx1
-        :return:
-        """
-        B, N, D = x.shape[0], x.shape[1], x.shape[2]
-        device = x.device
-        sum_w = w.sum(1, keepdim=True)
-        mu_x = (x * w).sum(1, keepdim=True) / sum_w
-        mu_y = (y * w).sum(1, keepdim=True) / sum_w
-        x_hat = x - mu_x
-        wx_hat = x_hat * w
-        y_hat = y - mu_y
-        wy_hat = y_hat * w
-        a = wy_hat.transpose(2, 1) @ wx_hat  # BxDxN @ BxNxD  BxDxD
-        u, s, v = torch.svd(a)
-        c = torch.ones(B, D).to(device)
-        c[:, -1] = torch.det(u @ v)  #
-        r = (u * (c[..., None])) @ v.transpose(2, 1)
-        tr_atr = torch.diagonal(a.transpose(2, 1) @ r, dim1=-2, dim2=-1).sum(-1)
-        tr_xtwx = torch.diagonal(wx_hat.transpose(2, 1) @ wx_hat, dim1=-2, dim2=-1).sum(
-            -1
-        )
-        s = (
-            (tr_atr / tr_xtwx)[..., None][..., None]
-            if self.eval_scale_for_rigid
-            else 1.0
-        )
-        t = mu_y - s * (r @ mu_x.transpose(2, 1)).transpose(2, 1)
-        A = torch.cat([r.transpose(2, 1) * s, t], 1)
-        X = torch.cat((x, torch.ones_like(x[:, :, :1])), dim=2)  # (B,N, D+1)
-        return A, X @ A
-
-    def compose_transform(self, A_prev, A_cur):
-        D = A_prev.shape[-1]
-        A_composed_matrix = A_prev[:, :D, :] @ A_cur[:, :D, :]  # BxDxD
-        A_composed_trans = (
-            A_prev[:, D:, :] @ A_cur[:, :D, :] + A_cur[:, D:, :]
-        )  # Bx1XD @ BxDxD   Bx1xD
-        return torch.cat([A_composed_matrix, A_composed_trans], 1)
-
     def solve_correspondence_via_gradflow(self):
         from functools import partial
 
@@ -136,11 +125,36 @@ class GradFlowPreAlign(nn.Module):
                 " the 16(2D)/64(3D) initial transforms (based on position and ot similarity) would be searched and return the best one ",
             )
         ]
+        self.init_rotation_sampling = self.opt[
+            (
+                "init_rotation_sampling",
+                "cube",
+                "the rotations searched for the initial transform, 'cube': the 24(3D)/4(2D) rotations of the cube, 'random': n_init_rotation uniformly sampled rotations",
+            )
+        ]
+        self.n_init_rotation = self.opt[
+            ("n_init_rotation", 64, "number of rotations for the 'random' sampling")
+        ]
+        self.init_search_npoints = self.opt[
+            (
+                "init_search_npoints",
+                1024,
+                "all the rotations are first evaluated on # points sampled from farthest point sampling, -1 to use all the points",
+            )
+        ]
+        self.init_search_topk = self.opt[
+            (
+                "init_search_topk",
+                4,
+                "the top k rotations of the coarse evaluation are evaluated again on all the points",
+            )
+        ]
         self.geomloss_setting = self.opt[("geomloss", {}, "settings for geomloss")]
         return partial(
             gradient_flow_guide(self.gradflow_mode),
             geomloss_setting=self.geomloss_setting,
             local_iter=torch.tensor([0]),
+            ot_solvers=self.ot_solvers,
         )
 
     def _solve_transform(self, source, flowed):
@@ -157,72 +171,76 @@ class GradFlowPreAlign(nn.Module):
         else:
             return self.pair_feature_extractor(flowed, target, iter)
 
+    def _transform_dist(self, source, target, transforms):
+        """
+        the batch x candidate problems are solved as one ot batch
+
+        :param source: Shape with points BxNxD
+        :param target: Shape with points BxMxD
+        :param transforms: BxRx(D+1)xD
+        :return: BxR ot distance between the transformed source and the target, BxRxNxD transformed points
+        """
+        B, R = transforms.shape[:2]
+        N, M, D = source.points.shape[1], target.points.shape[1], source.points.shape[2]
+        X = torch.cat((source.points, torch.ones_like(source.points[:, :, :1])), dim=2)
+        transformed = X[:, None] @ transforms  # Bx1xNx(D+1) @ BxRx(D+1)xD = BxRxNxD
+        geo_dist = self.ot_solvers.get(self.geomloss_setting["geom_obj"])
+        dist = geo_dist(
+            source.weights[:, None, :, 0].expand(B, R, N).reshape(B * R, N),
+            transformed.reshape(B * R, N, D),
+            target.weights[:, None, :, 0].expand(B, R, M).reshape(B * R, M),
+            target.points[:, None].expand(B, R, M, D).reshape(B * R, M, D),
+        )
+        return dist.view(B, R), transformed
+
+    def _coarse_shape(self, shape):
+        if shape.points.shape[1] <= self.init_search_npoints:
+            return shape
+        coarse_shape = point_fps_sampler(self.init_search_npoints)(shape)
+        coarse_shape.set_weights(
+            coarse_shape.weights / coarse_shape.weights.sum(1, keepdim=True)
+        )
+        return coarse_shape
+
     def find_initial_transform(self, source, target):
-        import numpy as np
-        from scipy.spatial.transform import Rotation as R
+        """
+        search the best initial rotation among the candidates (see init_rotation_candidates),
+        all the candidates are evaluated on the fps sampled points, the top ones are then evaluated on all the points
 
-        source_center = source.points.mean(dim=1, keepdim=True)
-        target_center = target.points.mean(dim=1, keepdim=True)
-        max_diameter = lambda x: (x.points.max(1)[0] - x.points.min(1)[0]).max(1)[0]
-        scale = max_diameter(target) / max_diameter(source)
+        :param source: Shape with points BxNxD
+        :param target: Shape with points BxMxD
+        :return: Bx(D+1)xD best initial transform, the transformed source
+        """
+        source_center = source.get_center()
+        target_center = target.get_center()
+        scale = target.get_diameter() / source.get_diameter()
         bias_center = (
             target_center - source_center
         ) / 10  # avoid fail into the identity local minimum
-        D = source.points.shape[-1]
-        n_init = 16 if D == 2 else 64
-        r = None
-        if D == 2:
-            angle_comp = np.mgrid[0:271:90, 0:271:90].transpose(1, 2, 0).reshape(-1, D)
-            r = R.from_euler("yx", angle_comp, degrees=True)
-        elif D == 3:
-            angle_comp = (
-                np.mgrid[0:271:90, 0:271:90, 0:271:90]
-                .transpose(1, 2, 3, 0)
-                .reshape(-1, D)
-            )
-            r = R.from_euler("zyx", angle_comp, degrees=True)
-        init_rotation_matrix = torch.tensor(r.as_matrix().astype(np.float32)).to(
-            source.points.device
-        )
-        init_best_transformed = []
-        init_best_transform = []
-        for i, (
-            b_source_points,
-            b_target_points,
-            b_source_weights,
-            b_target_weights,
-        ) in enumerate(
-            zip(source.points, target.points, source.weights, target.weights)
-        ):
-            b_source_points = b_source_points.repeat(n_init, 1, 1)
-            b_target_points = b_target_points.repeat(n_init, 1, 1)
-            b_source_weights = b_source_weights.repeat(n_init, 1, 1)
-            b_target_weights = b_target_weights.repeat(n_init, 1, 1)
-            b_init_rotation_bias = bias_center[i].repeat(n_init, 1, 1)
-            b_transform = torch.cat(
-                [init_rotation_matrix * scale[i], b_init_rotation_bias], 1
-            )
-            geo_dist = obj_factory(self.geomloss_setting["geom_obj"])
-            b_init_transformed = (
-                torch.cat(
-                    (b_source_points, torch.ones_like(b_source_points[:, :, :1])), dim=2
-                )
-                @ b_transform
-            )
-            bdist = geo_dist(
-                b_source_weights[..., 0],
-                b_init_transformed,
-                b_target_weights[..., 0],
-                b_target_points,
-            )
-            min_val, min_index = bdist.min(0)
-            b_init_best_transformed = b_init_transformed[min_index]
-            b_init_best_transform = b_transform[min_index]
-            print("the best init transform is {}".format(b_init_best_transform))
-            init_best_transformed.append(b_init_best_transformed)
-            init_best_transform.append(b_init_best_transform)
-        return torch.stack(init_best_transform, 0), Shape().set_data_with_refer_to(
-            torch.stack(init_best_transformed, 0), source
+        B, D = source.points.shape[0], source.points.shape[-1]
+        rotations = init_rotation_candidates(
+            D, self.init_rotation_sampling, self.n_init_rotation
+        ).to(source.points.device)
+        R = rotations.shape[0]
+        transforms = torch.cat(
+            [
+                rotations[None] * scale.view(B, 1, 1, 1),
+                bias_center[:, None].expand(B, R, 1, D),
+            ],
+            2,
+        )  # BxRx(D+1)xD
+        batch_index = torch.arange(B, device=source.points.device)
+        if self.init_search_npoints > 0 and self.init_search_topk < R:
+            coarse_source, coarse_target = self._coarse_shape(source), self._coarse_shape(target)
+            if coarse_source is not source or coarse_target is not target:
+                coarse_dist, _ = self._transform_dist(coarse_source, coarse_target, transforms)
+                top_index = coarse_dist.topk(self.init_search_topk, dim=1, largest=False)[1]
+                transforms = transforms[batch_index[:, None], top_index]  # Bxkx(D+1)xD
+        dist, transformed = self._transform_dist(source, target, transforms)
+        best_index = dist.argmin(1)
+        init_best_transform = transforms[batch_index, best_index]
+        return init_best_transform, Shape().set_data_with_refer_to(
+            transformed[batch_index, best_index], source
         )
 
     def sampling_input(self, toflow, target):
@@ -231,12 +249,15 @@ class GradFlowPreAlign(nn.Module):
         sampled_target = self.sampler(target) if compute_at_low_res else target
         return sampled_toflow, sampled_target
 
+    @profile_span("prealign")
     def __call__(self, source, target, init_A=None):
         """
         :param source: Shape with points BxNxD
         :param target_batch: Shape with points BxMxD
         :return: Bx(D+1)xD transform matrix
         """
+        # a new pair, the ot solvers don't keep the potentials of the last one
+        self.ot_solvers.reset()
         source, target = self.sampling_input(source, target)
         toflow = source
         A_prev = init_A if init_A is not None else None
@@ -253,14 +274,14 @@ class GradFlowPreAlign(nn.Module):
                 toflow.weights = weight_map_ratio
                 A, transforme_points = self._solve_transform(toflow, flowed)
                 toflow.weights = toflow_weights
-            A = self.compose_transform(A_prev, A) if A_prev is not None else A
+            A = compose_transform(A_prev, A) if A_prev is not None else A
             transformed_points = (
                 torch.cat(
                     (source.points, torch.ones_like(source.points[:, :, :1])), dim=2
                 )
                 @ A
             )
-            toflow = Shape().set_data_with_refer_to(transformed_points, source)
+            toflow = source.view(points=transformed_points)
             if i > 0 and torch.norm(A - A_prev) < self.rel_ftol:
                 print(
                     "reach relative tolerance {}".format(torch.norm(A - A_prev).item())
@@ -4,11 +4,12 @@ import torch
 from robot.global_variable import Shape
 from robot.utils.obj_factory import obj_factory
 from robot.metrics.reg_losses import GeomDistance
+from robot.utils.sinkhorn_utils import sinkhorn_engine
 from torch.autograd import grad
 
 
 def point_based_gradient_flow_guide(
-    cur_source, target, geomloss_setting, local_iter=-1
+    cur_source, target, geomloss_setting, local_iter=-1, ot_solvers=None
 ):
     geomloss_setting = deepcopy(geomloss_setting)
     geomloss_setting.print_settings_off()
@@ -16,12 +17,11 @@ def point_based_gradient_flow_guide(
     mode = geomloss_setting[("mode", "flow", "flow/analysis")]
     grad_enable_record = torch.is_grad_enabled()
     torch.set_grad_enabled(True)
-    geomloss = GeomDistance(geomloss_setting)
+    geomloss = GeomDistance(geomloss_setting, ot_solvers)
     cur_source_points_clone = cur_source.points.detach().clone()
     cur_source_points_clone.requires_grad_()
-    cur_source_clone = Shape()
-    cur_source_clone.set_data_with_refer_to(
-        cur_source_points_clone, cur_source
+    cur_source_clone = cur_source.view(
+        points=cur_source_points_clone
     )  # shallow copy, only points are cloned, other attr are not
     loss = geomloss(cur_source_clone, target)
     # print("{} th step, before gradient flow, the ot distance between the cur_source and the target is {}".format(
@@ -42,86 +42,63 @@ def point_based_gradient_flow_guide(
         return cur_source_clone.points, loss
 
 
-def wasserstein_barycenter_mapping(cur_source, target, gemloss_setting):
+def wasserstein_barycenter_mapping(cur_source, target, gemloss_setting, ot_solvers=None):
+    """
+    :param ot_solvers: OTSolverCache of the model, the engine is reused from it across the iterations if given
+    """
     from pykeops.torch import LazyTensor
 
-    grad_enable_record = torch.is_grad_enabled()
-    geom_obj = gemloss_setting["geom_obj"].replace(")", ",potentials=True)")
-    blur_arg_filtered = filter(lambda x: "blur" in x, geom_obj.split(","))
-    blur = eval(list(blur_arg_filtered)[0].replace("blur", "").replace("=", ""))
     # though can be generalized to arbitrary order, here we assume the order is 2
     mode = gemloss_setting[
         ("mode", "soft", "soft, hard, mapped_index,analysis,trans_plan")
     ]
-    geomloss = obj_factory(geom_obj)
+    solver = (
+        ot_solvers.get_engine(gemloss_setting["geom_obj"])
+        if ot_solvers is not None
+        else sinkhorn_engine(gemloss_setting["geom_obj"])
+    )
     attr = gemloss_setting[("attr", "pointfea", "points/pointfea/landmarks")]
     attr1 = getattr(cur_source, attr).type(torch.float32)
     attr2 = getattr(target, attr).type(torch.float32)
     points1 = cur_source.points.type(torch.float32)
     points2 = target.points.type(torch.float32)
-    device = points1.device
-    sqrt_const2 = torch.tensor(np.sqrt(2), dtype=torch.float32, device=device)
     weight1 = cur_source.weights[:, :, 0]  # remove the last dim
     weight2 = target.weights[:, :, 0]  # remove the last dim
-    F_i, G_j = geomloss(
-        weight1, attr1, weight2, attr2
-    )  # todo batch sz of input and output in geomloss is not consistent
-    torch.set_grad_enabled(grad_enable_record)
+    result = solver.solve(weight1, attr1, weight2, attr2)
 
     B, N, M, D = points1.shape[0], points1.shape[1], points2.shape[1], points2.shape[2]
-    a_i, x_i = LazyTensor(cur_source.weights.view(B, N, 1, 1)), LazyTensor(
-        attr1.view(B, N, 1, -1)
-    )
-    b_j, y_j = LazyTensor(target.weights.view(B, 1, M, 1)), LazyTensor(
-        attr2.view(B, 1, M, -1)
-    )
-    F_i, G_j = LazyTensor(F_i.view(B, N, 1, 1)), LazyTensor(G_j.view(B, 1, M, 1))
-    xx_i = x_i / (sqrt_const2 * blur)
-    yy_j = y_j / (sqrt_const2 * blur)
-    f_i = a_i.log() + F_i / blur ** 2
-    g_j = b_j.log() + G_j / blur ** 2  # Bx1xMx1
-    C_ij = ((xx_i - yy_j) ** 2).sum(-1)  # BxNxMx1
-    log_P_ij = (
-        f_i + g_j - C_ij
-    )  # BxNxMx1 P_ij = A_i * B_j * exp((F_i + G_j - .5 * |x_i-y_j|^2) / blur**2)
-    log_prob_i = log_P_ij - a_i.log()  # BxNxM
     if mode == "soft":
-        position_to_map = LazyTensor(points2.view(B, 1, M, -1))  # Bx1xMxD
-        mapped_position = log_P_ij.sumsoftmaxweight(position_to_map, dim=2)
-        mapped_mass_ratio = log_P_ij.exp().sum(2) / cur_source.weights
+        mapped_position, mapped_mass_ratio = result.barycentric_map(points2)
+        mapped_mass_ratio = mapped_mass_ratio[..., None]  # BxNx1
     elif mode == "hard":
-        P_i_index = log_P_ij.argmax(dim=2).long().view(B, N)  #  over M,  return (B*N)
-        for i in range(B):  # todo not test yet
-            P_i_index[i] += int(N * i)
-        P_i_index = P_i_index.view(-1)
-        points2_flatten = points2.view(-1, D)
-        mapped_position = points2_flatten[P_i_index]
-        mapped_position = mapped_position.view(B, N, D)
-        mapped_mass_ratio = log_P_ij.exp().sum(2) / cur_source.weights
+        _, mapped_mass_ratio, P_i_index, _ = result.fused_map(points2)
+        mapped_position = points2.gather(1, P_i_index[..., None].expand(B, N, D))
+        mapped_mass_ratio = mapped_mass_ratio[..., None]  # BxNx1
     elif mode == "mapped_index":
-        P_i_index = log_P_ij.argmax(dim=2).long().view(B, N)  # over M,  return (B,N)
+        P_i_index = result.fused_map(points2)[2]  # over M,  return (B,N)
         return P_i_index
     elif mode == "analysis":
         K = 5
-        P_i_index = log_P_ij.argmax(dim=2).long().view(B, N)  # over M,  return (B,N)
-        P_Ki_index = (
-            (-log_P_ij).argKmin(K=K, dim=2).long().view(B, N, K)
-        )  # over M,  return (B,N,K)
-        position_to_map = LazyTensor(points2.view(B, 1, M, -1))  # Bx1xMxD
-        mapped_position = log_P_ij.sumsoftmaxweight(position_to_map, dim=2)
-
+        # the soft map and the top-K matches are computed in the same sweep over the plan
+        mapped_position, _, P_i_index, P_Ki_index = result.fused_map(
+            points2, K=K
+        )  # BxNxD, (B,N), (B,N,K)
         return P_i_index, P_Ki_index, mapped_position
-    elif mode == "trans_plan":
-        return log_P_ij.exp(), log_P_ij
-    elif mode == "prob":
+    elif mode in ["trans_plan", "prob"]:
+        log_P_ij = result.log_plan(
+            lazy=True
+        )  # BxNxMx1 P_ij = A_i * B_j * exp((F_i + G_j - .5 * |x_i-y_j|^2) / blur**2)
+        if mode == "trans_plan":
+            return log_P_ij.exp(), log_P_ij
+        a_i = LazyTensor(cur_source.weights.view(B, N, 1, 1))
+        log_prob_i = log_P_ij - a_i.log()  # BxNxM
         return log_prob_i.exp(), log_prob_i
     else:
         raise ValueError(
             "mode {} not defined, support: soft/ hard/ confid".format(mode)
         )
     # print("OT based forward mapping complete")
-    mapped_shape = Shape()
-    mapped_shape.set_data_with_refer_to(mapped_position, cur_source)
+    mapped_shape = cur_source.view(points=mapped_position)
     return mapped_shape, mapped_mass_ratio
 
 
@@ -176,12 +153,14 @@ def wasserstein_barycenter_mapping(cur_source, target, gemloss_setting):
 def gradient_flow_guide(mode="grad_forward"):
     postion_based = mode == "grad_forward"
 
-    def guide(cur_source, target, geomloss_setting, local_iter=None):
+    def guide(cur_source, target, geomloss_setting, local_iter=None, ot_solvers=None):
         if postion_based:
             return point_based_gradient_flow_guide(
-                cur_source, target, geomloss_setting, local_iter
+                cur_source, target, geomloss_setting, local_iter, ot_solvers
             )
         else:
-            return wasserstein_barycenter_mapping(cur_source, target, geomloss_setting)
+            return wasserstein_barycenter_mapping(
+                cur_source, target, geomloss_setting, ot_solvers
+            )
 
     return guide
@@ -19,6 +19,20 @@ class LDDMMHamilton(nn.Module):
             )
         ]
         self.kernel = obj_factory(kernel)
+        self.evolve_mode = opt[
+            (
+                "evolve_mode",
+                "autograd",
+                "autograd / analytic, 'analytic' computes the hamiltonian gradients in closed form via the gauss_grad kernel, avoiding the second order autograd during the optimization",
+            )
+        ]
+        assert self.evolve_mode in ["autograd", "analytic"]
+        if self.evolve_mode == "analytic":
+            assert self.kernel.kernel_type.replace("fast_", "") in [
+                "gauss",
+                "multi_gauss",
+            ], "the analytic evolution only supports the (multi) gaussian kernel"
+            self.grad_kernel = obj_factory(kernel.replace("gauss", "gauss_grad"))
         self.mode = "shooting"
 
     def hamiltonian(self, mom, control_points):
@@ -26,6 +40,8 @@ class LDDMMHamilton(nn.Module):
         return (mom * self.kernel(control_points, control_points, mom)).sum() * 0.5
 
     def hamiltonian_evolve(self, mom, control_points):
+        if self.evolve_mode == "analytic":
+            return self.analytic_hamiltonian_evolve(mom, control_points)
         record_is_grad_enabled = torch.is_grad_enabled()
         torch.set_grad_enabled(True)
         control_points = control_points.clone().requires_grad_()
@@ -38,6 +54,20 @@ class LDDMMHamilton(nn.Module):
         torch.set_grad_enabled(record_is_grad_enabled)
         return -grad_control, grad_mom
 
+    def analytic_hamiltonian_evolve(self, mom, control_points):
+        """
+        for H = 1/2 sum_ij p_i^T K(q_i,q_j) p_j,
+        dq/dt = dH/dp = K(q,q)p,  dp/dt = -dH/dq = -sum_j grad_1 K(q_i,q_j) p_i^T p_j
+        both terms are single kernel reductions, so no autograd graph is built over the hamiltonian
+
+        :param mom: BxNxD
+        :param control_points: BxNxD
+        :return: dp/dt, dq/dt
+        """
+        return -self.grad_kernel(mom, control_points), self.kernel(
+            control_points, control_points, mom
+        )
+
     def flow(self, mom, control_points, flow_points):
         return self.hamiltonian_evolve(mom, control_points) + (
             self.kernel(flow_points, control_points, mom),
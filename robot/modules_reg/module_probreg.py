@@ -15,7 +15,7 @@ NonRigid Affine, MCT 	        TPS 	                  - 	        Deformable Kinem
 import numpy as np
 import torch
 from functools import partial
-from robot.utils.obj_factory import partial_obj_factory
+from robot.utils.obj_factory import obj_factory, partial_obj_factory
 
 try:
     import open3d as o3d
@@ -37,6 +37,7 @@ METHOD_POOL = [
     "filterreg_rigid",
     "filterreg_nonrigid",
     "BCPD_nonrigid",
+    "batch_icp",
 ]
 
 
@@ -283,12 +284,30 @@ class ProbReg(object):
 
         return _icp_sovler()
 
+    def _init_batch_icp(self, opt):
+        """
+        torch-native icp, all the pairs are solved together on the current device, see procrustes_utils.batch_icp
+        """
+        batch_icp_obj = opt[
+            (
+                "batch_icp_obj",
+                "procrustes_utils.batch_icp(transform_type='rigid', robust_loss='geman_mcclure', robust_scale=0.05, max_iter=50)",
+                "batch icp object",
+            )
+        ]
+        return obj_factory(batch_icp_obj)
+
     def __call__(self, source, target, return_tranform_param=True):
         """
         :param source: Shape with points BxNxD
         :param target_batch: Shape with points BxMxD
         :return: Bx(D+1)xD transform matrix
         """
+        if self.method_name == "batch_icp":
+            transform, transformed = self.solver(
+                source.points, target.points, source.weights
+            )
+            return transform if return_tranform_param else transformed
         source_batch, target_batch = source.points, target.points
         device = source_batch.device
         source_list, target_list = self._get_input(source_batch, target_batch)
@@ -79,15 +79,19 @@ def square_distance(src, dst):
     return dist
 
 
-def knn_point(nsample, xyz, new_xyz):
+def knn_point(nsample, xyz, new_xyz, index=None):
     """
     Input:
         nsample: max sample number in local region
         xyz: all points, [B, N, C]
         new_xyz: query points, [B, S, C]
+        index: optional SpatialIndexCache held by the caller (one per point set it searches),
+            the index is rebuilt only if xyz changes, otherwise brute force search
     Return:
         group_idx: grouped points index, [B, S, nsample]
     """
+    if index is not None:
+        return index.get(xyz).knn(new_xyz, nsample)[1]
 
     # sqrdists = square_distance(new_xyz, xyz)
     # _, group_idx = torch.topk(sqrdists, nsample, dim = -1, largest=False, sorted=False)
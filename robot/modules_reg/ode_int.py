@@ -1,9 +1,129 @@
 from __future__ import print_function
 from __future__ import absolute_import
+import math
 import torch
 import torch.nn as nn
 import torchdiffeq
+from torch.utils.checkpoint import checkpoint
 from robot.utils.module_parameters import ParameterDict
+from robot.utils.profiler import profile_span
+
+
+def _axpy(x, dt, dx):
+    return tuple(_x + dt * _dx for _x, _dx in zip(x, dx))
+
+
+def rk4_step(func, t, dt, x):
+    k1 = func(t, x)
+    k2 = func(t + dt / 2, _axpy(x, dt / 2, k1))
+    k3 = func(t + dt / 2, _axpy(x, dt / 2, k2))
+    k4 = func(t + dt, _axpy(x, dt, k3))
+    return tuple(
+        _x + dt / 6 * (_k1 + 2 * _k2 + 2 * _k3 + _k4)
+        for _x, _k1, _k2, _k3, _k4 in zip(x, k1, k2, k3, k4)
+    )
+
+
+def symplectic_euler_step(func, t, dt, x):
+    """
+    the first state is the momentum, the others are the positions (control points, flowed points)
+    p_{n+1} = p_n + dt*f_p(p_{n+1}, q_n),  q_{n+1} = q_n + dt*f_q(p_{n+1}, q_n)
+    the hamiltonian of LDDMM is not separable, so the implicit momentum update is solved by a fixed point
+    iteration started from the explicit prediction p_n + dt*f_p(p_n, q_n), one iteration is taken like
+    leapfrog_step, three evaluations per step
+    """
+    p = x[0] + dt * func(t, x)[0]
+    p = x[0] + dt * func(t, (p,) + tuple(x[1:]))[0]
+    dx = func(t, (p,) + tuple(x[1:]))
+    return (p,) + _axpy(x[1:], dt, dx[1:])
+
+
+def leapfrog_step(func, t, dt, x):
+    """
+    generalized Stormer-Verlet with the same state layout as symplectic_euler_step,
+    p_{n+1/2} = p_n + dt/2*f_p(p_{n+1/2}, q_n),
+    q_{n+1} = q_n + dt/2*(f_q(p_{n+1/2}, q_n) + f_q(p_{n+1/2}, q_{n+1})),
+    p_{n+1} = p_{n+1/2} + dt/2*f_p(p_{n+1/2}, q_{n+1})
+    the hamiltonian of LDDMM is not separable, so the two implicit updates are solved by a single fixed point
+    iteration each, which keeps the scheme explicit (three evaluations per step) and second order
+    """
+    p_pred = x[0] + dt / 2 * func(t, x)[0]
+    dx = func(t, (p_pred,) + tuple(x[1:]))
+    p_half = x[0] + dt / 2 * dx[0]
+    q_pred = _axpy(x[1:], dt, dx[1:])
+    dx_pred = func(t + dt, (p_half,) + q_pred)
+    q = tuple(
+        _x + dt / 2 * (_dx + _dx_pred)
+        for _x, _dx, _dx_pred in zip(x[1:], dx[1:], dx_pred[1:])
+    )
+    p = p_half + dt / 2 * dx_pred[0]
+    return (p,) + q
+
+
+FIXED_STEP_SOLVERS = {
+    "rk4_checkpoint": (rk4_step, 4),
+    "symplectic_euler": (symplectic_euler_step, 3),
+    "leapfrog": (leapfrog_step, 3),
+}
+""" the fixed step solvers implemented here, solver: (step function, number of function evaluations per step) """
+
+
+def fixed_step_odeint(func, x, t, dt, method="rk4_checkpoint", checkpoint_every=0):
+    """
+    integrate with a fixed step solver, the steps are grouped into segments of checkpoint_every steps,
+    only the states at the segment boundaries are stored during the forward and each segment is recomputed
+    in the backward, so the memory is O(steps/k + k) instead of O(steps) (O(sqrt(steps)) for k=sqrt(steps)),
+    and, unlike the adjoint method, the gradient is exact
+
+    :param func: function(t, x), return the time derivative of each state in x
+    :param x: tuple of torch.Tensor, initial state
+    :param t: 1d torch.Tensor, the time points to output
+    :param dt: the max time step
+    :param method: one of FIXED_STEP_SOLVERS
+    :param checkpoint_every: number of steps per checkpointed segment, 0 for no checkpointing
+    :return: tuple, each element is a torch.Tensor TxBx..., the state at each time point
+    """
+    step_fn = FIXED_STEP_SOLVERS[method][0]
+    t = [float(_t) for _t in t]
+
+    def run_segment(t0, h, n, *x):
+        for i in range(n):
+            x = step_fn(func, t0 + i * h, h, x)
+        return x
+
+    output = [[_x] for _x in x]
+    for t0, t1 in zip(t[:-1], t[1:]):
+        n_step = max(int(math.ceil(abs(t1 - t0) / dt - 1e-6)), 1)
+        h = (t1 - t0) / n_step
+        seg_len = checkpoint_every if checkpoint_every > 0 else n_step
+        for start in range(0, n_step, seg_len):
+            n = min(seg_len, n_step - start)
+            if checkpoint_every > 0 and torch.is_grad_enabled():
+                x = checkpoint(run_segment, t0 + start * h, h, n, *x, use_reentrant=False)
+            else:
+                x = run_segment(t0 + start * h, h, n, *x)
+        for _output, _x in zip(output, x):
+            _output.append(_x)
+    return tuple(torch.stack(_output, 0) for _output in output)
+
+
+def checkpoint_interval(n_step, state_bytes, n_eval, memory_budget_mb):
+    """
+    choose the number of steps per checkpointed segment from the memory budget,
+    a step is assumed to store about 2*n_eval copies of the state (inputs and outputs of each evaluation),
+    the stored activations of the function itself are not counted
+
+    :param n_step: number of steps
+    :param state_bytes: memory of the state
+    :param n_eval: number of function evaluations per step
+    :param memory_budget_mb: memory budget, <0 for no budget (always checkpoint every sqrt(n_step) steps)
+    :return: steps per segment, 0 if the full trajectory fits the budget
+    """
+    step_bytes = 2 * n_eval * state_bytes
+    if memory_budget_mb >= 0 and n_step * step_bytes <= memory_budget_mb * 2 ** 20:
+        return 0
+    # segment boundaries n/k*state + one recomputed segment k*step, minimized at k = sqrt(n*state/step)
+    return max(int(round(math.sqrt(n_step * state_bytes / step_bytes))), 1)
 
 
 class ODEBlock(nn.Module):
@@ -11,7 +131,8 @@ class ODEBlock(nn.Module):
 
         A interface class for torchdiffeq, https://github.com/rtqichen/torchdiffeq
         we add some constrains in torchdiffeq package to avoid collapse or traps, so this local version is recommended
-        the solvers supported by the torchdiffeq are listed as following
+        besides the solvers in FIXED_STEP_SOLVERS (rk4_checkpoint, symplectic_euler, leapfrog) implemented here,
+        which support gradient checkpointing, the solvers supported by the torchdiffeq are listed as following
         SOLVERS = {
         'explicit_adams': AdamsBashforth,
         'fixed_adams': AdamsBashforthMoulton,
@@ -64,6 +185,22 @@ class ODEBlock(nn.Module):
         """ absolute error tolerance for dopri5"""
         self.dt = 1.0 / self.n_step
         """time step, we assume integration time is from 0,1 so the step is 1/n_step"""
+        self.checkpoint_every = param[
+            (
+                "checkpoint_every",
+                -1,
+                "for rk4_checkpoint/symplectic_euler/leapfrog, checkpoint every k steps, 0: no checkpoint, -1: set from the memory budget",
+            )
+        ]
+        """ number of steps per checkpointed segment, only the segment boundaries are stored during the forward"""
+        self.memory_budget_mb = param[
+            (
+                "memory_budget_mb",
+                -1,
+                "the memory budget (MB) of the stored trajectory when checkpoint_every=-1, -1: no budget, checkpoint every sqrt(steps) steps",
+            )
+        ]
+        """ memory budget, checkpointing is turned off if the whole trajectory fits the budget"""
 
     def solve(self, x):
         return self.forward(x)
@@ -74,27 +211,55 @@ class ODEBlock(nn.Module):
     def get_dt(self):
         return self.dt
 
+    @profile_span("ode_integration")
     def forward(self, x):
         self.integration_time = (
             self.integration_time.type_as(x)
             if type(x) is not tuple
             else self.integration_time.type_as(x[0])
         )
-        odesolver = torchdiffeq.odeint_adjoint if self.adjoin_on else torchdiffeq.odeint
-        # out = odeint(self.odefunc, x, self.integration_time, rtol=self.rtol, atol=self.atol)
-        out = odesolver(
+        if self.method in FIXED_STEP_SOLVERS:
+            out = self.fixed_step_solve(x)
+        else:
+            odesolver = (
+                torchdiffeq.odeint_adjoint if self.adjoin_on else torchdiffeq.odeint
+            )
+            # out = odeint(self.odefunc, x, self.integration_time, rtol=self.rtol, atol=self.atol)
+            out = odesolver(
+                self.odefunc,
+                x,
+                self.integration_time,
+                rtol=self.rtol,
+                atol=self.atol,
+                method=self.method,
+                options={"step_size": self.dt, "eps": self.min_step},
+            )
+        if not self.interp_mode:
+            return (elem[1] for elem in out)
+        else:
+            return [[elem_t for elem_t in elem] for elem in out]
+
+    def fixed_step_solve(self, x):
+        is_tuple = type(x) is tuple
+        x = x if is_tuple else (x,)
+        checkpoint_every = self.checkpoint_every
+        if checkpoint_every < 0:
+            time_span = (self.integration_time[-1] - self.integration_time[0]).abs()
+            n_step = int(math.ceil(float(time_span) / self.dt))
+            state_bytes = sum(_x.numel() * _x.element_size() for _x in x)
+            n_eval = FIXED_STEP_SOLVERS[self.method][1]
+            checkpoint_every = checkpoint_interval(
+                n_step, state_bytes, n_eval, self.memory_budget_mb
+            )
+        out = fixed_step_odeint(
             self.odefunc,
             x,
             self.integration_time,
-            rtol=self.rtol,
-            atol=self.atol,
+            self.dt,
             method=self.method,
-            options={"step_size": self.dt, "eps": self.min_step},
+            checkpoint_every=checkpoint_every,
         )
-        if not self.interp_mode:
-            return (elem[1] for elem in out)
-        else:
-            return [[elem_t for elem_t in elem] for elem in out]
+        return out if is_tuple else out[0]
 
     @property
     def nfe(self):
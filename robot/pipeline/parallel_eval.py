@@ -0,0 +1,208 @@
+"""
+Pair-parallel evaluation of the optimization models.
+
+The optimization models (e.g. lddmm_opt, discrete_flow_opt, prealign_opt) solve each batch independently,
+so the batches are dispatched to a pool of worker processes, each holding its own model instance and a fixed
+torch thread budget. The main process iterates the dataloader, collects the results into the same
+records / records_time outputs as the serial evaluation and appends each finished batch to a progress file,
+so an interrupted run can be resumed by pair name.
+
+The workers are spawned (not forked) so that the torch/openmp thread pools of the main process are not inherited.
+In the workers, the shape outputs are written by their own background writer, the archived results
+(save_result_as_archive) go into one archive per worker, record_path/results_worker{id}.rba. On resume, the worker
+continues its archive (an archive left unclosed by the interrupted run is recovered), an unreadable one is kept
+and the worker rolls over to record_path/results_worker{id}_{timestamp}.rba.
+"""
+import os
+import json
+import multiprocessing
+from time import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import torch
+
+_worker = {}
+
+
+def _to_list(score):
+    return np.asarray(score).tolist()
+
+
+def _init_worker(opt, device, model_path, worker_ids, num_threads):
+    from robot.pipeline.build_model import build_model
+    from robot.utils.net_utils import get_test_model
+    from robot.utils.async_writer import configure_shape_writer
+    from robot.utils.result_archive import init_result_archive
+    from robot.utils.profiler import enable_profiler
+
+    torch.set_num_threads(num_threads)
+    worker_id = worker_ids.get()
+    record_path = opt["path"]["record_path"]
+    configure_shape_writer(opt["shape_writer_workers"], opt["shape_writer_queue_size"])
+    try:
+        init_result_archive(opt, record_path, "results_worker{}.rba".format(worker_id))
+    except ValueError as e:
+        archive_name = "results_worker{}_{}.rba".format(worker_id, int(time()))
+        print("{}, the results of worker {} go into {}".format(e, worker_id, archive_name))
+        init_result_archive(opt, record_path, archive_name)
+    enable_profiler(opt["profile"], opt["profile_sync_cuda"])
+    model = build_model(opt, device, None)
+    if len(model_path):
+        get_test_model(model_path, model.get_model(), model.optimizer)
+    model.set_cur_epoch(-1)
+    _worker.update(model=model, device=device, worker_id=worker_id)
+
+
+def _eval_batch(index, data, phase, save_fig_on):
+    """
+    :return: json serializable result of the batch, the profiling records of the batch are attached
+    """
+    from robot.utils.async_writer import flush_shape_writer
+    from robot.utils.profiler import get_profiler
+
+    model, device = _worker["model"], _worker["device"]
+    name_attr = list(filter(lambda x: "name" in x, data.keys()))[0]
+    pair_name = [str(name) for name in data[name_attr]]
+    get_profiler().push_context(phase=phase, pair=str(data[name_attr]))
+    model.set_test()
+    input_data = model.set_input(data, device, phase)
+    ex_time = time()
+    test_res = model.get_evaluation(input_data)
+    batch_time = time() - ex_time
+    score, detailed_scores = model.analyze_res(test_res, cache_res=False)
+    model.save_visual_res(save_fig_on, input_data, test_res, phase)
+    # the pair is recorded as finished only after its outputs are on the disk
+    flush_shape_writer()
+    profile_records = get_profiler().records
+    get_profiler().reset()
+    return {
+        "index": index,
+        "pair_name": pair_name,
+        "score": float(score),
+        "detailed_scores": {
+            metric: _to_list(score) for metric, score in detailed_scores.items()
+        },
+        "eval_metrics": {
+            metric: _to_list(score) for metric, score in test_res[0].items()
+        },
+        "batch_time": batch_time,
+        "batch_size": len(test_res[0]["score"]),
+        "worker_id": _worker["worker_id"],
+        "profile_records": profile_records,
+    }
+
+
+def load_progress(progress_path):
+    """
+    :param progress_path: the progress file (json lines) of an earlier run
+    :return: {tuple of the pair names: batch result}
+    """
+    progress = {}
+    if os.path.isfile(progress_path):
+        with open(progress_path) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    progress[tuple(result["pair_name"])] = result
+    return progress
+
+
+def eval_phase_in_parallel(
+    opt,
+    model,
+    dataloader,
+    phase,
+    device,
+    running_range,
+    num_workers,
+    num_threads=-1,
+    progress_path="",
+    resume=False,
+    save_fig_on=False,
+):
+    """
+    :param opt: ParameterDict, task settings, each worker builds its model from it
+    :param model: the model of the main process, the worker results are cached into it (model.cache_res)
+    :param dataloader: the dataloader of the phase
+    :param phase: "test"
+    :param device: torch device of the workers
+    :param running_range: the range of the batches to run, [-1] for all
+    :param num_workers: number of worker processes
+    :param num_threads: torch threads per worker, -1 to split the cpu cores evenly
+    :param progress_path: each finished batch is appended to this json lines file, not recorded if ""
+    :param resume: skip the batches whose pair names are already in the progress file and keep appending to it,
+        otherwise the progress file is overwritten
+    :param save_fig_on: save the visualization results
+    :return: list of the batch results ordered by the batch index
+    """
+    from robot.utils.profiler import get_profiler, profiled_iter
+
+    running_part_data = running_range[0] >= 0
+    model_path = opt["path"]["model_load_path"]
+    if num_threads <= 0:
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    progress = load_progress(progress_path) if resume and progress_path else {}
+    if progress:
+        print("resume from {}, {} batches are done".format(progress_path, len(progress)))
+    progress_file = open(progress_path, "a" if resume else "w") if progress_path else None
+
+    context = multiprocessing.get_context("spawn")
+    worker_ids = context.Queue()
+    for worker_id in range(num_workers):
+        worker_ids.put(worker_id)
+    executor = ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(opt, device, model_path, worker_ids, num_threads),
+    )
+    print(
+        "evaluate the {} pairs with {} workers, {} threads per worker".format(
+            phase, num_workers, num_threads
+        )
+    )
+    results, pending = [], set()
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            get_profiler().records.extend(result.pop("profile_records"))
+            if progress_file is not None:
+                progress_file.write(json.dumps(result) + "\n")
+                progress_file.flush()
+            print(
+                "id {} and current name is : {}, score {}, takes {:.2f}s on worker {}".format(
+                    result["index"],
+                    result["pair_name"],
+                    result["score"],
+                    result["batch_time"],
+                    result["worker_id"],
+                )
+            )
+            results.append(result)
+
+    try:
+        for idx, data in enumerate(profiled_iter(dataloader)):
+            i = idx
+            if running_part_data:
+                if i not in running_range:
+                    continue
+                i = i - running_range[0]
+            name_attr = list(filter(lambda x: "name" in x, data.keys()))[0]
+            pair_name = tuple(str(name) for name in data[name_attr])
+            if pair_name in progress:
+                results.append(dict(progress[pair_name], index=i))
+                continue
+            if len(pending) >= 2 * num_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(_eval_batch, i, data, phase, save_fig_on))
+        collect(wait(pending)[0])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if progress_file is not None:
+            progress_file.close()
+    results = sorted(results, key=lambda result: result["index"])
+    for result in results:
+        model.cache_res(result["eval_metrics"], result["pair_name"])
+    return results
@@ -2,6 +2,10 @@ from time import time
 from robot.utils.net_utils import get_test_model, update_res
 import os
 import numpy as np
+from robot.utils.async_writer import configure_shape_writer, flush_shape_writer
+from robot.utils.result_archive import init_result_archive, close_result_archive
+from robot.utils.profiler import enable_profiler, get_profiler, profiled_iter
+from robot.pipeline.parallel_eval import eval_phase_in_parallel
 
 
 def eval_model(opt, model, dataloaders, writer, device, task_name=""):
@@ -14,6 +18,54 @@ def eval_model(opt, model, dataloaders, writer, device, task_name=""):
     save_fig_on = opt[
         ("save_fig_on", False, "save the visualizatio results during the evaluation")
     ]
+    shape_writer_workers = opt[
+        (
+            "shape_writer_workers",
+            2,
+            "number of background workers writing the shape outputs, 0 to write synchronously",
+        )
+    ]
+    shape_writer_queue_size = opt[
+        (
+            "shape_writer_queue_size",
+            16,
+            "max number of queued shape writes, the loop blocks beyond it",
+        )
+    ]
+    configure_shape_writer(shape_writer_workers, shape_writer_queue_size)
+    init_result_archive(opt, record_path)
+    profile = opt[
+        ("profile", False, "record the timing spans of the pipeline, see utils/profiler")
+    ]
+    profile_sync_cuda = opt[
+        (
+            "profile_sync_cuda",
+            True,
+            "synchronize cuda at the span boundaries, so the gpu time is attributed to the right span",
+        )
+    ]
+    enable_profiler(profile, profile_sync_cuda)
+    num_eval_workers = opt[
+        (
+            "num_eval_workers",
+            0,
+            "optimization models only, number of worker processes registering the pairs in parallel, 0 to evaluate serially",
+        )
+    ]
+    eval_worker_threads = opt[
+        (
+            "eval_worker_threads",
+            -1,
+            "torch threads per evaluation worker, -1 to split the cpu cores evenly",
+        )
+    ]
+    resume_eval = opt[
+        (
+            "resume_eval",
+            False,
+            "parallel evaluation, skip the pairs already recorded in the progress file (record_path/eval_progress.jsonl)",
+        )
+    ]
     running_part_data = running_range[0] >= 0
     if running_part_data:
         print("running part of the test data from range {}".format(running_range))
@@ -38,49 +90,86 @@ def eval_model(opt, model, dataloaders, writer, device, task_name=""):
         running_test_score = 0
         time_total = 0
         batch_size_list = []
-        for idx, data in enumerate(dataloaders[phase]):
-            i = idx
-            if running_part_data:
-                if i not in running_range:
-                    continue
-                i = i - running_range[0]
-
-            model.set_test()
-            input_data = model.set_input(data, device, phase)
-            ex_time = time()
-            test_res = model.get_evaluation(input_data)
-            batch_time = time() - ex_time
-            time_total += batch_time
-            print("the batch prediction takes {} to complete".format(batch_time))
-            records_time_np[i] = batch_time
-            batch_size = len(test_res[0]["score"])
-            batch_size_list.append(batch_size)
-            score, detailed_scores = model.analyze_res(test_res, cache_res=True)
-            update_res(detailed_scores, runing_detailed_scores)
-            print("the loss_detailed is {}".format(detailed_scores))
-            running_test_score += score * batch_size
-            records_score_np[i] = score
-            sum_batch = sum(batch_size_list)
-            name_attr = list(filter(lambda x: "name" in x, data.keys()))[0]
-            print(
-                "id {} and current name is : {}".format(i, data[name_attr])
-            )  # todo follow the same name general, e.g "name"
-            print("the current running_score:{}".format(score))
-            print(
-                "the current average running_score:{}".format(
-                    running_test_score / sum_batch
-                )
+        if num_eval_workers > 0:
+            assert hasattr(
+                model, "cache_res"
+            ), "the parallel evaluation only supports the optimization models"
+            results = eval_phase_in_parallel(
+                opt,
+                model,
+                dataloaders[phase],
+                phase,
+                device,
+                running_range,
+                num_eval_workers,
+                eval_worker_threads,
+                os.path.join(record_path, task_name + "eval_progress.jsonl"),
+                resume_eval,
+                save_fig_on,
             )
+            for result in results:
+                i = result["index"]
+                records_time_np[i] = result["batch_time"]
+                records_score_np[i] = result["score"]
+                time_total += result["batch_time"]
+                batch_size_list.append(result["batch_size"])
+                update_res(result["detailed_scores"], runing_detailed_scores)
+                running_test_score += result["score"] * result["batch_size"]
             print(
-                "the current average running detailed score:{}".format(
+                "the average running detailed score:{}".format(
                     {
-                        metric: np.sum(score) / sum_batch
+                        metric: np.sum(score) / sum(batch_size_list)
                         for metric, score in runing_detailed_scores.items()
                     }
                 )
             )
-            model.save_visual_res(save_fig_on, input_data, test_res, phase)
+        else:
+            for idx, data in enumerate(profiled_iter(dataloaders[phase])):
+                i = idx
+                if running_part_data:
+                    if i not in running_range:
+                        continue
+                    i = i - running_range[0]
+
+                name_attr = list(filter(lambda x: "name" in x, data.keys()))[0]
+                get_profiler().push_context(phase=phase, pair=str(data[name_attr]))
+                model.set_test()
+                input_data = model.set_input(data, device, phase)
+                ex_time = time()
+                test_res = model.get_evaluation(input_data)
+                batch_time = time() - ex_time
+                time_total += batch_time
+                print("the batch prediction takes {} to complete".format(batch_time))
+                records_time_np[i] = batch_time
+                batch_size = len(test_res[0]["score"])
+                batch_size_list.append(batch_size)
+                score, detailed_scores = model.analyze_res(test_res, cache_res=True)
+                update_res(detailed_scores, runing_detailed_scores)
+                print("the loss_detailed is {}".format(detailed_scores))
+                running_test_score += score * batch_size
+                records_score_np[i] = score
+                sum_batch = sum(batch_size_list)
+                print(
+                    "id {} and current name is : {}".format(i, data[name_attr])
+                )  # todo follow the same name general, e.g "name"
+                print("the current running_score:{}".format(score))
+                print(
+                    "the current average running_score:{}".format(
+                        running_test_score / sum_batch
+                    )
+                )
+                print(
+                    "the current average running detailed score:{}".format(
+                        {
+                            metric: np.sum(score) / sum_batch
+                            for metric, score in runing_detailed_scores.items()
+                        }
+                    )
+                )
+                model.save_visual_res(save_fig_on, input_data, test_res, phase)
 
+        flush_shape_writer()
+        get_profiler().log_to_tensorboard(writer, 0, prefix="time_" + phase)
         test_score = running_test_score / len(dataloaders[phase].dataset)
         time_per_img = time_total / len((dataloaders[phase].dataset))
         print("the average {}_score: {:.4f}".format(phase, test_score))
@@ -100,6 +189,10 @@ def eval_model(opt, model, dataloaders, writer, device, task_name=""):
             runing_detailed_scores, batch_size_list, record_path
         )
         np.save(os.path.join(record_path, task_name + "records_time"), records_time_np)
+    close_result_archive()
+    if profile:
+        get_profiler().write_trace(os.path.join(record_path, "profile_trace.json"))
+        print("the time per pair: {}".format(get_profiler().summary(group_by="pair")))
     return model
 
 
@@ -1,6 +1,10 @@
+import os
 from time import time
 from robot.utils.net_utils import resume_train, save_checkpoint, update_res
 from robot.utils.utils import set_seed
+from robot.utils.async_writer import configure_shape_writer, flush_shape_writer
+from robot.utils.result_archive import init_result_archive, close_result_archive
+from robot.utils.profiler import enable_profiler, get_profiler, profiled_iter
 
 
 def train_model(opt, model, dataloaders, writer, device):
@@ -28,6 +32,33 @@ def train_model(opt, model, dataloaders, writer, device):
         )
     ]
     best_score = -1
+    shape_writer_workers = opt[
+        (
+            "shape_writer_workers",
+            2,
+            "number of background workers writing the shape outputs, 0 to write synchronously",
+        )
+    ]
+    shape_writer_queue_size = opt[
+        (
+            "shape_writer_queue_size",
+            16,
+            "max number of queued shape writes, the loop blocks beyond it",
+        )
+    ]
+    configure_shape_writer(shape_writer_workers, shape_writer_queue_size)
+    init_result_archive(opt, opt["path"]["record_path"])
+    profile = opt[
+        ("profile", False, "record the timing spans of the pipeline, see utils/profiler")
+    ]
+    profile_sync_cuda = opt[
+        (
+            "profile_sync_cuda",
+            True,
+            "synchronize cuda at the span boundaries, so the gpu time is attributed to the right span",
+        )
+    ]
+    enable_profiler(profile, profile_sync_cuda)
     start_epoch = 0
     best_epoch = -1
     phases = ["train", "val", "debug"]
@@ -111,7 +142,8 @@ def train_model(opt, model, dataloaders, writer, device):
             running_val_score = {}
             running_debug_score = {}
 
-            for data in dataloaders[phase]:
+            get_profiler().push_context(epoch=epoch, phase=phase)
+            for data in profiled_iter(dataloaders[phase]):
 
                 global_step[phase] += 1
                 end_of_epoch = (
@@ -203,6 +235,10 @@ def train_model(opt, model, dataloaders, writer, device):
                 if end_of_epoch:
                     break
 
+            flush_shape_writer()
+            get_profiler().log_to_tensorboard(
+                writer, global_step["train"], prefix="time_" + phase
+            )
             if phase == "val":
                 model.save_res(phase)
                 for metric in running_val_score:
@@ -270,7 +306,13 @@ def train_model(opt, model, dataloaders, writer, device):
         )
     )
     print("Best val score : {:4f} is at epoch {}".format(best_score, best_epoch))
+    if profile:
+        get_profiler().write_trace(
+            os.path.join(opt["path"]["record_path"], "profile_trace.json")
+        )
+        print("the time per epoch: {}".format(get_profiler().summary(group_by="epoch")))
     writer.close()
+    close_result_archive()
     # return the model at the last epoch, not the best epoch
     return model
 
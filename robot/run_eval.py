@@ -101,6 +101,10 @@ def addition_test_setting(args, tsm):
         tsm.task_par["tsk_set"]["model_path"] = model_path
     tsm.task_par["tsk_set"]["is_train"] = False
     tsm.task_par["tsk_set"]["continue_train"] = False
+    if args.num_workers > 0:
+        tsm.task_par["tsk_set"]["num_eval_workers"] = args.num_workers
+        tsm.task_par["tsk_set"]["eval_worker_threads"] = args.threads_per_worker
+        tsm.task_par["tsk_set"]["resume_eval"] = args.resume
     return tsm
 
 
@@ -114,6 +118,9 @@ if __name__ == "__main__":
         --setting_folder_path/ -ts: path of the folder where settings are saved,should include task_setting.json
         --model_path/ -m: for learning based approach, the model checkpoint should either provided here (first priority) or set in task_setting.json (second priority)
         --gpu_id/ -g: gpu_id to use
+        --num_workers/ -nw: for optimization based approach, number of worker processes registering the pairs in parallel
+        --threads_per_worker/ -nt: torch threads per worker, -1 to split the cpu cores evenly
+        --resume: skip the pairs already finished in the previous parallel run
     """
     import argparse
 
@@ -160,6 +167,25 @@ if __name__ == "__main__":
         metavar="N",
         help="list of gpu ids to use",
     )
+    parser.add_argument(
+        "-nw",
+        "--num_workers",
+        default=0,
+        type=int,
+        help="number of worker processes registering the pairs in parallel (optimization based approach), 0 to run serially",
+    )
+    parser.add_argument(
+        "-nt",
+        "--threads_per_worker",
+        default=-1,
+        type=int,
+        help="torch threads per worker, -1 to split the cpu cores evenly",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the pairs already finished in the previous parallel run",
+    )
     args = parser.parse_args()
     print(args)
     do_evaluation(args)
@@ -11,6 +11,8 @@ class PointCloud(ShapeBase):
 
     """
 
+    __slots__ = ()
+
     ####################################################################################################################
     ### Constructor:
     ####################################################################################################################
@@ -41,6 +43,7 @@ class PointCloud(ShapeBase):
         self.mask = fn(pointcloud.mask)
         self.extra_info = pointcloud.extra_info
         self.scale = pointcloud.scale
+        self.lengths = pointcloud.lengths
         self.update_info()
         return self
 
@@ -374,13 +374,42 @@ class NadWatAnisoSpline(object):
         return spline_value
 
 
+def nadwat_kernel_obj_interpolator(kernel_obj):
+    """
+    Nadaraya-Watson kernel interpolation, where the weighted kernel sums are computed by an external gauss kernel object,
+    e.g. the truncated "grid_kernels.GridKernel('fast_gauss',sigma=0.005,tol=1e-6)" for large point clouds
+
+    :param kernel_obj: kernel object string, the kernel should take (x, y, b) as input, e.g. gauss/fast_gauss
+    """
+    kernel = obj_factory(kernel_obj)
+
+    def interp(points, control_points, control_value, control_weights, gamma=None):
+        d = control_value.shape[-1]
+        weighted_value = torch.cat(
+            [control_value * control_weights, control_weights], -1
+        )  # BxMx(d+1)
+        points_value = kernel(points, control_points, weighted_value)  # BxNx(d+1)
+        # points out of the kernel support get zero value
+        return points_value[..., :d] / points_value[..., d:].clamp(min=1e-30)
+
+    return interp
+
+
 class NadWatIsoSpline(object):
-    def __init__(self, exp_order=2, kernel_scale=0.05, kernel_weight=1.0):
+    def __init__(self, exp_order=2, kernel_scale=0.05, kernel_weight=1.0, kernel_obj=""):
+        """
+        :param kernel_obj: if given, the interpolation is computed with this gauss kernel object,
+         the kernel_scale and kernel_weight are then ignored (the sigma is set in the kernel object)
+        """
         self.exp_order = exp_order
         self.kernel_scale = kernel_scale
-        self.spline = nadwat_kernel_interpolator(
-            scale=kernel_scale, weight=kernel_weight, exp_order=exp_order, iso=True
-        )
+        if kernel_obj:
+            assert exp_order == 2, "external kernel object only supports the gaussian (exp_order=2)"
+            self.spline = nadwat_kernel_obj_interpolator(kernel_obj)
+        else:
+            self.spline = nadwat_kernel_interpolator(
+                scale=kernel_scale, weight=kernel_weight, exp_order=exp_order, iso=True
+            )
         self.is_interp = False
         self.iter = 0
 
@@ -0,0 +1,227 @@
+"""
+A precomputed voxel-grid pyramid of a shape, from coarse to fine resolution.
+
+Each level is pooled from the next finer one, so the levels are nested: every point of level i+1 falls into
+exactly one point (its parent) of level i. The parent indices are the inter-level operators,
+values are pooled to the coarse level by the weighted mean and prolongated to the fine level by gathering the parent.
+The pyramid is cached on the shape (see get_point_pyramid) and reused as long as the points, weights and pointfea
+are not changed. The dataloader builds a new Shape for every pair, so to reuse the pyramid of e.g. an atlas that is
+registered against many targets, the caller holds a PointPyramidCache that finds the pyramid by the shape content.
+"""
+import copy
+import hashlib
+from collections import OrderedDict
+import torch
+from robot.shape.voxel_utils import voxel_downsample, voxel_pool
+
+
+def _coarsen(shape, scale):
+    """
+    :param shape: Shape with points BxNxD
+    :param scale: voxel size
+    :return: coarse Shape with points BxSxD, parent index BxN (the padded points point to 0)
+    """
+    from robot.global_variable import Shape
+    from robot.utils.packed_utils import (
+        offsets_to_batch_index,
+        batch_index_to_offsets,
+        packed_to_padded,
+    )
+
+    points, offsets = shape.to_packed("points")
+    weights, _ = shape.to_packed("weights")
+    attrs = [shape.to_packed("pointfea")[0]] if shape.pointfea is not None else []
+    batch_index = offsets_to_batch_index(offsets)
+    (
+        sampled_points,
+        sampled_weights,
+        sampled_attrs,
+        sampled_batch_index,
+        index,
+    ) = voxel_downsample(points, scale, weights, attrs, batch_index, shape.nbatch)
+    sampled_offsets = batch_index_to_offsets(sampled_batch_index, shape.nbatch)
+    parent_index = index - sampled_offsets[batch_index]
+    parent_index = packed_to_padded(parent_index[:, None], offsets, shape.npoints)[..., 0]
+    coarse_shape = Shape()
+    coarse_shape.set_data_from_packed(
+        sampled_offsets,
+        points=sampled_points,
+        weights=sampled_weights,
+        pointfea=sampled_attrs[0] if attrs else None,
+        label=shape.label,
+        landmarks=shape.landmarks,
+        extra_info=shape.extra_info,
+    )
+    coarse_shape.set_name_list(shape.name_list)
+    coarse_shape.set_scale(scale)
+    return coarse_shape, parent_index
+
+
+class PointPyramid(object):
+    """
+    Examples:
+        >>> pyramid = get_point_pyramid(source, [0.08, 0.04, -1])
+        >>> coarse_source = pyramid.level(0)
+        >>> fine_disp = pyramid.prolongate(coarse_disp, 0)
+    """
+
+    def __init__(self, shape, scales):
+        """
+        :param shape: Shape with points BxNxD
+        :param scales: voxel sizes from coarse to fine, -1 refers to the original resolution (only as the last one),
+            if the last scale is not -1, the original shape is appended as the finest level
+        """
+        scales = list(scales)
+        grid_scales = [scale for scale in scales if scale > 0]
+        assert scales[: len(grid_scales)] == grid_scales, "-1 can only be the last scale"
+        assert all(
+            coarse > fine for coarse, fine in zip(grid_scales[:-1], grid_scales[1:])
+        ), "the scales should be from coarse to fine"
+        self.scales = scales
+        self.levels = [shape]
+        self.parent_index = []
+        for scale in reversed(grid_scales):
+            coarse_shape, parent_index = _coarsen(self.levels[0], scale)
+            self.levels.insert(0, coarse_shape)
+            self.parent_index.insert(0, parent_index)
+        self.full_level = len(self.levels) - 1
+
+    def rebase(self, shape):
+        """
+        :param shape: Shape with the same content as the finest level
+        :return: a PointPyramid sharing the coarse levels, whose finest level is the given shape
+        """
+        pyramid = copy.copy(self)
+        pyramid.levels = self.levels[:-1] + [shape]
+        return pyramid
+
+    def __len__(self):
+        return len(self.levels)
+
+    def level(self, i):
+        """
+        :param i: level id, 0 is the coarsest, the scale of level i is scales[i]
+        :return: Shape
+        """
+        return self.levels[i]
+
+    def prolongate(self, values, i):
+        """
+        :param values: BxSxC, values on level i
+        :param i: level id
+        :return: BxNxC, the values on level i+1, each point takes the value of its parent
+        """
+        index = self.parent_index[i]
+        return values.gather(1, index[..., None].expand(-1, -1, values.shape[-1]))
+
+    def pool(self, values, i):
+        """
+        :param values: BxNxC, values on level i+1
+        :param i: level id
+        :return: BxSxC, the weighted mean of the values of the children on level i
+        """
+        B, S = self.levels[i].points.shape[:2]
+        index = self.parent_index[i]
+        offsets = torch.arange(B, device=index.device)[:, None] * S
+        pooled = voxel_pool(
+            values.reshape(-1, values.shape[-1]),
+            (index + offsets).view(-1),
+            B * S,
+            self.levels[i + 1].weights.reshape(-1, 1),
+        )
+        return pooled.view(B, S, -1)
+
+    def weight_ratio(self, i):
+        """
+        :param i: level id
+        :return: BxNx1, the weight fraction of each point of level i+1 inside its parent
+        """
+        parent_weights = self.prolongate(self.levels[i].weights, i)
+        return self.levels[i + 1].weights / parent_weights.clamp(min=1e-12)
+
+
+def update_points_from_parent(shape_pair_low, shape_pair_high, source_pyramid, level):
+    """
+    for the models whose reg_param is the flowed control points (e.g. gradient flow, barycenter mapping),
+    each high resolution control point moves with the displacement of its parent in the point pyramid,
+    the flowed control points are set as well, so the pair can be flowed without an optimization step
+
+    :param shape_pair_low: ShapePair on the pyramid level
+    :param shape_pair_high: ShapePair on the pyramid level+1
+    :param source_pyramid: PointPyramid of the source
+    :param level: pyramid level of shape_pair_low
+    :return: shape_pair_high
+    """
+    disp_low = shape_pair_low.reg_param - shape_pair_low.get_control_points()
+    reg_param_high = (
+        shape_pair_high.get_control_points() + source_pyramid.prolongate(disp_low, level)
+    ).detach()
+    reg_param_high.requires_grad_()
+    shape_pair_high.set_reg_param(reg_param_high)
+    shape_pair_high.set_flowed_control_points(reg_param_high.detach())
+    return shape_pair_high
+
+
+def _tensor_key(tensor):
+    if tensor is None:
+        return None
+    return id(tensor), tensor.data_ptr(), tensor._version
+
+
+def get_point_pyramid(shape, scales):
+    """
+    the pyramid is cached on the shape until its points, weights or pointfea change
+
+    :param shape: Shape with points BxNxD
+    :param scales: voxel sizes from coarse to fine, -1 refers to the original resolution
+    :return: PointPyramid
+    """
+    attr_key = (_tensor_key(shape.weights), _tensor_key(shape.pointfea))
+    cache = shape._get_stat(("point_pyramid", tuple(scales)), lambda points: {})
+    if cache.get("attr_key") != attr_key:
+        with torch.no_grad():
+            cache["pyramid"] = PointPyramid(shape, scales)
+        cache["attr_key"] = attr_key
+    return cache["pyramid"]
+
+
+class PointPyramidCache(object):
+    """
+    the pyramids of the recently used shapes, keyed by the shape content (name, points, weights, pointfea, landmarks),
+    so a shape that is reloaded for every pair (e.g. an atlas) is only coarsened once,
+    the least recently used pyramid is dropped once max_size pyramids are held
+
+    Examples:
+        >>> pyramid_cache = PointPyramidCache(max_size=2)
+        >>> source_pyramid = pyramid_cache.get(source, [0.08, 0.04, -1])
+    """
+
+    def __init__(self, max_size=2):
+        self.max_size = max_size
+        self.pyramids = OrderedDict()
+
+    @staticmethod
+    def content_key(shape, scales):
+        hasher = hashlib.sha1(repr((tuple(scales), shape.name_list)).encode())
+        for tensor in [shape.points, shape.weights, shape.pointfea, shape.landmarks]:
+            if tensor is not None:
+                hasher.update(repr(tuple(tensor.shape)).encode())
+                hasher.update(tensor.detach().cpu().numpy().tobytes())
+        return hasher.hexdigest()
+
+    def get(self, shape, scales):
+        """
+        :param shape: Shape with points BxNxD
+        :param scales: voxel sizes from coarse to fine, -1 refers to the original resolution
+        :return: PointPyramid whose finest level is the given shape
+        """
+        key = self.content_key(shape, scales)
+        pyramid = self.pyramids.pop(key, None)
+        if pyramid is None:
+            pyramid = get_point_pyramid(shape, scales)
+        elif pyramid.level(pyramid.full_level) is not shape:
+            pyramid = pyramid.rebase(shape)
+        self.pyramids[key] = pyramid
+        while len(self.pyramids) > self.max_size:
+            self.pyramids.popitem(last=False)
+        return pyramid
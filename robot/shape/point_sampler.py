@@ -1,11 +1,6 @@
-from pykeops.torch.cluster import grid_cluster
 import numpy as np
 import torch
-
-try:
-    from torch_scatter import scatter
-except:
-    print("torch scatter is not detected, voxel grid sampling is disabled")
+from robot.shape.voxel_utils import voxel_downsample, batch_voxel_downsample
 from pointnet2.lib.pointnet2_utils import furthest_point_sample
 from robot.modules_reg.networks.pointconv_util import index_points_gather
 
@@ -25,69 +20,100 @@ def grid_sampler(scale):
         :param weights: Nx1 tensor
         :return:
         """
-        if weights == None:
-            weights = torch.ones(points.shape[0], 1).to(points.device)
-        index = grid_cluster(points, scale).long()
-        points = scatter(points * weights, index, dim=0)
-        cluster_weights = scatter(weights, index, dim=0)
-        points = points / cluster_weights
+        points, cluster_weights, _, _, index = voxel_downsample(points, scale, weights)
         return points, cluster_weights, index
 
     return sampling
 
 
-def uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True):
+def _gather(points, index):
+    """
+    :param points: BxNxC
+    :param index: BxS
+    :return: BxSxC
+    """
+    return points.gather(1, index[..., None].expand(-1, -1, points.shape[2]))
+
+
+def gumbel_topk_sample(weights, num_sample, generator=None):
+    """
+    weighted sampling without replacement, each point gets the key log(w_i) + gumbel noise, the points of
+    the num_sample largest keys follow the successive sampling law of np.random.choice(replace=False, p=w/sum(w)),
+    one topk call for the whole batch, the sampling stays on the device of the weights
+
+    :param weights: BxN non-negative weights, the zero-weight points are only taken once all the others are sampled
+    :param num_sample: int, sampled with replacement if larger than N
+    :param generator: torch.Generator, the global torch generator if None
+    :return: BxS sorted index
     """
-    :param num_sample: float
-    :param rand_generator:
+    B, N = weights.shape
+    device = generator.device if generator is not None else weights.device
+    if num_sample > N:
+        prob = weights.clamp(min=1e-30).to(device)
+        index = torch.multinomial(prob, num_sample, replacement=True, generator=generator)
+    else:
+        uniform = torch.rand(B, N, generator=generator, device=device)
+        gumbel = -(-uniform.clamp(min=1e-20).log()).log()
+        keys = weights.clamp(min=1e-30).log().to(device) + gumbel
+        index = keys.topk(num_sample, dim=1, sorted=False)[1]
+    return index.sort(1)[0].to(weights.device)
+
+
+def uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True, generator=None):
+    """
+    :param num_sample: int
+    :param fixed_random_seed: sample with a fresh generator seeded by 0 in each call (the same points every call),
+        not used if the generator is given
+    :param sampled_by_weight: the sampling probability is proportional to the weights, otherwise uniform
+    :param generator: torch.Generator, the global torch generator is used if None (and not fixed_random_seed)
     :return:
     """
 
+    batch_sampler = batch_uniform_sampler(
+        num_sample, fixed_random_seed, sampled_by_weight, generator
+    )
+
     def sampling(points, weights=None):
         """
         :param points:  NxD tensor
-        :return:
+        :param weights: Nx1 tensor
+        :return: sampled points SxD, weights Sx1, index S
         """
-        if fixed_random_seed:
-            np.random.seed(0)
-        if weights is None:
-            weights = torch.ones(points.shape[0], 1).to(points.device)
-        npoints = points.shape[0]
-        if sampled_by_weight:
-            weights_np = weights.squeeze().detach().cpu().numpy()
-            try:
-                rand_ind = np.random.choice(
-                    np.arange(npoints),
-                    num_sample,
-                    replace=False,
-                    p=weights_np / weights_np.sum(),
-                )
-            except:
-                print("failed to sample {} from {} points".format(num_sample, npoints))
-                rand_ind = np.random.choice(
-                    np.arange(npoints),
-                    num_sample,
-                    replace=True,
-                    p=weights_np / weights_np.sum(),
-                )
-        else:
-            try:
-                rand_ind = np.random.choice(
-                    np.arange(npoints), num_sample, replace=False
-                )
-            except:
-                #print("failed to sample {} from {} points".format(num_sample, npoints))
-                rand_ind = np.random.choice(
-                    np.arange(npoints), num_sample, replace=True
-                )
-        rand_ind.sort()
-        points = points[rand_ind]
-        rand_ind = torch.from_numpy(rand_ind).to(points.device)
-        if weights is not None:
-            weights = weights[rand_ind]
-            return points, weights, rand_ind
-        else:
-            return points, rand_ind
+        points, weights, index = batch_sampler(
+            points[None], weights[None] if weights is not None else None
+        )
+        return points[0], weights[0], index[0]
+
+    return sampling
+
+
+def packed_grid_sampler(scale):
+    """
+    voxel grid sampling on packed point sets, all the sets are processed at once and the output stays packed
+
+    :param scale: voxelgrid gather the point info inside grids of "scale" size
+    :return:
+    """
+
+    def sampling(points, batch_index, weights=None, pointfea=None):
+        """
+        :param points: (sum_b N_b)xD tensor
+        :param batch_index: sum_b N_b tensor, the batch id of each point
+        :param weights: (sum_b N_b)x1 tensor
+        :param pointfea: (sum_b N_b)xC tensor
+        :return: sampled points (sum_b S_b)xD, weights (sum_b S_b)x1, pointfea (sum_b S_b)xC or None,
+         batch index sum_b S_b, cluster index sum_b N_b
+        """
+        attrs = [pointfea] if pointfea is not None else []
+        (
+            sampled_points,
+            cluster_weights,
+            sampled_attrs,
+            sampled_batch_index,
+            index,
+        ) = voxel_downsample(points, scale, weights, attrs, batch_index)
+        sampled_pointfea = sampled_attrs[0] if pointfea is not None else None
+        return sampled_points, cluster_weights, sampled_pointfea, sampled_batch_index, index
 
     return sampling
 
@@ -97,110 +123,76 @@ def point_grid_sampler(scale):
     :param scale: voxelgrid gather the point info inside grids of "scale" size
     :return:
     """
-    grid_point_sampler = grid_sampler(scale)
+    grid_point_sampler = packed_grid_sampler(scale)
 
     def sampling(input_shape):
         from robot.global_variable import Shape
+        from robot.utils.packed_utils import (
+            offsets_to_batch_index,
+            batch_index_to_offsets,
+        )
 
-        nbatch = input_shape.nbatch
-        sampled_points_list = []
-        sampled_weights_list = []
-        sampled_pointfea_list = []
-        D = input_shape.points.shape[-1]
-        device = input_shape.points.device
-        for i in range(nbatch):
-            points = input_shape.points[i]
-            weights = input_shape.weights[i]
-            sampled_points, sampled_weights, index = grid_point_sampler(points, weights)
-            if input_shape.pointfea is not None:
-                sampled_pointfea = scatter(
-                    input_shape.pointfea[i] * weights, index, dim=0
-                )
-                sampled_pointfea = sampled_pointfea / sampled_weights
-                sampled_pointfea_list.append(sampled_pointfea)
-            sampled_points_list.append(sampled_points)
-            sampled_weights_list.append(sampled_weights)
-        max_len = max(
-            [sampled_points.shape[0] for sampled_points in sampled_points_list]
+        points, offsets = input_shape.to_packed("points")
+        weights, _ = input_shape.to_packed("weights")
+        pointfea = (
+            input_shape.to_packed("pointfea")[0]
+            if input_shape.pointfea is not None
+            else None
         )
-        cleaned_sampled_points_list, cleaned_sampled_weights_list = [], []
-        for sampled_points, sampled_weights in zip(
-            sampled_points_list, sampled_weights_list
-        ):
-            nsample = sampled_points.shape[0]
-            if nsample < max_len:
-                zeros_cat_points = torch.zeros(max_len - nsample, D, device=device)
-                zeros_cat_weights = torch.zeros(max_len - nsample, 1, device=device)
-                cleaned_sampled_points_list.append(
-                    torch.cat([sampled_points, zeros_cat_points], 0)
-                )
-                cleaned_sampled_weights_list.append(
-                    torch.cat([sampled_weights, zeros_cat_weights], 0)
-                )
-        sampled_batch_points = torch.stack(cleaned_sampled_points_list, dim=0)
-        sampled_batch_weights = torch.stack(cleaned_sampled_weights_list, dim=0)
+        batch_index = offsets_to_batch_index(offsets)
+        (
+            sampled_points,
+            sampled_weights,
+            sampled_pointfea,
+            sampled_batch_index,
+            _,
+        ) = grid_point_sampler(points, batch_index, weights, pointfea)
+        sampled_offsets = batch_index_to_offsets(sampled_batch_index, input_shape.nbatch)
+        # the sets are zero padded to the same length, the padded points have zero weight
         # todo for polyline and mesh, edges sampling are not supported
         new_shape = Shape()
-        new_shape.set_data_with_refer_to(sampled_batch_points, input_shape)
-        new_shape.set_weights(sampled_batch_weights)
+        new_shape.set_data_from_packed(
+            sampled_offsets,
+            points=sampled_points,
+            weights=sampled_weights,
+            pointfea=sampled_pointfea,
+            label=input_shape.label,
+            landmarks=input_shape.landmarks,
+            extra_info=input_shape.extra_info,
+        )
+        new_shape.set_name_list(input_shape.name_list)
         new_shape.set_scale(scale)
-        if input_shape.pointfea is not None:
-            cleaned_sampled_pointfea_list = []
-            for sampled_pointfea in sampled_pointfea_list:
-                nsample, fea_dim = sampled_pointfea.shape[0], sampled_pointfea.shape[-1]
-                if nsample < max_len:
-                    zeros_cat_pointfea = torch.zeros(
-                        max_len - nsample, fea_dim, device=device
-                    )
-                    cleaned_sampled_pointfea_list.append(
-                        torch.cat([sampled_pointfea, zeros_cat_pointfea], 0)
-                    )
-            sampled_batch_pointfea = torch.stack(cleaned_sampled_pointfea_list, dim=0)
-            new_shape.set_pointfea(sampled_batch_pointfea)
         return new_shape
 
     return sampling
 
 
-def point_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True):
+def point_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True, generator=None):
     """
-    :param num_sample: float
-    :param rand_generator:
+    :param num_sample: int
+    :param fixed_random_seed: see uniform_sampler
+    :param sampled_by_weight: see uniform_sampler
+    :param generator: torch.Generator
     :return:
     """
 
-    uniform_point_sampler = uniform_sampler(
-        num_sample, fixed_random_seed, sampled_by_weight
+    batch_point_sampler = batch_uniform_sampler(
+        num_sample, fixed_random_seed, sampled_by_weight, generator
     )
 
     def sampling(input_shape):
         from robot.global_variable import Shape
 
-        nbatch = input_shape.nbatch
-        sampled_points_list = []
-        sampled_weights_list = []
-        sampled_pointfea_list = []
-        for i in range(nbatch):
-            points = input_shape.points[i]
-            weights = input_shape.weights[i]
-            sampled_points, sampled_weights, index = uniform_point_sampler(
-                points, weights
-            )
-            sampled_weights = sampled_weights
-            if input_shape.pointfea is not None:
-                sampled_pointfea = input_shape.pointfea[i][index]
-                sampled_pointfea_list.append(sampled_pointfea)
-            sampled_points_list.append(sampled_points)
-            sampled_weights_list.append(sampled_weights)
-        sampled_batch_points = torch.stack(sampled_points_list, dim=0)
-        sampled_batch_weights = torch.stack(sampled_weights_list, dim=0)
+        sampled_batch_points, sampled_batch_weights, index = batch_point_sampler(
+            input_shape.points, input_shape.weights
+        )
         # todo for polyline and mesh, edges sampling are not supported
         new_shape = Shape()
         new_shape.set_data_with_refer_to(sampled_batch_points, input_shape)
         new_shape.set_weights(sampled_batch_weights)
         new_shape.set_scale(num_sample)
         if input_shape.pointfea is not None:
-            sampled_batch_pointfea = torch.stack(sampled_pointfea_list, dim=0)
+            sampled_batch_pointfea = _gather(input_shape.pointfea, index)
             new_shape.set_pointfea(sampled_batch_pointfea)
         return new_shape
 
@@ -235,71 +227,42 @@ def batch_grid_sampler(scale):
     :param scale: voxelgrid gather the point info inside grids of "scale" size
     :return:
     """
-    sampler = grid_sampler(scale)
 
     def sampling(points, weights=None):
-        points_list = []
-        weights_list = []
-        ind_list = []
-        if weights is not None:
-            for _points, _weights in zip(points, weights):
-                spoints, sweights, sind = sampler(points, weights)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
-        else:
-            for _points in zip(points):
-                spoints, sweights, sind = sampler(points)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
+        """
+        :param points: BxNxD tensor
+        :param weights: BxNx1 tensor
+        :return: sampled points BxSxD, weights BxSx1, cluster index BxN,
+         the sets are zero padded to the largest number of voxels, the padded points have zero weight
+        """
+        points, cluster_weights, _, index = batch_voxel_downsample(points, scale, weights)
+        return points, cluster_weights, index
 
     return sampling
 
 
-def batch_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True):
+def batch_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True, generator=None):
     """
-    :param num_sample: float
-    :param rand_generator:
+    :param num_sample: int
+    :param fixed_random_seed: see uniform_sampler
+    :param sampled_by_weight: see uniform_sampler
+    :param generator: torch.Generator
     :return:
     """
-    sampler = uniform_sampler(num_sample, fixed_random_seed, sampled_by_weight)
 
     def sampling(points, weights=None):
-        points_list = []
-        weights_list = []
-        ind_list = []
-        if weights is not None:
-            for _points, _weights in zip(points, weights):
-                spoints, sweights, sind = sampler(_points, _weights)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
-        else:
-            for _points in zip(points):
-                spoints, sweights, sind = sampler(_points)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
+        """
+        :param points: BxNxD tensor
+        :param weights: BxNx1 tensor
+        :return: sampled points BxSxD, weights BxSx1, index BxS
+        """
+        if weights is None:
+            weights = torch.ones(points.shape[0], points.shape[1], 1).to(points.device)
+        _generator = generator
+        if _generator is None and fixed_random_seed:
+            _generator = torch.Generator(device=points.device).manual_seed(0)
+        sampling_weights = weights[..., 0] if sampled_by_weight else torch.ones_like(weights[..., 0])
+        index = gumbel_topk_sample(sampling_weights.detach(), num_sample, _generator)
+        return _gather(points, index), _gather(weights, index), index
 
     return sampling
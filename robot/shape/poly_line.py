@@ -11,6 +11,8 @@ class PolyLine(ShapeBase):
 
     """
 
+    __slots__ = ("index",)
+
     ####################################################################################################################
     ### Constructor:
     ####################################################################################################################
@@ -1,15 +1,53 @@
 import os.path
+from functools import lru_cache
 import numpy as np
 import torch
 
 
+def uniform_weights(nbatch, npoints, device):
+    """
+    the default BxNx1 weights 1/N, filled in a single allocation,
+    each shape gets its own tensor, so in-place edits and requires_grad_ never leak to other shapes
+    """
+    return torch.full((nbatch, npoints, 1), 1.0 / npoints, device=device)
+
+
 class ShapeBase(object):
     """
     This class is designed for batch based processing.
     For each batch, we assume the num of nodes  are the same
+    if the sets have different sizes, they are zero-padded to the same N and the valid lengths are kept in self.lengths,
+    the padded points have zero weight, use to_packed/set_data_from_packed to convert from/to the packed form
 
+    The attributes are slotted, a shape derived from another one (see view) shares the tensors of its parent,
+    setting an attribute on the derived shape only rebinds it there (copy-on-write), the parent is never modified
     """
 
+    __slots__ = (
+        "type",
+        "attr_list",
+        "nbatch",
+        "dimension",
+        "points",
+        "faces",
+        "edges",
+        "weights",
+        "npoints",
+        "lengths",
+        "label",
+        "seg",
+        "name_list",
+        "compute_bd",
+        "bounding_box",
+        "landmarks",
+        "mask",
+        "pointfea",
+        "scale",
+        "extra_info",
+        "points_mode_on",
+        "_stats",
+    )
+
     ####################################################################################################################
     ### Constructor:
     ####################################################################################################################
@@ -37,6 +75,7 @@ class ShapeBase(object):
         self.edges = None
         self.weights = None
         self.npoints = None
+        self.lengths = None
         self.label = None
         self.seg = None
         self.name_list = []
@@ -47,6 +86,7 @@ class ShapeBase(object):
         self.scale = -1
         self.extra_info = None
         self.points_mode_on = False
+        self._stats = None
         # self.update_bounding_box()
 
     def update_info(self):
@@ -56,14 +96,37 @@ class ShapeBase(object):
         self.dimension = points.shape[-1]
         self.points = points
         self.npoints = points_shape[1]
-        if self.weights is None:
-            self.weights = (
-                torch.ones(self.nbatch, self.npoints, 1).to(points.device)
-                / self.npoints
-            )
+        if self.weights is None and self.lengths is None:
+            self.weights = uniform_weights(self.nbatch, self.npoints, points.device)
+        elif self.weights is None:
+            lengths = self.lengths.to(points.device)
+            valid = torch.arange(self.npoints, device=points.device)[None] < lengths[:, None]
+            self.weights = (valid.float() / lengths[:, None])[..., None]
         if self.compute_bd:
             self.update_bounding_box()
 
+    def view(self, **changed):
+        """
+        a zero-copy derived shape, all the tensors are shared with self except the attributes in changed,
+        the attributes changed later on the derived shape are rebound on it only (copy-on-write)
+
+        Examples:
+            >>> toflow = source.view(points=transformed_points)
+
+        :param changed: attributes to be replaced, e.g. points=BxNxD
+        :return: a shape of the same class
+        """
+        new_shape = self.__class__.__new__(self.__class__)
+        for name in _slot_names(self.__class__):
+            if hasattr(self, name):
+                setattr(new_shape, name, getattr(self, name))
+        for name, value in changed.items():
+            setattr(new_shape, name, value)
+        if "points" in changed:
+            new_shape._stats = None
+            new_shape.update_info()
+        return new_shape
+
     def detatch(self):
         for attr in self.attr_list:
             if attr is not None:
@@ -86,6 +149,7 @@ class ShapeBase(object):
         mask = args["mask"] if "mask" in args else None
         scale = args["scale"] if "scale" in args else -1
         extra_info = args["extra_info"] if "extra_info" in args else None
+        lengths = args["lengths"] if "lengths" in args else None
 
         self.points = points
         self.weights = weights
@@ -96,9 +160,43 @@ class ShapeBase(object):
         self.mask = mask
         self.scale = scale
         self.extra_info = extra_info
+        self.lengths = lengths
         self.update_info()
         return self
 
+    def set_data_from_packed(self, offsets, **args):
+        """
+        set the data from the packed form, the sets are zero-padded to the max length
+
+        :param offsets: B+1, offsets[b]:offsets[b+1] is the range of the b-th set
+        :param args: packed attributes, e.g. points: (sum_b N_b)xD, weights: (sum_b N_b)x1
+        :return:
+        """
+        from robot.utils.packed_utils import offsets_to_lengths, packed_to_padded
+
+        for attr in ["points", "weights", "pointfea", "seg", "mask"]:
+            if args.get(attr, None) is not None:
+                args[attr] = packed_to_padded(args[attr], offsets)
+        args["lengths"] = offsets_to_lengths(offsets)
+        return self.set_data(**args)
+
+    def to_packed(self, attr="points"):
+        """
+        :param attr: a point attribute, e.g. 'points','weights','pointfea'
+        :return: (sum_b N_b)x*, B+1 offsets
+        """
+        from robot.utils.packed_utils import padded_to_packed
+
+        return padded_to_packed(getattr(self, attr), self.lengths)
+
+    def get_lengths(self):
+        """
+        :return: B, the number of valid points of each set
+        """
+        if self.lengths is not None:
+            return self.lengths
+        return torch.full((self.nbatch,), self.npoints, dtype=torch.long)
+
     def set_weights(self, weights):
         """
         point weight
@@ -156,17 +254,71 @@ class ShapeBase(object):
     def get_landmarks(self):
         return self.landmarks
 
+    def _get_stat(self, name, compute):
+        """
+        the point statistics are cached and reused until the points change
+        (a new points tensor is set or the current one is modified in place)
+        """
+        points = self.points
+        key = (id(points), points.data_ptr(), points._version, points.shape)
+        if self._stats is None or self._stats[0] != key:
+            self._stats = (key, {})
+        cache = self._stats[1]
+        if name not in cache:
+            with torch.no_grad():
+                cache[name] = compute(points.detach())
+        return cache[name]
+
+    def _valid_points_stat(self, points, reduce_fn, pad_value):
+        if self.lengths is None:
+            return reduce_fn(points)
+        valid = (
+            torch.arange(points.shape[1], device=points.device)[None]
+            < self.lengths.to(points.device)[:, None]
+        )
+        return reduce_fn(torch.where(valid[..., None], points, points.new_tensor(pad_value)))
+
+    def get_bounding_box(self):
+        """
+        :return: BxDx2, the min and max of each dimension
+        """
+
+        def compute(points):
+            low = self._valid_points_stat(points, lambda x: x.min(1)[0], float("inf"))
+            high = self._valid_points_stat(points, lambda x: x.max(1)[0], -float("inf"))
+            return torch.stack([low, high], -1)
+
+        return self._get_stat("bounding_box", compute)
+
+    def get_center(self):
+        """
+        :return: Bx1xD, the mean of the points
+        """
+
+        def compute(points):
+            total = self._valid_points_stat(points, lambda x: x.sum(1, keepdim=True), 0.0)
+            return total / self.get_lengths().to(points.device).view(-1, 1, 1)
+
+        return self._get_stat("center", compute)
+
+    def get_diameter(self):
+        """
+        :return: B, the largest side of the bounding box
+        """
+        return self._get_stat(
+            "diameter",
+            lambda points: (
+                self.get_bounding_box()[..., 1] - self.get_bounding_box()[..., 0]
+            ).max(1)[0],
+        )
+
     # Compute a tight bounding box that contains all the landmarks data.
     def update_bounding_box(self):
         """
 
-        :return: bounding box: BxNx2
+        :return: bounding box: BxDx2
         """
-        self.bounding_box = np.zeros((self.nbatch, self.dimension, 2))
-        for b in range(self.nbatch):
-            for d in range(self.dimension):
-                self.bounding_box[b, d, 0] = np.min(self.points[b, :, d])
-                self.bounding_box[b, d, 1] = np.max(self.points[b, :, d])
+        self.bounding_box = self.get_bounding_box()
 
     def write(self, output_dir):
         if self.points is not None:
@@ -182,3 +334,13 @@ class ShapeBase(object):
                             str_p.append(str(0.0))
                         s = " ".join(str_p) + "\n"
                         f.write(s)
+
+
+@lru_cache(maxsize=None)
+def _slot_names(cls):
+    names = []
+    for klass in cls.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if name not in names:
+                names.append(name)
+    return tuple(names)
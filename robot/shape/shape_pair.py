@@ -41,6 +41,23 @@ class ShapePair:
         >>> do_flow(shape_pair)
     """
 
+    __slots__ = (
+        "source",
+        "target",
+        "toflow",
+        "flowed",
+        "reg_param",
+        "control_points",
+        "control_weights",
+        "flowed_control_points",
+        "dense_mode",
+        "pair_name",
+        "extra_info",
+        "shape_type",
+        "dimension",
+        "nbatch",
+    )
+
     def __init__(self, dense_mode=True):
         self.source = None
         self.target = None
@@ -97,8 +114,7 @@ class ShapePair:
 
     def infer_flowed(self):
         if self.dense_mode:
-            self.flowed = Shape()
-            self.flowed.set_data_with_refer_to(self.flowed_control_points, self.toflow)
+            self.flowed = self.toflow.view(points=self.flowed_control_points)
             return True
         else:
             return False
@@ -2,13 +2,15 @@ import numpy as np
 
 
 def get_scale_and_center(points, percentile=99):
-    dim = points.shape[1]
-    scale = np.zeros([1, dim])
-    center = np.zeros([1, dim])
+    """
+    the robust extent of the points, the percentiles of all dimensions are computed at once
+
+    :param points: NxD array
+    :param percentile: the central percentile kept on each dimension
+    :return: 1xD half extent, 1xD center
+    """
     interval = [(100.0 - percentile) / 2, 100 - (100.0 - percentile) / 2]
-    for d in range(dim):
-        filtered_low_thre = np.percentile(points[:, d], interval[0])
-        filtered_up_thre = np.percentile(points[:, d], interval[1])
-        scale[0, d] = filtered_up_thre - filtered_low_thre
-        center[0, d] = (filtered_up_thre + filtered_low_thre) / 2
+    filtered_low_thre, filtered_up_thre = np.percentile(points, interval, axis=0)
+    scale = (filtered_up_thre - filtered_low_thre)[None]
+    center = ((filtered_up_thre + filtered_low_thre) / 2)[None]
     return (scale / 2).astype(np.float32), center.astype(np.float32)
@@ -11,6 +11,8 @@ class SurfaceMesh(ShapeBase):
 
     """
 
+    __slots__ = ("index",)
+
     ####################################################################################################################
     ### Constructor:
     ####################################################################################################################
@@ -119,6 +121,8 @@ class SurfaceMesh(ShapeBase):
 
 
 class SurfaceMesh_Point(SurfaceMesh):
+    __slots__ = ()
+
     def __init__(self):
         super(SurfaceMesh_Point, self).__init__()
         self.points_mode_on = True
@@ -0,0 +1,137 @@
+"""
+Voxel grid downsampling in plain torch, neither KeOps (grid_cluster) nor torch_scatter is needed.
+
+The points are hashed into integer voxel keys (batch id included), the keys are grouped by a sort-based
+torch.unique and every per-point attribute is pooled by a weighted segment mean (index_add).
+The cluster index (point -> voxel) is returned so that features computed later can be pooled the same way.
+"""
+import torch
+from robot.utils.packed_utils import segment_sum
+
+
+def _batch_min(points, batch_index, nbatch):
+    """
+    :param points: (sum_b N_b)xD
+    :param batch_index: sum_b N_b
+    :param nbatch: B
+    :return: BxD, the lower corner of each set
+    """
+    index = batch_index[:, None].expand_as(points)
+    return points.new_zeros(nbatch, points.shape[1]).scatter_reduce(
+        0, index, points, "amin", include_self=False
+    )
+
+
+def voxel_hash(points, scale, batch_index=None, nbatch=None):
+    """
+    the voxel grid of each set starts from its lower corner,
+    the voxel coordinates and the batch id are raveled into a single int64 key
+
+    :param points: (sum_b N_b)xD tensor
+    :param scale: voxel size
+    :param batch_index: sum_b N_b tensor, the batch id of each point, a single set if None
+    :param nbatch: B, inferred from batch_index if None
+    :return: sum_b N_b int64 key, int number of keys per set (the key // it is the batch id)
+    """
+    if batch_index is None:
+        batch_index = torch.zeros(points.shape[0], dtype=torch.long, device=points.device)
+    nbatch = int(batch_index.max()) + 1 if nbatch is None else nbatch
+    origin = _batch_min(points.detach(), batch_index, nbatch)
+    voxel = ((points.detach() - origin[batch_index]) / scale).floor().long()
+    extent = voxel.max(0)[0] + 1
+    assert float(extent.double().prod()) * nbatch < 2 ** 62, "voxel grid is too fine to hash"
+    key = torch.zeros_like(voxel[:, 0])
+    for d in range(voxel.shape[1]):
+        key = key * extent[d] + voxel[:, d]
+    nkey = int(extent.prod())
+    return batch_index * nkey + key, nkey
+
+
+def voxel_cluster(points, scale, batch_index=None, nbatch=None):
+    """
+    :param points: (sum_b N_b)xD tensor
+    :param scale: voxel size
+    :param batch_index: sum_b N_b tensor, the batch id of each point, a single set if None
+    :param nbatch: B, inferred from batch_index if None
+    :return: cluster index sum_b N_b (clusters are ordered by batch), cluster batch index sum_b S_b
+    """
+    key, nkey = voxel_hash(points, scale, batch_index, nbatch)
+    cluster_key, index = torch.unique(key, sorted=True, return_inverse=True)
+    return index, cluster_key // nkey
+
+
+def voxel_pool(values, index, ncluster, weights):
+    """
+    weighted mean of the points inside each cluster
+
+    :param values: (sum_b N_b)xC tensor
+    :param index: sum_b N_b cluster index
+    :param ncluster: number of clusters
+    :param weights: (sum_b N_b)x1 tensor
+    :return: ncluster x C
+    """
+    return segment_sum(values * weights, index, ncluster) / segment_sum(
+        weights, index, ncluster
+    ).clamp(min=1e-12)
+
+
+def voxel_downsample(points, scale, weights=None, attrs=(), batch_index=None, nbatch=None):
+    """
+    :param points: (sum_b N_b)xD tensor
+    :param scale: voxel size
+    :param weights: (sum_b N_b)x1 tensor, uniform if None
+    :param attrs: a list of (sum_b N_b)x* per-point attributes, pooled by the weighted mean
+    :param batch_index: sum_b N_b tensor, the batch id of each point, a single set if None
+    :param nbatch: B, inferred from batch_index if None
+    :return: sampled points (sum_b S_b)xD, weights (sum_b S_b)x1 (sum of the weights in the voxel),
+        list of the pooled attributes, batch index sum_b S_b, cluster index sum_b N_b
+    """
+    if weights is None:
+        weights = torch.ones(points.shape[0], 1, device=points.device, dtype=points.dtype)
+    index, cluster_batch_index = voxel_cluster(points, scale, batch_index, nbatch)
+    ncluster = cluster_batch_index.shape[0]
+    cluster_weights = segment_sum(weights, index, ncluster)
+    sampled_points = voxel_pool(points, index, ncluster, weights)
+    sampled_attrs = [
+        voxel_pool(attr.view(attr.shape[0], -1), index, ncluster, weights).view(
+            (ncluster,) + tuple(attr.shape[1:])
+        )
+        for attr in attrs
+    ]
+    return sampled_points, cluster_weights, sampled_attrs, cluster_batch_index, index
+
+
+def batch_voxel_downsample(points, scale, weights=None, attrs=()):
+    """
+    batched path, all the sets are hashed together, the outputs are zero padded to the largest number of voxels,
+    the padded voxels have zero weight
+
+    :param points: BxNxD tensor
+    :param scale: voxel size
+    :param weights: BxNx1 tensor, uniform if None
+    :param attrs: a list of BxNx* per-point attributes
+    :return: sampled points BxSxD, weights BxSx1, list of the pooled attributes BxSx*,
+        cluster index BxN (indexing the S voxels of each set)
+    """
+    from robot.utils.packed_utils import batch_index_to_offsets, packed_to_padded
+
+    B, N = points.shape[:2]
+    batch_index = torch.arange(B, device=points.device).repeat_interleave(N)
+    flatten = lambda x: x.reshape((B * N,) + tuple(x.shape[2:]))
+    sampled_points, cluster_weights, sampled_attrs, cluster_batch_index, index = voxel_downsample(
+        flatten(points),
+        scale,
+        flatten(weights) if weights is not None else None,
+        [flatten(attr) for attr in attrs],
+        batch_index,
+        B,
+    )
+    offsets = batch_index_to_offsets(cluster_batch_index, B)
+    index = index.view(B, N) - offsets[:-1, None]
+    to_padded = lambda x: packed_to_padded(x, offsets)
+    return (
+        to_padded(sampled_points),
+        to_padded(cluster_weights),
+        [to_padded(attr) for attr in sampled_attrs],
+        index,
+    )
@@ -0,0 +1,73 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import tempfile
+import threading
+import time
+import numpy as np
+import unittest
+from robot.utils.async_writer import AsyncWriter
+
+
+class Test_Async_Writer(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pass
+
+    def test_flush(self):
+        writer = AsyncWriter(num_workers=2, max_pending=4)
+        array = np.arange(10)
+        for i in range(8):
+            writer.submit(np.save, os.path.join(self.folder, "{}.npy".format(i)), array)
+        writer.flush()
+        for i in range(8):
+            np.testing.assert_equal(
+                np.load(os.path.join(self.folder, "{}.npy".format(i))), array
+            )
+        writer.submit(np.save, os.path.join(self.folder, "missing", "0.npy"), array)
+        self.assertRaises(FileNotFoundError, writer.flush)
+        writer.flush()  # the error is reported once
+        writer.close()
+
+    def test_late_callback(self):
+        class LateCallbackWriter(AsyncWriter):
+            def _done(self, future):
+                time.sleep(0.2)
+                super(LateCallbackWriter, self)._done(future)
+
+        # wait returns before the done callback runs, the error is still collected by flush
+        writer = LateCallbackWriter(num_workers=1, max_pending=2)
+        writer.submit(np.save, os.path.join(self.folder, "missing", "0.npy"), np.arange(10))
+        self.assertRaises(FileNotFoundError, writer.flush)
+        time.sleep(0.4)
+        writer.flush()  # the late callback does not report it again
+        writer.close()
+
+    def test_backpressure(self):
+        writer = AsyncWriter(num_workers=1, max_pending=2)
+        release = threading.Event()
+        writer.submit(release.wait)
+        writer.submit(release.wait)
+        blocked = threading.Thread(target=writer.submit, args=(time.sleep, 0))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())  # the queue is full
+        release.set()
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive())
+        writer.close()
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Async_Writer(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_flush")
+    run_by_name("test_backpressure")
+    run_by_name("test_late_callback")
@@ -0,0 +1,60 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import tempfile
+import unittest
+from robot.benchmarks.benchmark_utils import (
+    time_fn,
+    sweep,
+    key,
+    save_results,
+    load_results,
+    compare_to_baseline,
+)
+
+
+class Test_Benchmark_Utils(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pass
+
+    def test_time_fn(self):
+        calls = []
+        stats, output = time_fn(lambda: calls.append(1) or len(calls), repeat=3, warmup=2)
+        self.assertEqual(output, 5)
+        self.assertEqual(stats["repeat"], 3)
+        self.assertLessEqual(stats["min_ms"], stats["median_ms"])
+        self.assertEqual(len(sweep(N=[1, 2], M=[3, 4, 5])), 6)
+
+    def test_compare_to_baseline(self):
+        baseline = [
+            {"suite": "kernel", "name": "tiled/gauss", "params": {"N": 10}, "median_ms": 10.0},
+            {"suite": "kernel", "name": "tiled/gauss", "params": {"N": 20}, "median_ms": 10.0},
+        ]
+        fpath = os.path.join(self.folder, "baseline.json")
+        save_results(fpath, baseline)
+        baseline = load_results(fpath)
+        results = [
+            dict(baseline[0], median_ms=11.0),
+            dict(baseline[1], median_ms=13.0),
+            {"suite": "knn", "name": "grid", "params": {}, "median_ms": 1.0},
+        ]
+        comparison = compare_to_baseline(results, baseline, threshold=1.2)
+        self.assertEqual(len(comparison), 2)
+        self.assertFalse(comparison[0]["regression"])
+        self.assertTrue(comparison[1]["regression"])
+        self.assertEqual(comparison[1]["key"], key(results[1]))
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Benchmark_Utils(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_time_fn")
+    run_by_name("test_compare_to_baseline")
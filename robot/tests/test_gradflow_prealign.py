@@ -0,0 +1,72 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.global_variable import Shape
+from robot.utils.module_parameters import ParameterDict
+from robot.modules_reg.module_gradflow_prealign import (
+    GradFlowPreAlign,
+    init_rotation_candidates,
+)
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_GradFlow_PreAlign(unittest.TestCase):
+    def setUp(self):
+        B, N, D = 2, 1000, 3
+        points = torch.rand(B, N, D) * torch.tensor([1.0, 0.6, 0.3])
+        points[..., 2] += points[..., 0] ** 2  # no symmetry
+        self.rotations = init_rotation_candidates(D)
+        self.true_index = [5, 17]
+        target_points = torch.stack(
+            [points[b] @ self.rotations[i] for b, i in enumerate(self.true_index)]
+        )
+        weights = torch.ones(B, N, 1) / N
+        self.source = Shape().set_data(points=points, weights=weights)
+        self.target = Shape().set_data(points=target_points, weights=weights.clone())
+        opt = ParameterDict()
+        opt.print_settings_off()
+        opt["search_init_transform"] = True
+        opt["init_search_npoints"] = 200
+        opt["geomloss"][
+            "geom_obj"
+        ] = "geomloss.SamplesLoss(loss='sinkhorn',blur=0.05, scaling=0.8,debias=False, backend='tensorized')"
+        self.prealign = GradFlowPreAlign(opt)
+
+    def tearDown(self):
+        pass
+
+    def test_rotation_candidates(self):
+        for D, n_rotation in [(2, 4), (3, 24)]:
+            rotations = init_rotation_candidates(D)
+            self.assertEqual(len(rotations), n_rotation)
+            torch.testing.assert_close(
+                rotations @ rotations.transpose(2, 1), torch.eye(D).expand_as(rotations)
+            )
+            self.assertEqual(len(torch.unique(rotations.round(), dim=0)), n_rotation)
+        self.assertEqual(len(init_rotation_candidates(3, "random", 10)), 10)
+
+    def test_find_initial_transform(self):
+        transform, transformed = self.prealign.find_initial_transform(
+            self.source, self.target
+        )
+        for b, i in enumerate(self.true_index):
+            torch.testing.assert_close(
+                transform[b, :3], self.rotations[i], rtol=0, atol=1e-5
+            )
+        self.assertEqual(transformed.points.shape, self.source.points.shape)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_GradFlow_PreAlign(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_rotation_candidates")
+    run_by_name("test_find_initial_transform")
@@ -0,0 +1,106 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+from torch.autograd import grad
+import unittest
+from robot.kernels.grid_kernels import GridKernel
+from robot.kernels.torch_kernels import TorchKernel
+from robot.modules_reg.module_lddmm import LDDMMHamilton, LDDMMVariational
+from robot.utils.module_parameters import ParameterDict
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Grid_Kernels(unittest.TestCase):
+    def setUp(self):
+        B = 2
+        N = 1000
+        K = 800
+        D = 3
+        device = torch.device("cpu")
+        dtype = torch.float64
+        self.x = torch.rand(B, N, D, requires_grad=True, device=device, dtype=dtype)
+        self.y = torch.rand(B, K, D, requires_grad=True, device=device, dtype=dtype)
+        self.px = torch.rand(B, N, D, requires_grad=True, device=device, dtype=dtype)
+        self.py = torch.rand(B, K, D, requires_grad=True, device=device, dtype=dtype)
+        self.b = torch.rand(B, K, D, requires_grad=True, device=device, dtype=dtype)
+
+    def tearDown(self):
+        pass
+
+    def compare_tensors(self, tensors1, tensors2, rtol=1e-3, atol=1e-4):
+        for tensor1, tensor2 in zip(tensors1, tensors2):
+            torch.testing.assert_close(tensor1, tensor2, rtol=rtol, atol=atol)
+
+    def compare_kernels(self, kernel1, kernel2, inputs):
+        output1 = kernel1(*inputs)
+        output2 = kernel2(*inputs)
+        grads1 = grad(output1.sum(), inputs, retain_graph=True)
+        grads2 = grad(output2.sum(), inputs, retain_graph=True)
+        self.compare_tensors([output1], [output2])
+        self.compare_tensors(grads1, grads2)
+
+    def test_kernel_fast_gaussian(self):
+        self.compare_kernels(
+            GridKernel("fast_gauss", sigma=0.05, tol=1e-8, chunk_size=300),
+            TorchKernel("gauss", sigma=0.05),
+            (self.x, self.y, self.b),
+        )
+
+    def test_kernel_fast_multi_gaussian(self):
+        kernel_args = dict(sigma_list=[0.01, 0.03, 0.05], weight_list=[0.2, 0.3, 0.5])
+        self.compare_kernels(
+            GridKernel("fast_multi_gauss", tol=1e-8, **kernel_args),
+            TorchKernel("multi_gauss", **kernel_args),
+            (self.x, self.y, self.b),
+        )
+
+    def test_kernel_fast_gaussian_grad(self):
+        self.compare_kernels(
+            GridKernel("fast_gauss_grad", sigma=0.05, tol=1e-8),
+            TorchKernel("gauss_grad", sigma=0.05),
+            (self.px, self.x, self.py, self.y),
+        )
+
+    def test_kernel_fast_multi_gaussian_grad(self):
+        kernel_args = dict(sigma_list=[0.01, 0.03, 0.05], weight_list=[0.2, 0.3, 0.5])
+        self.compare_kernels(
+            GridKernel("fast_multi_gauss_grad", tol=1e-8, **kernel_args),
+            TorchKernel("multi_gauss_grad", **kernel_args),
+            (self.px, self.x, self.py, self.y),
+        )
+
+    def test_lddmm_shooting_fast_gaussian(self):
+        hamiltonian_opt = ParameterDict()
+        hamiltonian_opt[
+            "kernel"
+        ] = "grid_kernels.GridKernel('fast_gauss',sigma=0.05,tol=1e-8)"
+        variational_opt = ParameterDict()
+        variational_opt[
+            "kernel"
+        ] = "grid_kernels.GridKernel('fast_gauss',sigma=0.05,tol=1e-8)"
+        momentum = self.px * 0.01  # keep inside the clamp of the variational view
+        hamiltonian_forward = LDDMMHamilton(hamiltonian_opt)(
+            t=1.0, input=(momentum, self.x)
+        )
+        variational_forward = LDDMMVariational(variational_opt)(
+            t=1.0, input=(momentum, self.x)
+        )
+        self.compare_tensors(hamiltonian_forward, variational_forward)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Grid_Kernels(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_kernel_fast_gaussian")
+    run_by_name("test_kernel_fast_multi_gaussian")
+    run_by_name("test_kernel_fast_gaussian_grad")
+    run_by_name("test_kernel_fast_multi_gaussian_grad")
+    run_by_name("test_lddmm_shooting_fast_gaussian")
@@ -142,12 +142,61 @@ class Test_Kernels(unittest.TestCase):
         )
 
 
-def run_by_name(test_name):
+class Test_Analytic_Evolve(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(123)
+        B = 1
+        N = 2000
+        D = 3
+        device = torch.device("cpu")
+        self.control_points = torch.rand(B, N, D, dtype=torch.float64, device=device)
+        self.momentum = torch.rand(B, N, D, dtype=torch.float64, device=device)
+
+    def tearDown(self):
+        pass
+
+    def compare_tensors(self, tensors1, tensors2, rtol=1e-3, atol=1e-7):
+        for tensor1, tensor2 in zip(tensors1, tensors2):
+            torch.testing.assert_allclose(tensor1, tensor2, rtol=rtol, atol=atol)
+
+    def test_lddmm_analytic_evolve(self):
+        for kernel in [
+            "torch_kernels.TorchKernel('gauss',sigma=0.1)",
+            "torch_kernels.TorchKernel(kernel_type='multi_gauss', sigma_list=[0.01,0.05,0.1],weight_list=[0.2,0.3,0.5])",
+        ]:
+            autograd_opt = ParameterDict()
+            autograd_opt["kernel"] = kernel
+            analytic_opt = ParameterDict()
+            analytic_opt["kernel"] = kernel
+            analytic_opt["evolve_mode"] = "analytic"
+            input = (
+                self.momentum.clone().requires_grad_(),
+                self.control_points.clone().requires_grad_(),
+            )
+            autograd_forward = LDDMMHamilton(autograd_opt)(t=1.0, input=input)
+            analytic_forward = LDDMMHamilton(analytic_opt)(t=1.0, input=input)
+            self.compare_tensors(
+                autograd_forward, analytic_forward, rtol=1e-3, atol=1e-5
+            )
+            for i in range(2):
+                autograd_backward = grad(
+                    autograd_forward[i].mean(), input, retain_graph=True
+                )
+                analytic_backward = grad(
+                    analytic_forward[i].mean(), input, retain_graph=True
+                )
+                self.compare_tensors(
+                    autograd_backward, analytic_backward, rtol=1e-3, atol=1e-5
+                )
+
+
+def run_by_name(test_name, test_case=Test_Kernels):
     suite = unittest.TestSuite()
-    suite.addTest(Test_Kernels(test_name))
+    suite.addTest(test_case(test_name))
     runner = unittest.TextTestRunner()
     runner.run(suite)
 
 
 if __name__ == "__main__":
     run_by_name("test_lddmm_shooting")
+    run_by_name("test_lddmm_analytic_evolve", Test_Analytic_Evolve)
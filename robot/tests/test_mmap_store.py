@@ -0,0 +1,94 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from robot.datasets.mmap_store import MMapShapeStore, build_mmap_store, open_mmap_store
+
+np.random.seed(123)
+
+
+def fake_preprocess(file_info):
+    npoints = file_info["npoints"]
+    return {
+        "points": np.random.rand(npoints, 3).astype(np.float32),
+        "weights": np.ones([npoints, 1], dtype=np.float32) / npoints,
+        "extra_info": {"scale": np.array(2.0), "shift": np.zeros(3)},
+    }
+
+
+class Test_MMap_Store(unittest.TestCase):
+    def setUp(self):
+        self.store_path = tempfile.mkdtemp()
+        self.file_info_dict = {
+            "shape_{}".format(i): {"npoints": 100 + 50 * i} for i in range(5)
+        }
+        self.case_dicts = {}
+
+        def preprocess(file_info):
+            case_dict = fake_preprocess(file_info)
+            self.case_dicts[file_info["npoints"]] = case_dict
+            return case_dict
+
+        self.store = build_mmap_store(
+            self.file_info_dict, self.store_path, preprocess, num_workers=1
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.store_path)
+
+    def test_read_back(self):
+        self.assertEqual(len(self.store), 5)
+        for name, file_info in self.file_info_dict.items():
+            case_dict = self.store.get(name)
+            ref_dict = self.case_dicts[file_info["npoints"]]
+            np.testing.assert_array_equal(case_dict["points"], ref_dict["points"])
+            np.testing.assert_array_equal(case_dict["weights"], ref_dict["weights"])
+            self.assertEqual(case_dict["extra_info"]["scale"], 2.0)
+            self.assertEqual(case_dict["extra_info"]["shift"].shape, (3,))
+
+    def test_pickle_and_write(self):
+        store = pickle.loads(pickle.dumps(self.store))
+        points = store.get("shape_1")["points"]
+        torch.from_numpy(points)[:] = 0  # copy-on-write, the file is untouched
+        reopened = MMapShapeStore(self.store_path)
+        self.assertTrue((reopened.get("shape_1")["points"] != 0).any())
+
+    def test_open_stale(self):
+        n_call = []
+
+        def preprocess(file_info):
+            n_call.append(1)
+            return fake_preprocess(file_info)
+
+        store = open_mmap_store(self.store_path, self.file_info_dict, preprocess, {})
+        self.assertEqual((len(store), len(n_call)), (5, 0))
+        # built with another reader
+        store = open_mmap_store(
+            self.store_path, self.file_info_dict, preprocess, {"reader": "a"}, num_workers=1
+        )
+        self.assertEqual((store.build_info, len(n_call)), ({"reader": "a"}, 5))
+        # a shape is missing
+        file_info_dict = dict(self.file_info_dict, shape_5={"npoints": 10})
+        store = open_mmap_store(
+            self.store_path, file_info_dict, preprocess, {"reader": "a"}, num_workers=1
+        )
+        self.assertEqual((len(store), len(n_call)), (6, 11))
+        self.assertEqual(store.get("shape_5")["points"].shape, (10, 3))
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_MMap_Store(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_read_back")
+    run_by_name("test_pickle_and_write")
+    run_by_name("test_open_stale")
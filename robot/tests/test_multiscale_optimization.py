@@ -0,0 +1,164 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import tempfile
+import torch
+import unittest
+from robot.global_variable import Shape, MODEL_POOL
+from robot.utils.module_parameters import ParameterDict
+from robot.shape.shape_pair_utils import create_shape_pair
+from robot.shape.point_pyramid import get_point_pyramid
+from robot.models_reg.multiscale_optimization import build_multi_scale_solver
+
+torch.backends.cudnn.deterministic = True
+
+
+class Test_Multiscale_Optimization(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(123)
+        N = 300
+        self.source, self.target = Shape(), Shape()
+        self.source.set_data(points=torch.rand(1, N, 3), weights=torch.ones(1, N, 1) / N)
+        self.target.set_data(
+            points=torch.rand(1, N, 3) * 0.8 + 0.1, weights=torch.ones(1, N, 1) / N
+        )
+        self.geom_obj = "sinkhorn_utils.SinkhornEngine(blur=0.01, scaling=0.8)"
+
+    def tearDown(self):
+        pass
+
+    def solver_opt(self, ext=None):
+        opt = ParameterDict()
+        opt.ext = dict(
+            {
+                "point_grid_scales": [0.3, 0.15],
+                "iter_per_scale": [1, 1],
+                "rel_ftol_per_scale": [1e-9, 1e-9],
+                "init_lr_per_scale": [1e-4, 1e-4],
+                "shape_sampler_type": "point_grid",
+                "use_point_pyramid": True,
+                "save_res": False,
+                "record_path": tempfile.mkdtemp(),
+            },
+            **(ext or {})
+        )
+        return opt
+
+    def model_opt(self, ext):
+        opt = ParameterDict()
+        opt.ext = dict(
+            {
+                "sim_loss": {
+                    "loss_list": ["geomloss"],
+                    "geomloss": {"attr": "points", "geom_obj": self.geom_obj},
+                }
+            },
+            **ext
+        )
+        return opt
+
+    def run_solver(self, model, solver_opt):
+        """
+        :return: the registered shape pair, list of (low, high) reg_param of the parent prolongations
+        """
+        updates = []
+        parent_param_updater = model.update_reg_param_from_parent
+
+        def update_reg_param_from_parent(shape_pair_low, shape_pair_high, source_pyramid, level):
+            reg_param_low = shape_pair_low.reg_param.detach().clone()
+            shape_pair_high = parent_param_updater(
+                shape_pair_low, shape_pair_high, source_pyramid, level
+            )
+            self.assertIs(shape_pair_high.source, source_pyramid.level(level + 1))
+            updates.append((reg_param_low, shape_pair_high.reg_param.detach().clone()))
+            return shape_pair_high
+
+        model.update_reg_param_from_parent = update_reg_param_from_parent
+        solver = build_multi_scale_solver(solver_opt, model)
+        shape_pair = solver(create_shape_pair(self.source, self.target))
+        return shape_pair, updates
+
+    def test_gradient_flow_parent_update(self):
+        model = MODEL_POOL["gradient_flow_opt"](
+            self.model_opt(
+                {
+                    "interpolator_obj": "point_interpolator.nadwat_kernel_interpolator(scale=0.1, exp_order=2)"
+                }
+            )
+        )
+        shape_pair, updates = self.run_solver(model, self.solver_opt())
+        # 0.3 -> 0.15 and 0.15 -> the original resolution
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(updates[-1][1].shape, self.source.points.shape)
+        self.assertEqual(shape_pair.flowed.points.shape, self.source.points.shape)
+        self.assertTrue(torch.isfinite(shape_pair.flowed.points).all())
+
+    def test_barycenter_parent_update(self):
+        model = MODEL_POOL["barycenter_opt"](self.model_opt({}))
+        shape_pair, updates = self.run_solver(model, self.solver_opt())
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(shape_pair.flowed.points.shape, self.source.points.shape)
+        self.assertTrue(torch.isfinite(shape_pair.flowed.points).all())
+
+    def test_probreg_parent_update(self):
+        # the probreg solver needs the third party package, only the upsampling and the final flow are checked
+        model = MODEL_POOL["probreg_opt"](ParameterDict())
+        pyramid = get_point_pyramid(self.source, [0.15])
+        shape_pair_low = create_shape_pair(pyramid.level(0), self.target)
+        model.init_reg_param(shape_pair_low)
+        disp_low = torch.rand_like(shape_pair_low.reg_param) * 0.01
+        shape_pair_low.reg_param = (shape_pair_low.reg_param + disp_low).detach()
+        shape_pair_high = model.update_reg_param_from_parent(
+            shape_pair_low, create_shape_pair(self.source, self.target), pyramid, 0
+        )
+        torch.testing.assert_close(
+            shape_pair_high.flowed_control_points,
+            self.source.points + pyramid.prolongate(disp_low, 0),
+        )
+        shape_pair_high = model.flow(shape_pair_high)
+        self.assertEqual(shape_pair_high.flowed.points.shape, self.source.points.shape)
+
+    def test_lddmm_parent_update(self):
+        model = MODEL_POOL["lddmm_opt"](
+            self.model_opt(
+                {
+                    "module": "hamiltonian",
+                    "hamiltonian": {
+                        "kernel": "torch_kernels.TorchKernel(kernel_type='gauss', sigma=0.1)"
+                    },
+                    "integrator": {
+                        "solver": "rk4",
+                        "adjoin_on": False,
+                        "number_of_time_steps": 2,
+                    },
+                }
+            )
+        )
+        solver_opt = self.solver_opt(
+            {
+                "stragtegy": "use_optimizer_defined_here",
+                "optim": {"type": "sgd"},
+                "scheduler": {"type": "step_lr", "step_lr": {"gamma": 0.5, "step_size": 80}},
+            }
+        )
+        shape_pair, updates = self.run_solver(model, solver_opt)
+        self.assertEqual(len(updates), 2)
+        for reg_param_low, reg_param_high in updates:
+            # the momentum of each parent is split among its children
+            torch.testing.assert_close(reg_param_low.sum(1), reg_param_high.sum(1))
+        self.assertEqual(shape_pair.flowed.points.shape, self.source.points.shape)
+        self.assertTrue(torch.isfinite(shape_pair.flowed.points).all())
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Multiscale_Optimization(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_gradient_flow_parent_update")
+    run_by_name("test_barycenter_parent_update")
+    run_by_name("test_probreg_parent_update")
+    run_by_name("test_lddmm_parent_update")
@@ -0,0 +1,103 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+from torch.autograd import grad
+import unittest
+from robot.modules_reg.module_lddmm import LDDMMHamilton
+from robot.modules_reg.ode_int import ODEBlock, checkpoint_interval
+from robot.utils.module_parameters import ParameterDict
+
+torch.backends.cudnn.deterministic = True
+
+
+class Test_ODE_Int(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(123)
+        B, N, K, D = 2, 200, 300, 3
+        self.control_points = torch.rand(B, N, D, dtype=torch.float64)
+        self.momentum = (torch.rand(B, N, D, dtype=torch.float64) - 0.5) * 0.1
+        self.toflow = torch.rand(B, K, D, dtype=torch.float64)
+
+    def tearDown(self):
+        pass
+
+    def solve(self, solver, evolve_mode="autograd", checkpoint_every=0, n_step=10):
+        lddmm_opt = ParameterDict()
+        lddmm_opt["kernel"] = "torch_kernels.TorchKernel('gauss',sigma=0.1)"
+        lddmm_opt["evolve_mode"] = evolve_mode
+        lddmm_module = LDDMMHamilton(lddmm_opt)
+        lddmm_module.set_mode("flow")
+        integrator_opt = ParameterDict()
+        integrator_opt["solver"] = solver
+        integrator_opt["adjoin_on"] = False
+        integrator_opt["number_of_time_steps"] = n_step
+        integrator_opt["checkpoint_every"] = checkpoint_every
+        integrator = ODEBlock(integrator_opt)
+        integrator.set_func(lddmm_module)
+        momentum = self.momentum.clone().requires_grad_()
+        control_points = self.control_points.clone().requires_grad_()
+        output = tuple(integrator.solve((momentum, control_points, self.toflow)))
+        grads = grad(output[2].sum(), (momentum, control_points))
+        return output, grads
+
+    def test_rk4_checkpoint(self):
+        ref_output, ref_grads = self.solve("rk4")
+        for evolve_mode in ["autograd", "analytic"]:
+            for checkpoint_every in [0, 3]:
+                output, grads = self.solve(
+                    "rk4_checkpoint", evolve_mode, checkpoint_every
+                )
+                # torchdiffeq rk4 is the 3/8 rule variant, same order
+                for tensor, ref_tensor in zip(output + grads, ref_output + ref_grads):
+                    torch.testing.assert_close(tensor, ref_tensor, rtol=1e-4, atol=1e-5)
+
+    def test_symplectic(self):
+        ref_output, _ = self.solve("rk4", n_step=40)
+        for solver, order in [("symplectic_euler", 1), ("leapfrog", 2)]:
+            output, grads = self.solve(solver, "analytic", checkpoint_every=4)
+            _, no_ckpt_grads = self.solve(solver, "analytic")
+            half_step_output, _ = self.solve(solver, "analytic", n_step=20)
+            for tensor, half_step_tensor, ref_tensor in zip(
+                output, half_step_output, ref_output
+            ):
+                # richardson estimate of the global error at this step size, err(dt) ~ C*dt^order
+                err = (tensor - half_step_tensor).abs().max() * 2 ** order / (2 ** order - 1)
+                tol = 1.5 * err.item()
+                torch.testing.assert_close(tensor, ref_tensor, rtol=0, atol=tol)
+            for tensor, ref_tensor in zip(grads, no_ckpt_grads):
+                torch.testing.assert_close(tensor, ref_tensor)
+
+    def test_hamiltonian_conservation(self):
+        lddmm_opt = ParameterDict()
+        lddmm_opt["kernel"] = "torch_kernels.TorchKernel('gauss',sigma=0.1)"
+        hamiltonian = LDDMMHamilton(lddmm_opt).hamiltonian
+        init_energy = hamiltonian(self.momentum, self.control_points)
+        drift = {}
+        for solver, order in [("symplectic_euler", 1), ("leapfrog", 2)]:
+            for n_step in [10, 20]:
+                output, _ = self.solve(solver, "analytic", n_step=n_step)
+                energy = hamiltonian(output[0], output[1])
+                drift[solver, n_step] = ((energy - init_energy).abs() / init_energy).item()
+            # the energy error decays at the order of the scheme
+            self.assertGreater(drift[solver, 10] / drift[solver, 20], 0.8 * 2 ** order)
+        self.assertLess(drift["leapfrog", 10], 0.1 * drift["symplectic_euler", 10])
+
+    def test_checkpoint_interval(self):
+        self.assertEqual(checkpoint_interval(100, 1000, 4, -1), 4)
+        self.assertEqual(checkpoint_interval(100, 2 ** 20, 4, 1000), 0)
+        self.assertEqual(checkpoint_interval(100, 2 ** 20, 4, 100), 4)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_ODE_Int(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_rk4_checkpoint")
+    run_by_name("test_symplectic")
+    run_by_name("test_hamiltonian_conservation")
+    run_by_name("test_checkpoint_interval")
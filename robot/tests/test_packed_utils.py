@@ -0,0 +1,115 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.utils.packed_utils import (
+    PackedKernel,
+    lengths_to_offsets,
+    offsets_to_batch_index,
+    packed_to_padded,
+    padded_to_packed,
+    segment_mean,
+)
+from robot.kernels.torch_kernels import TorchKernel
+from robot.shape.point_cloud import PointCloud
+from robot.shape.point_sampler import packed_grid_sampler
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Packed_Utils(unittest.TestCase):
+    def setUp(self):
+        D = 3
+        self.lengths = [300, 120, 200]
+        self.col_lengths = [150, 260, 90]
+        self.offsets = lengths_to_offsets(self.lengths)
+        self.col_offsets = lengths_to_offsets(self.col_lengths)
+        self.x = torch.rand(sum(self.lengths), D, dtype=torch.float64)
+        self.y = torch.rand(sum(self.col_lengths), D, dtype=torch.float64)
+        self.b = torch.rand(sum(self.col_lengths), 2, dtype=torch.float64)
+
+    def tearDown(self):
+        pass
+
+    def test_pack_and_pad(self):
+        padded = packed_to_padded(self.x, self.offsets)
+        self.assertEqual(padded.shape, (3, 300, 3))
+        self.assertTrue((padded[1, 120:] == 0).all())
+        packed, offsets = padded_to_packed(padded, self.lengths)
+        self.assertTrue(torch.equal(packed, self.x))
+        self.assertTrue(torch.equal(offsets, self.offsets))
+        batch_index = offsets_to_batch_index(self.offsets)
+        mean = segment_mean(self.x, batch_index, 3)
+        torch.testing.assert_close(mean[2], self.x[420:].mean(0))
+
+    def test_packed_kernel(self):
+        kernel = TorchKernel("gauss", sigma=0.1)
+        output = PackedKernel(kernel)(
+            self.x, self.y, self.b, row_offsets=self.offsets, col_offsets=self.col_offsets
+        )
+        for i in range(3):
+            x = self.x[self.offsets[i] : self.offsets[i + 1]][None]
+            y = self.y[self.col_offsets[i] : self.col_offsets[i + 1]][None]
+            b = self.b[self.col_offsets[i] : self.col_offsets[i + 1]][None]
+            torch.testing.assert_close(
+                output[self.offsets[i] : self.offsets[i + 1]], kernel(x, y, b)[0]
+            )
+        # the rows and the columns are different arguments, the padded columns do not contribute
+        kernel = TorchKernel("gauss_grad", sigma=0.1)
+        px = self.x.clone().requires_grad_()
+        py = torch.rand_like(self.y)
+        output = PackedKernel(kernel, row_args=(0, 1))(
+            px, self.x, py, self.y, row_offsets=self.offsets, col_offsets=self.col_offsets
+        )
+        (grad,) = torch.autograd.grad(output.sum(), px)
+        for i in range(3):
+            rows = slice(self.offsets[i], self.offsets[i + 1])
+            cols = slice(self.col_offsets[i], self.col_offsets[i + 1])
+            b_px = self.x[rows][None].clone().requires_grad_()
+            b_output = kernel(b_px, self.x[rows][None], py[cols][None], self.y[cols][None])
+            torch.testing.assert_close(output[rows], b_output[0])
+            torch.testing.assert_close(
+                grad[rows], torch.autograd.grad(b_output.sum(), b_px)[0][0]
+            )
+
+    def test_shape_from_packed(self):
+        shape = PointCloud().set_data_from_packed(self.offsets, points=self.x)
+        self.assertTrue(torch.equal(shape.get_lengths(), torch.tensor(self.lengths)))
+        torch.testing.assert_close(
+            shape.weights.sum(1)[:, 0], torch.ones(3, dtype=shape.weights.dtype)
+        )
+        self.assertTrue((shape.weights[1, 120:] == 0).all())
+        packed, offsets = shape.to_packed()
+        self.assertTrue(torch.equal(packed, self.x))
+
+    def test_packed_grid_sampler(self):
+        scale = 0.2
+        batch_index = offsets_to_batch_index(self.offsets)
+        points, weights, _, sampled_batch_index, index = packed_grid_sampler(scale)(
+            self.x, batch_index
+        )
+        self.assertAlmostEqual(float(weights.sum()), float(len(self.x)))
+        for i in range(3):
+            x = self.x[self.offsets[i] : self.offsets[i + 1]]
+            voxel = ((x - x.min(0)[0]) / scale).floor()
+            n_voxel = len(torch.unique(voxel, dim=0))
+            self.assertEqual(int((sampled_batch_index == i).sum()), n_voxel)
+        torch.testing.assert_close(
+            points[index[0]], self.x[index == index[0]].mean(0)
+        )
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Packed_Utils(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_pack_and_pad")
+    run_by_name("test_packed_kernel")
+    run_by_name("test_shape_from_packed")
+    run_by_name("test_packed_grid_sampler")
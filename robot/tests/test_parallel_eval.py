@@ -0,0 +1,159 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import glob
+import json
+import tempfile
+import unittest
+import torch
+from robot.utils.module_parameters import ParameterDict
+from robot.models_reg.model_opt import OptModel
+from robot.pipeline.build_model import build_model
+from robot.pipeline.parallel_eval import load_progress, eval_phase_in_parallel
+from robot.utils.result_archive import (
+    ResultArchive,
+    init_result_archive,
+    close_result_archive,
+)
+
+
+class Test_Parallel_Eval(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.progress_path = os.path.join(self.folder, "eval_progress.jsonl")
+        with open(self.progress_path, "w") as f:
+            for i in range(3):
+                result = {
+                    "index": i,
+                    "pair_name": ["pair{}".format(i)],
+                    "score": float(i),
+                    "detailed_scores": {"score": [float(i)]},
+                    "eval_metrics": {"score": [float(i)]},
+                    "batch_time": 1.0,
+                    "batch_size": 1,
+                    "worker_id": 0,
+                }
+                f.write(json.dumps(result) + "\n")
+
+    def tearDown(self):
+        pass
+
+    def test_load_progress(self):
+        progress = load_progress(self.progress_path)
+        self.assertEqual(set(progress.keys()), {("pair0",), ("pair1",), ("pair2",)})
+        self.assertEqual(load_progress(os.path.join(self.folder, "missing.jsonl")), {})
+
+    def test_resume(self):
+        # all the pairs are done, the batches are restored from the progress file without running the workers
+        opt = ParameterDict()
+        opt["path"] = {}
+        opt["path"]["model_load_path"] = ""
+        model = OptModel()
+        model.caches = {}
+        dataloader = [{"pair_name": ["pair{}".format(i)]} for i in [2, 0, 1]]
+        results = eval_phase_in_parallel(
+            opt, model, dataloader, "test", "cpu", [-1], 2, 1, self.progress_path, resume=True
+        )
+        self.assertEqual([result["index"] for result in results], [0, 1, 2])
+        self.assertEqual([result["pair_name"] for result in results], [["pair2"], ["pair0"], ["pair1"]])
+        self.assertEqual(model.caches["pair_name"], ["pair2", "pair0", "pair1"])
+        self.assertEqual(model.caches["score"], [2.0, 0.0, 1.0])
+        self.assertEqual(len(load_progress(self.progress_path)), 3)
+
+    def test_spawned_workers(self):
+        geom_obj = "sinkhorn_utils.SinkhornEngine(blur=0.01, scaling=0.8, reach=1)"
+        opt = ParameterDict()
+        opt.ext = {
+            "path": {
+                "check_point_path": self.folder,
+                "record_path": self.folder,
+                "model_load_path": "",
+            },
+            "model": "optimization",
+            "method_name": "gradient_flow_opt",
+            "gradient_flow_opt": {
+                "geom_loss_opt_for_eval": {"attr": "points", "mode": "soft", "geom_obj": geom_obj},
+                "sim_loss": {
+                    "loss_list": ["geomloss"],
+                    "geomloss": {"attr": "points", "geom_obj": geom_obj},
+                },
+            },
+            "multi_scale_optimization": {
+                "point_grid_scales": [-1],
+                "iter_per_scale": [2],
+                "save_res": False,
+            },
+            "shape_writer_workers": 0,
+            "shape_writer_queue_size": 16,
+            "save_result_as_archive": True,
+            "result_archive_float16": False,
+            "profile": False,
+            "profile_sync_cuda": False,
+        }
+        generator = torch.Generator().manual_seed(0)
+        N = 200
+
+        def shape():
+            return {
+                "points": torch.rand(1, N, 3, generator=generator),
+                "weights": torch.ones(1, N, 1) / N,
+            }
+
+        dataloader = [
+            {
+                "pair_name": ["toy{}".format(i)],
+                "source": shape(),
+                "target": shape(),
+                "source_info": {},
+                "target_info": {},
+            }
+            for i in range(4)
+        ]
+        # an unreadable archive left by an earlier run, the worker rolls over to a new one
+        with open(os.path.join(self.folder, "results_worker0.rba"), "wb") as f:
+            f.write(b"0" * 100)
+        model = build_model(opt, "cpu", None)
+        results = eval_phase_in_parallel(
+            opt, model, dataloader, "test", "cpu", [-1], 2, 1, self.progress_path
+        )
+        # the serial evaluation of test_model.eval_model
+        init_result_archive(opt, self.folder, "results_serial.rba")
+        for result, data in zip(results, dataloader):
+            model.set_test()
+            test_res = model.get_evaluation(model.set_input(data, "cpu", "test"))
+            score, detailed_scores = model.analyze_res(test_res, cache_res=False)
+            self.assertEqual(result["pair_name"], data["pair_name"])
+            self.assertAlmostEqual(result["score"], float(score), places=5)
+            for metric, metric_score in detailed_scores.items():
+                if metric == "forward_t":  # timing
+                    continue
+                self.assertAlmostEqual(
+                    result["detailed_scores"][metric][0], float(metric_score[0]), places=5
+                )
+        close_result_archive()
+        self.assertEqual(
+            sorted(ResultArchive(os.path.join(self.folder, "results_serial.rba")).pair_names),
+            ["toy0", "toy1", "toy2", "toy3"],
+        )
+        self.assertTrue({result["worker_id"] for result in results} <= {0, 1})
+        self.assertEqual(model.caches["pair_name"], ["toy0", "toy1", "toy2", "toy3"])
+        archived_pairs = []
+        for archive_path in glob.glob(os.path.join(self.folder, "results_worker*_*.rba")) + [
+            os.path.join(self.folder, "results_worker1.rba")
+        ]:
+            archived_pairs += ResultArchive(archive_path).pair_names
+        self.assertEqual(sorted(archived_pairs), ["toy0", "toy1", "toy2", "toy3"])
+        self.assertEqual(os.path.getsize(os.path.join(self.folder, "results_worker0.rba")), 100)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Parallel_Eval(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_load_progress")
+    run_by_name("test_resume")
+    run_by_name("test_spawned_workers")
@@ -0,0 +1,86 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.global_variable import Shape
+from robot.shape.point_pyramid import get_point_pyramid, PointPyramidCache
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Point_Pyramid(unittest.TestCase):
+    def setUp(self):
+        self.lengths = [800, 500]
+        points = torch.rand(2, 800, 3)
+        self.shape = Shape()
+        self.shape.set_data(points=points, lengths=torch.tensor(self.lengths))
+
+    def tearDown(self):
+        pass
+
+    def test_nested_levels(self):
+        pyramid = get_point_pyramid(self.shape, [0.4, 0.2])
+        self.assertEqual(len(pyramid), 3)
+        self.assertIs(pyramid.level(2), self.shape)
+        for i in range(2):
+            coarse, fine = pyramid.level(i), pyramid.level(i + 1)
+            torch.testing.assert_close(coarse.weights.sum(1), fine.weights.sum(1))
+            # the coarse points are the weighted mean of their children
+            torch.testing.assert_close(
+                pyramid.pool(fine.points, i)[1, : coarse.get_lengths()[1]],
+                coarse.points[1, : coarse.get_lengths()[1]],
+            )
+            prolongated = pyramid.prolongate(coarse.points, i)
+            self.assertEqual(prolongated.shape, fine.points.shape)
+            torch.testing.assert_close(
+                pyramid.pool(prolongated, i)[0], coarse.points[0]
+            )
+            torch.testing.assert_close(
+                pyramid.prolongate(coarse.weights, i) * pyramid.weight_ratio(i),
+                fine.weights,
+            )
+        self.assertIs(get_point_pyramid(self.shape, [0.4, 0.2]), pyramid)
+        self.assertIs(get_point_pyramid(self.shape, [0.4, 0.2, -1]).level(2), self.shape)
+
+    def test_cache_invalidation(self):
+        pyramid = get_point_pyramid(self.shape, [0.4, 0.2])
+        weights = torch.rand_like(self.shape.weights) * (self.shape.weights > 0)
+        self.shape.weights = weights
+        new_pyramid = get_point_pyramid(self.shape, [0.4, 0.2])
+        self.assertIsNot(new_pyramid, pyramid)
+        torch.testing.assert_close(
+            new_pyramid.level(0).weights.sum(1), weights.sum(1)
+        )
+        self.shape.weights.mul_(2)
+        self.assertIsNot(get_point_pyramid(self.shape, [0.4, 0.2]), new_pyramid)
+
+    def test_content_cache(self):
+        pyramid_cache = PointPyramidCache(max_size=2)
+        pyramid = pyramid_cache.get(self.shape, [0.4, 0.2])
+        # the same content reloaded as a new shape, e.g. the atlas of the next pair
+        shape = Shape()
+        shape.set_data(points=self.shape.points.clone(), lengths=torch.tensor(self.lengths))
+        reloaded = pyramid_cache.get(shape, [0.4, 0.2])
+        self.assertIs(reloaded.level(0), pyramid.level(0))
+        self.assertIs(reloaded.level(2), shape)
+        other = Shape()
+        other.set_data(points=torch.rand(2, 800, 3), lengths=torch.tensor(self.lengths))
+        self.assertIsNot(pyramid_cache.get(other, [0.4, 0.2]).level(0), pyramid.level(0))
+        pyramid_cache.get(Shape().set_data(points=torch.rand(1, 100, 3)), [0.4, 0.2])
+        self.assertEqual(len(pyramid_cache.pyramids), 2)
+        self.assertIsNot(pyramid_cache.get(shape, [0.4, 0.2]).level(0), pyramid.level(0))
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Point_Pyramid(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_nested_levels")
+    run_by_name("test_cache_invalidation")
+    run_by_name("test_content_cache")
@@ -0,0 +1,95 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.shape.point_sampler import (
+    batch_grid_sampler,
+    batch_uniform_sampler,
+    grid_sampler,
+    gumbel_topk_sample,
+    uniform_sampler,
+)
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Point_Sampler(unittest.TestCase):
+    def setUp(self):
+        self.points = torch.rand(2, 1000, 3)
+        self.weights = torch.rand(2, 1000, 1)
+        self.weights[:, :500] = 0.0
+
+    def tearDown(self):
+        pass
+
+    def test_without_replacement(self):
+        index = gumbel_topk_sample(self.weights[..., 0], 400)
+        for b in range(2):
+            self.assertEqual(len(torch.unique(index[b])), 400)
+            self.assertTrue((index[b] >= 500).all())  # zero-weight points are not sampled
+        index = gumbel_topk_sample(self.weights[..., 0], 600)
+        self.assertTrue(((index < 500).sum(1) == 100).all())
+        self.assertEqual(gumbel_topk_sample(self.weights[..., 0], 2000).shape, (2, 2000))
+
+    def test_inclusion_probability(self):
+        # a single draw follows the normalized weights
+        weights = torch.tensor([[1.0, 2.0, 3.0, 4.0]]).repeat(20000, 1)
+        generator = torch.Generator().manual_seed(0)
+        index = gumbel_topk_sample(weights, 1, generator)
+        freq = torch.bincount(index[:, 0], minlength=4).float() / len(index)
+        torch.testing.assert_close(freq, weights[0] / weights[0].sum(), rtol=0, atol=0.02)
+
+    def test_batch_sampler(self):
+        sampler = batch_uniform_sampler(300, fixed_random_seed=False)
+        points, weights, index = sampler(self.points, self.weights)
+        self.assertEqual(points.shape, (2, 300, 3))
+        torch.testing.assert_close(points[1], self.points[1][index[1]])
+        torch.testing.assert_close(weights[1], self.weights[1][index[1]])
+        fixed_sampler = uniform_sampler(300, fixed_random_seed=True)
+        index1 = fixed_sampler(self.points[0], self.weights[0])[2]
+        index2 = fixed_sampler(self.points[0], self.weights[0])[2]
+        self.assertTrue((index1 == index2).all())
+        generator = torch.Generator().manual_seed(1)
+        sampler = batch_uniform_sampler(300, generator=generator)
+        index1 = sampler(self.points, self.weights)[2]
+        index2 = sampler(self.points, self.weights)[2]
+        self.assertFalse((index1 == index2).all())
+
+    def test_grid_sampler(self):
+        scale = 0.25
+        points, weights, index = grid_sampler(scale)(self.points[0], self.weights[0])
+        voxel = ((self.points[0] - self.points[0].min(0)[0]) / scale).floor()
+        self.assertEqual(len(points), len(torch.unique(voxel, dim=0)))
+        self.assertTrue((voxel[index == index[-1]] == voxel[-1]).all())
+        torch.testing.assert_close(weights.sum(), self.weights[0].sum())
+        cluster = index == index[-1]
+        torch.testing.assert_close(
+            points[index[-1]],
+            (self.points[0][cluster] * self.weights[0][cluster]).sum(0)
+            / self.weights[0][cluster].sum(),
+        )
+        batch_points, batch_weights, batch_index = batch_grid_sampler(scale)(
+            self.points, self.weights
+        )
+        self.assertEqual(batch_index.shape, (2, 1000))
+        torch.testing.assert_close(batch_points[0, : len(points)], points)
+        torch.testing.assert_close(batch_weights[0, : len(points)], weights)
+        sampled, _, _ = grid_sampler(scale)(self.points[1], self.weights[1])
+        torch.testing.assert_close(batch_points[1, : len(sampled)], sampled)
+        self.assertTrue((batch_weights[1, len(sampled) :] == 0).all())
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Point_Sampler(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_without_replacement")
+    run_by_name("test_inclusion_probability")
+    run_by_name("test_batch_sampler")
+    run_by_name("test_grid_sampler")
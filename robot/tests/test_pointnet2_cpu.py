@@ -0,0 +1,97 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from torch.autograd import gradcheck
+import pointnet2.lib.pointnet2_utils as pointnet2_utils
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Pointnet2_CPU(unittest.TestCase):
+    def setUp(self):
+        B = 2
+        N = 200
+        M = 50
+        C = 4
+        self.xyz = torch.rand(B, N, 3)
+        self.new_xyz = torch.rand(B, M, 3)
+        self.features = torch.rand(B, C, N, dtype=torch.float64, requires_grad=True)
+
+    def tearDown(self):
+        pass
+
+    def test_furthest_point_sample(self):
+        npoint = 20
+        idx = pointnet2_utils.furthest_point_sample(self.xyz, npoint)
+        self.assertEqual(idx.dtype, torch.int32)
+        for b in range(self.xyz.shape[0]):
+            selected = [0]
+            min_dist = ((self.xyz[b] - self.xyz[b, 0]) ** 2).sum(-1)
+            for i in range(1, npoint):
+                selected.append(int(min_dist.argmax()))
+                dist = ((self.xyz[b] - self.xyz[b, selected[-1]]) ** 2).sum(-1)
+                min_dist = torch.minimum(min_dist, dist)
+            self.assertEqual(idx[b].tolist(), selected)
+
+    def test_knn(self):
+        dist, idx = pointnet2_utils.three_nn(self.new_xyz, self.xyz)
+        dist_ref, idx_ref = torch.cdist(self.new_xyz, self.xyz).topk(
+            3, dim=2, largest=False
+        )
+        torch.testing.assert_close(dist, dist_ref)
+        self.assertTrue((idx.long() == idx_ref).all())
+        dist, idx = pointnet2_utils.knn(8, self.new_xyz, self.xyz)
+        dist_ref, idx_ref = torch.cdist(self.new_xyz, self.xyz).topk(
+            8, dim=2, largest=False
+        )
+        torch.testing.assert_close(dist, dist_ref)
+
+    def test_ball_query(self):
+        radius, nsample = 0.2, 8
+        idx = pointnet2_utils.ball_query(radius, nsample, self.xyz, self.new_xyz)
+        for b in range(self.xyz.shape[0]):
+            for s in range(self.new_xyz.shape[1]):
+                dist2 = ((self.xyz[b] - self.new_xyz[b, s]) ** 2).sum(-1)
+                found = (dist2 < radius ** 2).nonzero()[:, 0][:nsample].tolist()
+                expected = found + [found[0] if found else 0] * (nsample - len(found))
+                self.assertEqual(idx[b, s].tolist(), expected)
+
+    def test_gather_grouping_interpolate_grad(self):
+        B, C, N = self.features.shape
+        M = self.new_xyz.shape[1]
+        idx = torch.randint(0, N, (B, M), dtype=torch.int32)
+        group_idx = torch.randint(0, N, (B, M, 6), dtype=torch.int32)
+        three_idx = torch.randint(0, N, (B, M, 3), dtype=torch.int32)
+        weight = torch.rand(B, M, 3, dtype=torch.float64)
+        self.assertTrue(
+            gradcheck(pointnet2_utils.gather_operation, (self.features, idx))
+        )
+        self.assertTrue(
+            gradcheck(pointnet2_utils.grouping_operation, (self.features, group_idx))
+        )
+        self.assertTrue(
+            gradcheck(
+                pointnet2_utils.three_interpolate, (self.features, three_idx, weight)
+            )
+        )
+        grouped = pointnet2_utils.grouping_operation(self.features, group_idx)
+        torch.testing.assert_close(
+            grouped[1, :, 3, 2], self.features[1, :, group_idx[1, 3, 2].long()]
+        )
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Pointnet2_CPU(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_furthest_point_sample")
+    run_by_name("test_knn")
+    run_by_name("test_ball_query")
+    run_by_name("test_gather_grouping_interpolate_grad")
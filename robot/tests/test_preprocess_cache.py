@@ -0,0 +1,90 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from robot.datasets.preprocess_cache import PreprocessCache, report_preprocess_cache
+from robot.datasets.mmap_store import build_mmap_store
+
+np.random.seed(123)
+
+
+class Test_Preprocess_Cache(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.data_path = tempfile.mkdtemp()
+        self.file_info_list = []
+        for i in range(4):
+            path = os.path.join(self.data_path, "shape_{}.npy".format(i))
+            np.save(path, np.random.rand(1000, 3))
+            self.file_info_list.append({"name": "shape_{}".format(i), "data_path": path})
+        self.n_call = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+        shutil.rmtree(self.data_path)
+
+    def preprocess(self, file_info):
+        self.n_call += 1
+        points = np.load(file_info["data_path"])
+        return {"points": points, "extra_info": {"scale": np.array(2.0)}}
+
+    def test_hit_and_key(self):
+        cache = PreprocessCache(self.cache_path, config="a")
+        for file_info in self.file_info_list:
+            cache(file_info, self.preprocess)
+        cache = PreprocessCache(self.cache_path, config="a")  # a new run
+        case_dict = cache(self.file_info_list[0], self.preprocess)
+        np.testing.assert_array_equal(
+            case_dict["points"], np.load(self.file_info_list[0]["data_path"])
+        )
+        self.assertEqual(case_dict["extra_info"]["scale"], 2.0)
+        self.assertEqual((cache.n_hit, self.n_call), (1, 4))
+        PreprocessCache(self.cache_path, config="b")(self.file_info_list[0], self.preprocess)
+        np.save(self.file_info_list[1]["data_path"], np.random.rand(10, 3))
+        cache(self.file_info_list[1], self.preprocess)
+        self.assertEqual(self.n_call, 6)
+
+    def test_evict(self):
+        entry_gb = 1000 * 3 * 8 / (1 << 30)
+        cache = PreprocessCache(self.cache_path, max_size_gb=entry_gb * 2.5)
+        for file_info in self.file_info_list:
+            cache(file_info, self.preprocess)
+        self.assertGreater(cache.n_evict, 0)
+        self.assertLessEqual(cache.size, cache.max_size)
+        self.assertLessEqual(len(os.listdir(self.cache_path)), 2)
+
+    def test_worker_stats(self):
+        cache = PreprocessCache(self.cache_path)
+        file_info_dict = {file_info["name"]: file_info for file_info in self.file_info_list}
+        preprocess = lambda file_info: cache(file_info, self.preprocess)
+        for i, expected in enumerate([(0, 4), (4, 0)]):
+            worker_stats = {}
+            build_mmap_store(
+                file_info_dict,
+                os.path.join(self.cache_path, "store_{}".format(i)),
+                preprocess,
+                num_workers=2,
+                stats_fn=cache.stats,
+                worker_stats=worker_stats,
+            )
+            # the statistics of the forked workers are summed by the parent
+            n_hit = sum(stats["hit"] for stats in worker_stats.values())
+            n_miss = sum(stats["miss"] for stats in worker_stats.values())
+            self.assertEqual((n_hit, n_miss), expected)
+            report_preprocess_cache(worker_stats.values())
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Preprocess_Cache(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_hit_and_key")
+    run_by_name("test_evict")
+    run_by_name("test_worker_stats")
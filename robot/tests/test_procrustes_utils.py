@@ -0,0 +1,87 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.utils.procrustes_utils import (
+    RobustTransformEstimator,
+    batch_icp,
+    homogeneous,
+)
+
+torch.backends.cudnn.deterministic = True
+
+
+def random_rotation(B, D):
+    q, _ = torch.linalg.qr(torch.randn(B, D, D, dtype=torch.float64))
+    q[:, :, 0] *= torch.det(q)[:, None]  # proper rotation
+    return q
+
+
+class Test_Procrustes_Utils(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(123)
+        B, N, D = 3, 500, 3
+        self.x = torch.rand(B, N, D, dtype=torch.float64)
+        rotation = random_rotation(B, D)
+        scale = torch.rand(B, 1, 1, dtype=torch.float64) + 0.5
+        translation = torch.rand(B, 1, D, dtype=torch.float64)
+        self.rigid = torch.cat([rotation, translation], 1)
+        self.similarity = torch.cat([rotation * scale, translation], 1)
+        self.affine = torch.cat(
+            [rotation + 0.2 * torch.rand(B, D, D, dtype=torch.float64), translation], 1
+        )
+
+    def tearDown(self):
+        pass
+
+    def test_closed_form(self):
+        for transform_type in ["rigid", "similarity", "affine"]:
+            A_gt = getattr(self, transform_type)
+            y = homogeneous(self.x) @ A_gt
+            A, transformed = RobustTransformEstimator(transform_type)(self.x, y)
+            torch.testing.assert_close(A, A_gt)
+            torch.testing.assert_close(transformed, y)
+
+    def test_robust_loss(self):
+        y = homogeneous(self.x) @ self.rigid
+        outlier = torch.rand_like(y[..., :1]) < 0.3
+        # the outlier offsets are clearly beyond the truncation threshold 1.0
+        y_noisy = torch.where(outlier, y + 1.5, y)
+        errors = {}
+        # the truncation threshold must keep the inliers of the initial l2 fit
+        robust_scales = {"l2": 1.0, "huber": 0.1, "geman_mcclure": 0.1, "truncated": 1.0}
+        for robust_loss, robust_scale in robust_scales.items():
+            A, _ = RobustTransformEstimator(
+                "rigid", robust_loss, robust_scale, n_irls_iter=50
+            )(self.x, y_noisy)
+            errors[robust_loss] = (A - self.rigid).abs().max().item()
+        # huber only bounds the influence of the outliers, the redescending losses reject them
+        self.assertLess(errors["huber"], 0.5 * errors["l2"])
+        self.assertLess(errors["geman_mcclure"], 1e-3)
+        self.assertLess(errors["truncated"], 1e-3)
+
+    def test_batch_icp(self):
+        B, D = self.x.shape[0], self.x.shape[2]
+        small_rotation = torch.linalg.matrix_exp(
+            0.1 * torch.tensor([[0.0, -1, 0], [1, 0, 0], [0, 0, 0]], dtype=torch.float64)
+        )
+        A_gt = torch.cat(
+            [small_rotation.repeat(B, 1, 1), 0.02 * torch.ones(B, 1, D, dtype=torch.float64)], 1
+        )
+        y = homogeneous(self.x) @ A_gt
+        A, transformed = batch_icp(max_iter=100, tol=1e-8)(self.x, y)
+        torch.testing.assert_close(A, A_gt, rtol=0, atol=1e-4)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Procrustes_Utils(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_closed_form")
+    run_by_name("test_robust_loss")
+    run_by_name("test_batch_icp")
@@ -0,0 +1,78 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import json
+import tempfile
+import unittest
+from robot.utils.profiler import (
+    enable_profiler,
+    get_profiler,
+    profile_context,
+    profile_span,
+    profiled_iter,
+)
+
+
+@profile_span("ot")
+def fake_ot():
+    return 1
+
+
+class FakeWriter(object):
+    def __init__(self):
+        self.scalars = {}
+
+    def add_scalar(self, tag, value, step):
+        self.scalars[tag] = value
+
+
+class Test_Profiler(unittest.TestCase):
+    def setUp(self):
+        get_profiler().reset()
+
+    def tearDown(self):
+        enable_profiler(False)
+        get_profiler().reset()
+
+    def test_disabled(self):
+        enable_profiler(False)
+        with profile_span("solver"):
+            fake_ot()
+        self.assertEqual(get_profiler().records, [])
+
+    def test_spans(self):
+        enable_profiler(True)
+        for scale in [0.1, -1]:
+            with profile_context(pair="pair_0", scale=scale):
+                with profile_span("solver"):
+                    fake_ot()
+                    fake_ot()
+        self.assertEqual(list(profiled_iter(range(3))), [0, 1, 2])
+        summary = get_profiler().summary(group_by="scale")
+        self.assertEqual(summary[0.1]["solver/ot"]["count"], 2)
+        self.assertEqual(summary[-1]["solver"]["count"], 1)
+        self.assertEqual(get_profiler().summary()["data_loading"]["count"], 4)
+        writer = FakeWriter()
+        get_profiler().log_to_tensorboard(writer, 0)
+        self.assertIn("time/solver/ot", writer.scalars)
+        writer = FakeWriter()
+        get_profiler().log_to_tensorboard(writer, 1)
+        self.assertEqual(writer.scalars, {})  # only the new records are logged
+        fpath = os.path.join(tempfile.mkdtemp(), "trace.json")
+        get_profiler().write_trace(fpath)
+        with open(fpath) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len(events), len(get_profiler().records))
+        self.assertEqual(events[0]["args"]["pair"], "pair_0")
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Profiler(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_disabled")
+    run_by_name("test_spans")
@@ -0,0 +1,106 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import tempfile
+import numpy as np
+import torch
+import unittest
+from robot.utils.result_archive import (
+    ResultArchive,
+    ResultArchiveWriter,
+    open_result_archive,
+    close_result_archive,
+)
+from robot.utils.shape_visual_utils import save_shape_into_file
+
+np.random.seed(123)
+
+
+class Test_Result_Archive(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.archive_path = os.path.join(self.folder, "results.rba")
+
+    def tearDown(self):
+        pass
+
+    def test_random_access(self):
+        points = np.random.rand(100, 3).astype(np.float32)
+        reg_param = np.random.rand(100, 3)
+        with ResultArchiveWriter(self.archive_path, meta={"method": "lddmm"}) as writer:
+            for i in range(3):
+                writer.write(
+                    "pair_{}".format(i),
+                    "iter_last",
+                    {"flowed/points": points + i, "reg_param/reg_param_vector": reg_param},
+                    meta={"score": float(i)},
+                )
+        with ResultArchiveWriter(self.archive_path, float16=True) as writer:
+            writer.write("pair_1", "iter_0", {"flowed/points": points})
+        archive = ResultArchive(self.archive_path)
+        self.assertEqual(archive.meta["method"], "lddmm")
+        self.assertEqual(archive.pair_names, ["pair_0", "pair_1", "pair_2"])
+        self.assertEqual(archive.stages("pair_1"), ["iter_last", "iter_0"])
+        np.testing.assert_equal(archive.get("pair_2", "iter_last", "flowed/points"), points + 2)
+        np.testing.assert_equal(
+            archive.get("pair_0", "iter_last", "reg_param")["reg_param_vector"], reg_param
+        )
+        self.assertEqual(archive.record_meta("pair_1", "iter_last")["score"], 1.0)
+        coarse = archive.get("pair_1", "iter_0", "flowed/points")
+        self.assertEqual(coarse.dtype, np.float16)
+        np.testing.assert_allclose(coarse, points, atol=1e-3)
+
+    def test_recover_unclosed(self):
+        points = np.random.rand(100, 3).astype(np.float32)
+        writer = ResultArchiveWriter(self.archive_path, meta={"method": "lddmm"})
+        for i in range(3):
+            writer.write("pair_{}".format(i), "iter_last", {"flowed/points": points + i})
+        # the run is killed in the middle of the last record, before the index is written
+        size = writer._file.tell()
+        with open(self.archive_path, "r+b") as f:
+            f.truncate(size - 100)
+        archive = ResultArchive(self.archive_path)
+        self.assertEqual(archive.meta["method"], "lddmm")
+        self.assertEqual(archive.pair_names, ["pair_0", "pair_1"])
+        np.testing.assert_equal(archive.get("pair_1", "iter_last", "flowed/points"), points + 1)
+        # the resumed run continues after the last complete record
+        with ResultArchiveWriter(self.archive_path) as writer:
+            writer.write("pair_2", "iter_last", {"flowed/points": points + 2})
+        archive = ResultArchive(self.archive_path)
+        self.assertEqual(archive.pair_names, ["pair_0", "pair_1", "pair_2"])
+        np.testing.assert_equal(archive.get("pair_2", "iter_last", "flowed/points"), points + 2)
+        not_archive_path = os.path.join(self.folder, "not_archive.rba")
+        with open(not_archive_path, "wb") as f:
+            f.write(b"0" * 100)
+        with self.assertRaises(ValueError):
+            ResultArchive(not_archive_path)
+
+    def test_shape_saving(self):
+        open_result_archive(self.archive_path, self.folder)
+        save_shape_into_file(
+            os.path.join(self.folder, "test", "iter_last"),
+            "flowed",
+            ["pair_0", "pair_1"],
+            points=torch.rand(2, 50, 3),
+            weights=torch.rand(2, 50, 1),
+        )
+        close_result_archive()
+        archive = ResultArchive(self.archive_path)
+        self.assertEqual(archive.stages("pair_1"), [os.path.join("test", "iter_last")])
+        self.assertEqual(
+            sorted(archive.get("pair_1", os.path.join("test", "iter_last"), "flowed")),
+            ["points", "weights"],
+        )
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Result_Archive(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_random_access")
+    run_by_name("test_recover_unclosed")
+    run_by_name("test_shape_saving")
@@ -0,0 +1,98 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import numpy as np
+import torch
+import unittest
+from robot.shape.point_cloud import PointCloud
+from robot.shape.shape_pair import ShapePair
+from robot.shape.shape_utils import get_scale_and_center
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Shape_Base(unittest.TestCase):
+    def setUp(self):
+        self.points = torch.rand(2, 100, 3)
+        self.pointfea = torch.rand(2, 100, 5)
+        self.shape = PointCloud().set_data(points=self.points, pointfea=self.pointfea)
+
+    def tearDown(self):
+        pass
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.shape, "__dict__"))
+        with self.assertRaises(AttributeError):
+            self.shape.not_an_attribute = 1
+
+    def test_view(self):
+        new_points = self.points + 1
+        view = self.shape.view(points=new_points)
+        self.assertIsInstance(view, PointCloud)
+        self.assertIs(view.pointfea, self.shape.pointfea)
+        self.assertIs(view.weights, self.shape.weights)
+        self.assertIs(view.points, new_points)
+        view.pointfea = torch.zeros(2, 100, 5)  # copy-on-write, the parent is untouched
+        self.assertIs(self.shape.pointfea, self.pointfea)
+        self.assertIs(self.shape.points, self.points)
+
+    def test_default_weights_not_shared(self):
+        other = PointCloud().set_data(points=torch.rand(2, 100, 3))
+        self.assertNotEqual(other.weights.data_ptr(), self.shape.weights.data_ptr())
+        other.weights.mul_(2)
+        torch.testing.assert_close(self.shape.weights.sum(1), torch.ones(2, 1))
+
+    def test_shape_pair_infer_flowed(self):
+        shape_pair = ShapePair(dense_mode=True)
+        shape_pair.set_source_and_target(self.shape, self.shape)
+        shape_pair.set_flowed_control_points(self.points * 2)
+        self.assertTrue(shape_pair.infer_flowed())
+        self.assertIs(shape_pair.flowed.pointfea, self.pointfea)
+        self.assertFalse(hasattr(shape_pair, "__dict__"))
+
+    def test_point_statistics_cache(self):
+        bounding_box = self.shape.get_bounding_box()
+        torch.testing.assert_close(bounding_box[..., 0], self.points.min(1)[0])
+        torch.testing.assert_close(bounding_box[..., 1], self.points.max(1)[0])
+        torch.testing.assert_close(self.shape.get_center(), self.points.mean(1, keepdim=True))
+        diameter = (self.points.max(1)[0] - self.points.min(1)[0]).max(1)[0]
+        torch.testing.assert_close(self.shape.get_diameter(), diameter)
+        self.assertIs(self.shape.get_bounding_box(), bounding_box)
+        view = self.shape.view(points=self.points * 2)
+        torch.testing.assert_close(view.get_diameter(), diameter * 2)
+        self.assertIs(self.shape.get_bounding_box(), bounding_box)
+        self.points.mul_(3)  # in place change invalidates the cache
+        torch.testing.assert_close(self.shape.get_diameter(), diameter * 3)
+
+    def test_point_statistics_with_lengths(self):
+        points = self.points.clone()
+        points[1, 60:] = 100.0
+        shape = PointCloud().set_data(points=points, lengths=torch.tensor([100, 60]))
+        torch.testing.assert_close(shape.get_bounding_box()[1, :, 1], points[1, :60].max(0)[0])
+        torch.testing.assert_close(shape.get_center()[1, 0], points[1, :60].mean(0))
+
+    def test_get_scale_and_center(self):
+        points = self.points[0].numpy()
+        scale, center = get_scale_and_center(points, percentile=95)
+        for d in range(points.shape[1]):
+            low, high = np.percentile(points[:, d], 2.5), np.percentile(points[:, d], 97.5)
+            self.assertAlmostEqual(float(scale[0, d]), (high - low) / 2, places=5)
+            self.assertAlmostEqual(float(center[0, d]), (high + low) / 2, places=5)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Shape_Base(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_slots")
+    run_by_name("test_view")
+    run_by_name("test_default_weights_not_shared")
+    run_by_name("test_shape_pair_infer_flowed")
+    run_by_name("test_point_statistics_cache")
+    run_by_name("test_point_statistics_with_lengths")
+    run_by_name("test_get_scale_and_center")
@@ -0,0 +1,183 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from geomloss import SamplesLoss
+from robot.utils.sinkhorn_utils import (
+    SinkhornEngine,
+    WarmStartSinkhorn,
+    OTSolverCache,
+    sinkhorn_engine,
+)
+from robot.utils.packed_utils import padded_to_packed
+from robot.utils.module_parameters import ParameterDict
+from robot.global_variable import Shape
+from robot.metrics.reg_losses import GeomDistance
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Sinkhorn_Utils(unittest.TestCase):
+    def setUp(self):
+        B, N, M, D = 2, 300, 400, 3
+        self.x = torch.rand(B, N, D, dtype=torch.float64)
+        self.y = torch.rand(B, M, D, dtype=torch.float64) + 0.1
+        self.a = torch.ones(B, N, dtype=torch.float64) / N
+        self.b = torch.ones(B, M, dtype=torch.float64) / M
+
+    def tearDown(self):
+        pass
+
+    def test_consistent_with_geomloss(self):
+        for reach in [None, 0.5]:
+            for potentials in [False, True]:
+                setting = dict(blur=0.05, scaling=0.8, reach=reach, potentials=potentials)
+                x = self.x.clone().requires_grad_()
+                ref = SamplesLoss(
+                    "sinkhorn", debias=False, backend="tensorized", **setting
+                )(self.a, x, self.b, self.y)
+                output = WarmStartSinkhorn(**setting)(self.a, x, self.b, self.y)
+                ref = ref if potentials else (ref,)
+                output = output if potentials else (output,)
+                for tensor, ref_tensor in zip(output, ref):
+                    torch.testing.assert_close(tensor, ref_tensor)
+                torch.testing.assert_close(
+                    torch.autograd.grad(output[0].sum(), x)[0],
+                    torch.autograd.grad(ref[0].sum(), x)[0],
+                )
+
+    def test_warm_start(self):
+        solver = WarmStartSinkhorn(blur=0.05, scaling=0.8)
+        cold_solver = WarmStartSinkhorn(blur=0.05, scaling=0.8, warm_start=False)
+        solver(self.a, self.x, self.b, self.y)
+        x = self.x + 0.002 * torch.randn_like(self.x)
+        loss = solver(self.a, x, self.b, self.y)
+        cold_loss = cold_solver(self.a, x, self.b, self.y)
+        converged_loss = SinkhornEngine(blur=0.05, scaling=0.999)(self.a, x, self.b, self.y)
+        self.assertEqual(solver.stats()["warm"], 1)
+        self.assertLess(solver.n_iter, cold_solver.n_iter)
+        # the warm-started solve iterates until tol, at least as accurate as the cold eps-scaling
+        self.assertLessEqual(
+            (loss - converged_loss).abs().max().item(),
+            (cold_loss - converged_loss).abs().max().item(),
+        )
+        # large displacement, restart from scratch
+        solver(self.a, x + 0.5, self.b, self.y)
+        self.assertEqual(solver.stats()["cold"], 2)
+        # the potentials of other weights are not reused
+        a = torch.rand_like(self.a)
+        solver(a / a.sum(1, keepdim=True), x + 0.5, self.b, self.y)
+        self.assertEqual(solver.stats()["cold"], 3)
+
+    def test_ot_solver_cache(self):
+        geom_obj = "sinkhorn_utils.WarmStartSinkhorn(blur=0.05, scaling=0.8)"
+        ot_solvers, other_ot_solvers = OTSolverCache(), OTSolverCache()
+        solver = ot_solvers.get(geom_obj)
+        self.assertIs(ot_solvers.get(geom_obj), solver)
+        self.assertIsNot(other_ot_solvers.get(geom_obj), solver)
+        solver(self.a, self.x, self.b, self.y)
+        ot_solvers.reset()
+        solver(self.a, self.x, self.b, self.y)
+        self.assertEqual(solver.stats()["cold"], 2)
+        engine = sinkhorn_engine(
+            "geomloss.SamplesLoss(loss='sinkhorn',blur=0.05, scaling=0.8,reach=1,debias=False)"
+        )
+        self.assertEqual((engine.blur, engine.scaling, engine.reach), (0.05, 0.8, 1))
+
+    def test_transport_plan(self):
+        for reach, marginal in [(None, "kl"), (0.5, "kl"), (0.2, "tv")]:
+            solver = SinkhornEngine(blur=0.05, scaling=0.8, reach=reach, marginal=marginal)
+            result = solver.solve(self.a, self.x, self.b, self.y)
+            log_P = result.log_plan(lazy=False)
+            P = log_P.exp()
+            mapped, mass_ratio = result.barycentric_map()
+            torch.testing.assert_close(mapped, (P @ self.y) / P.sum(2, keepdim=True))
+            torch.testing.assert_close(mass_ratio, P.sum(2) / self.a)
+            torch.testing.assert_close(result.apply(self.y), P @ self.y)
+            fused_mapped, fused_mass_ratio, index, topk_index = result.fused_map(
+                K=3, tile_size=128
+            )
+            torch.testing.assert_close(fused_mapped, mapped)
+            torch.testing.assert_close(fused_mass_ratio, mass_ratio)
+            self.assertTrue((index == log_P.argmax(2)).all())
+            self.assertTrue((topk_index == log_P.topk(3, dim=2)[1]).all())
+            row_mass, col_mass = result.marginals()
+            torch.testing.assert_close(col_mass, P.sum(1))
+            torch.testing.assert_close(row_mass, P.sum(2))
+            if marginal == "tv":
+                self.assertLessEqual(result.f.abs().max().item(), reach ** 2 + 1e-12)
+            self.assertTrue(torch.isfinite(solver.cost(result)).all())
+
+    def test_padded_batch(self):
+        # the eps-scaling is shared by the batch, fix the diameter to compare with the separate solves
+        solver = SinkhornEngine(blur=0.05, scaling=0.8, reach=0.5, diameter=2.0)
+        lengths_x, lengths_y = [300, 120], [250, 400]
+        x, x_offsets = padded_to_packed(self.x, lengths_x)
+        y, y_offsets = padded_to_packed(self.y, lengths_y)
+        a = torch.cat([torch.ones(n, dtype=torch.float64) / n for n in lengths_x])
+        b = torch.cat([torch.ones(m, dtype=torch.float64) / m for m in lengths_y])
+        result = solver.solve_packed(a, x, x_offsets, b, y, y_offsets)
+        for i, (n, m) in enumerate(zip(lengths_x, lengths_y)):
+            ref = solver.solve(
+                self.a[i : i + 1, :n] * (self.a.shape[1] / n),
+                self.x[i : i + 1, :n],
+                self.b[i : i + 1, :m] * (self.b.shape[1] / m),
+                self.y[i : i + 1, :m],
+            )
+            torch.testing.assert_close(result.f[i, :n], ref.f[0])
+            torch.testing.assert_close(result.g[i, :m], ref.g[0])
+            self.assertTrue((result.marginals()[0][i, n:] < 1e-12).all())
+
+    def test_geom_distance_padded(self):
+        # the padded sets are solved in one call, the same as solving each valid range,
+        # the eps-scaling is shared by the batch, fix the diameter to compare with the separate solves
+        lengths_x, lengths_y = [300, 120], [250, 400]
+        source = Shape().set_data(points=self.x * 3, lengths=torch.tensor(lengths_x))
+        target = Shape().set_data(points=self.y, lengths=torch.tensor(lengths_y))
+        for geom_obj in [
+            "geomloss.SamplesLoss(loss='sinkhorn',blur=0.01, scaling=0.8, debias=False, diameter=6.0)",
+            "sinkhorn_utils.SinkhornEngine(blur=0.01, scaling=0.8, diameter=6.0)",
+        ]:
+            opt = ParameterDict()
+            opt.ext = {"attr": "points", "geom_obj": geom_obj}
+            geom_distance = GeomDistance(opt)
+            loss = geom_distance(source, target)
+            for i, (n, m) in enumerate(zip(lengths_x, lengths_y)):
+                ref = geom_distance.gemoloss(
+                    self.a[i : i + 1, :n] * (self.a.shape[1] / n),
+                    source.points[i : i + 1, :n],
+                    self.b[i : i + 1, :m] * (self.b.shape[1] / m),
+                    target.points[i : i + 1, :m],
+                )
+                torch.testing.assert_close(loss[i : i + 1], ref)
+
+    def test_multiscale(self):
+        B, N, M, D = 1, 3000, 2500, 3
+        x, y = torch.rand(B, N, D), torch.rand(B, M, D) + 0.1
+        a, b = torch.ones(B, N) / N, torch.ones(B, M) / M
+        setting = dict(blur=0.02, scaling=0.8, reach=0.5)
+        F, G = SamplesLoss(
+            "sinkhorn", debias=False, potentials=True, backend="multiscale", **setting
+        )(a[0], x[0], b[0], y[0])
+        result = SinkhornEngine(backend="multiscale", **setting).solve(a, x, b, y)
+        torch.testing.assert_close(result.f[0], F, rtol=0, atol=1e-5)
+        torch.testing.assert_close(result.g[0], G, rtol=0, atol=1e-5)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Sinkhorn_Utils(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_consistent_with_geomloss")
+    run_by_name("test_warm_start")
+    run_by_name("test_ot_solver_cache")
+    run_by_name("test_transport_plan")
+    run_by_name("test_padded_batch")
+    run_by_name("test_geom_distance_padded")
+    run_by_name("test_multiscale")
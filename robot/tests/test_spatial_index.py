@@ -0,0 +1,118 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from robot.utils.spatial_index import (
+    GridIndex,
+    IncrementalKNN,
+    SpatialIndexCache,
+    gather_points,
+)
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Spatial_Index(unittest.TestCase):
+    def setUp(self):
+        B = 2
+        N = 700
+        M = 1000
+        D = 3
+        self.points = torch.rand(B, M, D, dtype=torch.float64)
+        # part of the queries lie outside the bounding box of the indexed points
+        self.query = torch.rand(B, N, D, dtype=torch.float64) * 1.4 - 0.2
+
+    def tearDown(self):
+        pass
+
+    def brute_force_knn(self, query, points, K):
+        dist2 = torch.cdist(query, points) ** 2
+        return dist2.topk(K, dim=2, largest=False)
+
+    def test_knn(self):
+        K = 10
+        dist2, index = GridIndex(self.points, k_hint=K).knn(self.query, K)
+        dist2_ref, index_ref = self.brute_force_knn(self.query, self.points, K)
+        torch.testing.assert_close(dist2, dist2_ref)
+        gathered = gather_points(self.points, index)
+        torch.testing.assert_close(
+            ((self.query.unsqueeze(2) - gathered) ** 2).sum(-1), dist2_ref
+        )
+
+    def test_nn(self):
+        dist2, index = GridIndex(self.points).nn(self.query)
+        dist2_ref, index_ref = self.brute_force_knn(self.query, self.points, 1)
+        torch.testing.assert_close(dist2, dist2_ref)
+        self.assertTrue((index == index_ref).all())
+
+    def test_radius_search(self):
+        radius, nsample = 0.08, 16
+        index, count = GridIndex(self.points).radius_search(
+            self.query, radius, nsample
+        )
+        dist2 = torch.cdist(self.query, self.points) ** 2
+        count_ref = (dist2 < radius ** 2).sum(2).clamp(max=nsample)
+        self.assertTrue((count == count_ref).all())
+        gathered_dist2 = dist2.gather(2, index)
+        valid = torch.arange(nsample)[None, None] < count[..., None]
+        self.assertTrue((gathered_dist2[valid] < radius ** 2).all())
+
+    def test_index_cache(self):
+        cache = SpatialIndexCache("grid")
+        cache.get(self.points)
+        cache.get(self.points)
+        self.assertEqual(cache.n_build, 1)
+        self.points.add_(1e-3)
+        cache.get(self.points)
+        self.assertEqual(cache.n_build, 2)
+
+    def test_incremental_knn(self):
+        K = 5
+        knn = IncrementalKNN("grid")
+        query, points = self.query.clone(), self.points.clone()
+        for i in range(6):
+            dist2, index = knn(query, points, K)
+            dist2_ref, _ = self.brute_force_knn(query, points, K)
+            torch.testing.assert_close(dist2, dist2_ref)
+            query = query + torch.randn_like(query) * 1e-3
+            points = points + torch.randn_like(points) * 1e-4
+        self.assertGreater(knn.n_hit, 0)
+        self.assertEqual(knn.n_hit + knn.n_miss, 6 * query.shape[0] * query.shape[1])
+        n_miss = knn.n_miss
+        knn(torch.rand_like(query), points, K)
+        self.assertGreater(knn.n_miss - n_miss, query.shape[1])
+
+    def test_incremental_knn_drift(self):
+        K = 5
+        knn = IncrementalKNN("grid")
+        query, points = self.query.clone(), self.points.clone()
+        drift = torch.randn_like(points[:, :1]) * 1e-4
+        for i in range(60):
+            if i == 40:
+                n_hit, n_miss = knn.n_hit, knn.n_miss
+            dist2, index = knn(query, points, K)
+            dist2_ref, _ = self.brute_force_knn(query, points, K)
+            torch.testing.assert_close(dist2, dist2_ref)
+            query = query + torch.randn_like(query) * 1e-5
+            points = points + drift
+        # the bound of a row is the displacement since its own search, the reuse does not decay with the drift
+        n_hit, n_miss = knn.n_hit - n_hit, knn.n_miss - n_miss
+        self.assertGreater(n_hit, 0.7 * (n_hit + n_miss))
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Spatial_Index(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_knn")
+    run_by_name("test_nn")
+    run_by_name("test_radius_search")
+    run_by_name("test_index_cache")
+    run_by_name("test_incremental_knn")
+    run_by_name("test_incremental_knn_drift")
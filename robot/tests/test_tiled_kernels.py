@@ -0,0 +1,137 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+from torch.autograd import grad
+import unittest
+from robot.kernels.tiled_kernels import TiledTorchKernel, tiled_softmax_topk_reduction
+from robot.kernels.torch_kernels import TorchKernel
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Tiled_Kernels(unittest.TestCase):
+    def setUp(self):
+        B = 2
+        N = 300
+        K = 250
+        D = 3
+        device = torch.device("cpu")
+        self.tile_size = 64
+        self.x = torch.rand(B, N, D, requires_grad=True, device=device)
+        self.y = torch.rand(B, K, D, requires_grad=True, device=device)
+        self.px = torch.rand(B, N, D, requires_grad=True, device=device)
+        self.py = torch.rand(B, K, D, requires_grad=True, device=device)
+        self.b = torch.rand(B, K, D, requires_grad=True, device=device)
+
+    def tearDown(self):
+        pass
+
+    def compare_tensors(self, tensors1, tensors2, rtol=1e-3, atol=1e-5):
+        for tensor1, tensor2 in zip(tensors1, tensors2):
+            torch.testing.assert_close(tensor1, tensor2, rtol=rtol, atol=atol)
+
+    def compare_kernels(self, kernel1, kernel2, inputs):
+        output1 = kernel1(*inputs)
+        output2 = kernel2(*inputs)
+        grads1 = grad(output1.mean(), inputs, retain_graph=True)
+        grads2 = grad(output2.mean(), inputs, retain_graph=True)
+        self.compare_tensors([output1], [output2])
+        self.compare_tensors(grads1, grads2)
+
+    def test_kernel_gaussian(self):
+        self.compare_kernels(
+            TiledTorchKernel("gauss", tile_size=self.tile_size, sigma=0.1),
+            TorchKernel("gauss", sigma=0.1),
+            (self.x, self.y, self.b),
+        )
+
+    def test_kernel_multi_gaussian(self):
+        kernel_args = dict(sigma_list=[0.01, 0.05, 0.1], weight_list=[0.2, 0.3, 0.5])
+        self.compare_kernels(
+            TiledTorchKernel("multi_gauss", tile_size=self.tile_size, **kernel_args),
+            TorchKernel("multi_gauss", **kernel_args),
+            (self.x, self.y, self.b),
+        )
+
+    def test_kernel_gaussian_grad(self):
+        self.compare_kernels(
+            TiledTorchKernel("gauss_grad", tile_size=self.tile_size, sigma=0.1),
+            TorchKernel("gauss_grad", sigma=0.1),
+            (self.px, self.x, self.py, self.y),
+        )
+
+    def test_kernel_multi_gaussian_grad(self):
+        kernel_args = dict(sigma_list=[0.01, 0.05, 0.1], weight_list=[0.2, 0.3, 0.5])
+        self.compare_kernels(
+            TiledTorchKernel(
+                "multi_gauss_grad", tile_size=self.tile_size, **kernel_args
+            ),
+            TorchKernel("multi_gauss_grad", **kernel_args),
+            (self.px, self.x, self.py, self.y),
+        )
+
+    def test_kernel_gaussian_lin(self):
+        self.compare_kernels(
+            TiledTorchKernel("gauss_lin", tile_size=self.tile_size, sigma=0.1),
+            TorchKernel("gauss_lin", sigma=0.1),
+            (self.x, self.y, self.px, self.py, self.b),
+        )
+
+    def test_kernel_normalized_gaussian(self):
+        sigma = 0.01  # small sigma, the streaming log-sum-exp has to be stable
+
+        def dense_normalized_gauss(x, y, b):
+            dist2 = ((x[:, :, None] - y[:, None]) ** 2).sum(-1)
+            return torch.softmax(-dist2 / (2 * sigma ** 2), dim=2) @ b
+
+        self.compare_kernels(
+            TiledTorchKernel("normalized_gauss", tile_size=self.tile_size, sigma=sigma),
+            dense_normalized_gauss,
+            (self.x, self.y, self.b),
+        )
+
+    def test_kernel_double_backward(self):
+        kernel = TiledTorchKernel("gauss", tile_size=self.tile_size, sigma=0.1)
+        torch_kernel = TorchKernel("gauss", sigma=0.1)
+        grads = []
+        for _kernel in [kernel, torch_kernel]:
+            hamiltonian = (self.px * _kernel(self.x, self.x, self.px)).sum() * 0.5
+            grad_x = grad(hamiltonian, self.x, create_graph=True)[0]
+            grads.append(grad(grad_x.mean(), (self.x, self.px)))
+        self.compare_tensors(grads[0], grads[1])
+
+    def test_softmax_topk_reduction(self):
+        logit_fn = lambda x, y: -((x[:, :, None] - y[:, None]) ** 2).sum(-1) / 0.01
+        log_normalizer, output, topk_index = tiled_softmax_topk_reduction(
+            logit_fn, [self.x], [self.y], self.b, K=5, tile_size=self.tile_size
+        )
+        logit = logit_fn(self.x, self.y)
+        ref_output = logit.softmax(2) @ self.b
+        self.compare_tensors(
+            [log_normalizer, output], [logit.logsumexp(2), ref_output]
+        )
+        self.assertTrue((topk_index == logit.topk(5, dim=2)[1]).all())
+        self.compare_tensors(
+            grad(output.mean(), (self.x, self.y, self.b)),
+            grad(ref_output.mean(), (self.x, self.y, self.b)),
+        )
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Tiled_Kernels(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_kernel_gaussian")
+    run_by_name("test_kernel_multi_gaussian")
+    run_by_name("test_kernel_gaussian_grad")
+    run_by_name("test_kernel_multi_gaussian_grad")
+    run_by_name("test_kernel_gaussian_lin")
+    run_by_name("test_kernel_normalized_gaussian")
+    run_by_name("test_kernel_double_backward")
+    run_by_name("test_softmax_topk_reduction")
@@ -0,0 +1,123 @@
+"""
+Background writer for the shape outputs (vtk/ply/npy).
+
+The caller only takes a detached cpu snapshot of the arrays, the serialization runs in a thread (or process) pool.
+At most max_pending writes are queued, submit blocks when the queue is full (backpressure),
+flush is the barrier that waits for all the queued writes, e.g. at the end of a phase, and re-raises the write errors.
+
+Examples:
+    >>> configure_shape_writer(num_workers=2, max_pending=16)
+    >>> get_shape_writer().submit(np.save, fpath, array)
+    >>> flush_shape_writer()
+"""
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+
+
+class AsyncWriter(object):
+    def __init__(self, num_workers=2, max_pending=16, use_process=False):
+        """
+        :param num_workers: number of writer workers, 0 to write synchronously
+        :param max_pending: max number of queued writes, submit blocks beyond it
+        :param use_process: use a process pool instead of a thread pool, the write function and its arguments should be picklable
+        """
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.use_process = use_process
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = []
+
+    def _get_executor(self):
+        if self._executor is None:
+            pool = ProcessPoolExecutor if self.use_process else ThreadPoolExecutor
+            self._executor = pool(max_workers=self.num_workers)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        :param fn: the write function, the arguments should not be modified after the submission
+        """
+        if self.num_workers <= 0:
+            fn(*args, **kwargs)
+            return
+        self._slots.acquire()
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _collect(self, future):
+        # called with the lock held, a future is collected once, by its done callback or by flush
+        if future in self._pending:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+
+    def _done(self, future):
+        with self._lock:
+            self._collect(future)
+        self._slots.release()
+
+    def flush(self):
+        """
+        wait until all the submitted writes are finished, the first write error is re-raised
+        """
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        with self._lock:
+            # wait can return before the done callbacks run, collect the finished futures here
+            for future in pending:
+                self._collect(future)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+_shape_writer = None
+
+
+def configure_shape_writer(num_workers=2, max_pending=16, use_process=False):
+    """
+    replace the shared writer, the writes queued in the previous one are flushed first
+
+    :param num_workers: number of writer workers, 0 to write synchronously
+    :param max_pending: max number of queued writes
+    :param use_process: use a process pool instead of a thread pool
+    :return: AsyncWriter
+    """
+    global _shape_writer
+    if _shape_writer is not None:
+        _shape_writer.close()
+    _shape_writer = AsyncWriter(num_workers, max_pending, use_process)
+    return _shape_writer
+
+
+def get_shape_writer():
+    if _shape_writer is None:
+        configure_shape_writer()
+    return _shape_writer
+
+
+def flush_shape_writer():
+    if _shape_writer is not None:
+        _shape_writer.flush()
+
+
+atexit.register(flush_shape_writer)
@@ -133,8 +133,21 @@ class ShapePair:
 
 
 
-def init_reg_param(points_path, is_affine=False):
+def init_reg_param(points_path, is_affine=False, archive_record=None):
+    """
+    :param points_path: the reg_param vtk file, or the result archive if archive_record is set
+    :param is_affine:
+    :param archive_record: (pair_name, stage) of the record in the result archive
+    :return: 1xNxD
+    """
     if not is_affine:
+        if archive_record is not None:
+            from robot.utils.result_archive import ResultArchive
+
+            reg_param = ResultArchive(points_path).get(
+                *archive_record, "reg_param/reg_param_vector"
+            )
+            return torch.Tensor(reg_param.astype(np.float32))[None]
         reg_param_dict = read_vtk(points_path)
         return torch.Tensor(reg_param_dict["reg_param_vector"])[None]
 
@@ -2,12 +2,52 @@ from pykeops.torch import LazyTensor
 
 from robot.utils.obj_factory import obj_factory
 from robot.utils.local_feature_extractor import compute_anisotropic_gamma_from_points
+from robot.utils.spatial_index import IncrementalKNN, SpatialIndexCache, gather_points
 from functools import partial
 
-def NN(return_value=True, return_pos=False):
+
+def indexed_knn_search(index=None, index_args=None, incremental=False):
+    """
+    :param index: spatial index type, e.g. "grid", if None and not incremental, return None (use the brute force keops search)
+    :param index_args: settings for the spatial index, see robot.utils.spatial_index.GridIndex
+    :param incremental: reuse the knn result of the last call for the queries that only move slightly,
+     see robot.utils.spatial_index.IncrementalKNN
+    :return: function(pc1, pc2, K), return BxNxK index, or None
+    """
+    index_args = index_args or {}
+    if incremental:
+        return IncrementalKNN(index if index else "grid", **index_args)
+    if index:
+        index_cache = SpatialIndexCache(index, **index_args)
+        return lambda pc1, pc2, K: index_cache.get(pc2).knn(pc1, K)
+    return None
+
+
+def NN(return_value=True, return_pos=False, index=None, index_args=None, incremental=False):
+    """
+    :param index: spatial index type, e.g. "grid", the index is built on pc2 and reused as long as pc2 is unchanged,
+     if None, the brute force keops search is used
+    :param index_args: settings for the spatial index, see robot.utils.spatial_index.GridIndex
+    :param incremental: reuse the nearest neighbor of the last call for the queries that only move slightly
+    """
+    search = indexed_knn_search(index, index_args, incremental)
+
+    def indexed_compute(pc1, pc2):
+        _, index = search(pc1, pc2, 1)
+        Kmin_pc3 = gather_points(pc2, index)  # BxNx1xD
+        if return_value:
+            K_min = ((pc1.unsqueeze(2) - Kmin_pc3) ** 2).sum(-1)
+            return K_min, index
+        elif return_pos:
+            return Kmin_pc3[:, :, 0].contiguous(), index
+        else:
+            return index
+
     def compute(pc1, pc2):
         from robot.modules_reg.networks.pointconv_util import index_points_group
 
+        if search is not None:
+            return indexed_compute(pc1, pc2)
         B,N = pc1.shape[0], pc1.shape[1]
         pc_i = LazyTensor(pc1[:,:,None])
         pc_j = LazyTensor(pc2[:,None])
@@ -21,11 +61,32 @@ def NN(return_value=True, return_pos=False):
             return Kmin_pc3[:,:,0].contiguous(), index.long().view(B, N, 1)
         else:
             return dist2.argmin(dim=2).long().view(B, N, 1)
+    compute.search = search
     return compute
 
-def KNN(return_value=True):
+def KNN(return_value=True, index=None, index_args=None, incremental=False):
+    """
+    :param index: spatial index type, e.g. "grid", the index is built on pc2 and reused as long as pc2 is unchanged,
+     if None, the brute force keops search is used
+    :param index_args: settings for the spatial index, see robot.utils.spatial_index.GridIndex
+    :param incremental: reuse the knn result of the last call for the queries that only move slightly,
+     e.g. "knn_utils.KNN(incremental=True)" in an iterative solver, the hit/miss counters are in compute.search
+    """
+    search = indexed_knn_search(index, index_args, incremental)
+
+    def indexed_compute(pc1, pc2, K):
+        _, index = search(pc1, pc2, K)
+        if return_value:
+            Kmin_pc3 = gather_points(pc2, index)
+            K_min = (pc1.unsqueeze(2) - Kmin_pc3).norm(p=2, dim=3)
+            return K_min, index
+        else:
+            return index
+
     def compute(pc1, pc2, K):
         from robot.modules_reg.networks.pointconv_util import index_points_group
+        if search is not None:
+            return indexed_compute(pc1, pc2, K)
         B, N = pc1.shape[0], pc1.shape[1]
         pc_i = LazyTensor(pc1[:, :, None])
         pc_j = LazyTensor(pc2[:, None])
@@ -38,6 +99,7 @@ def KNN(return_value=True):
         else:
             return index.long().view(B, N, K)
 
+    compute.search = search
     return compute
 
 
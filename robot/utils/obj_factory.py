@@ -35,6 +35,8 @@ KNOWN_MODULES = {
     "shape_pair_utils": "robot.shape.shape_pair_utils",
     "torch_kernels": "robot.kernels.torch_kernels",
     "keops_kernels": "robot.kernels.keops_kernels",
+    "tiled_kernels": "robot.kernels.tiled_kernels",
+    "grid_kernels": "robot.kernels.grid_kernels",
     "point_interpolator": "robot.shape.point_interpolator",
     "geomloss": "geomloss",
     "nn": "torch.nn",
@@ -43,7 +45,9 @@ KNOWN_MODULES = {
     "probreg": "probreg",
     "features": "probreg.features",
     "utils": "robot.utils.utils",
-    "knn_utils": "robot.utils.knn_utils"
+    "knn_utils": "robot.utils.knn_utils",
+    "sinkhorn_utils": "robot.utils.sinkhorn_utils",
+    "procrustes_utils": "robot.utils.procrustes_utils"
     #'probreg.filterreg':'probreg.filterreg'
 }
 
@@ -0,0 +1,163 @@
+"""
+Packed (ragged) representation of a batch of point sets.
+
+A batch of B point sets with different sizes is stored as the concatenated points (sum_b N_b)xD
+together with the offsets (B+1, offsets[b]:offsets[b+1] is the range of the b-th set) or the batch index (sum_b N_b).
+Compared with the padded BxNxD form, no memory/compute is spent on the padding,
+e.g. voxel-downsampled lung pairs can differ in size by 2-3x.
+"""
+import torch
+
+
+def lengths_to_offsets(lengths):
+    """
+    :param lengths: B, number of points in each set
+    :return: B+1
+    """
+    lengths = torch.as_tensor(lengths, dtype=torch.long)
+    return torch.cat([lengths.new_zeros(1), lengths.cumsum(0)])
+
+
+def offsets_to_lengths(offsets):
+    return offsets[1:] - offsets[:-1]
+
+
+def offsets_to_batch_index(offsets):
+    """
+    :param offsets: B+1
+    :return: sum_b N_b, the batch id of each point
+    """
+    lengths = offsets_to_lengths(offsets)
+    return torch.arange(len(lengths), device=offsets.device).repeat_interleave(lengths)
+
+
+def batch_index_to_offsets(batch_index, nbatch=None):
+    """
+    :param batch_index: sum_b N_b, sorted
+    :param nbatch: number of sets, inferred from the batch index if not set
+    :return: B+1
+    """
+    nbatch = int(batch_index.max()) + 1 if nbatch is None else nbatch
+    lengths = torch.bincount(batch_index, minlength=nbatch)
+    return lengths_to_offsets(lengths).to(batch_index.device)
+
+
+def padded_to_packed(padded, lengths=None):
+    """
+    :param padded: BxNx*
+    :param lengths: B, the valid length of each set, if None, all N points are valid
+    :return: (sum_b N_b)x*, B+1 offsets
+    """
+    B, N = padded.shape[:2]
+    if lengths is None:
+        lengths = torch.full((B,), N, dtype=torch.long)
+    lengths = torch.as_tensor(lengths, dtype=torch.long, device=padded.device)
+    valid = torch.arange(N, device=padded.device)[None] < lengths[:, None]  # BxN
+    return padded[valid], lengths_to_offsets(lengths).to(padded.device)
+
+
+def packed_to_padded(packed, offsets, max_len=None, pad_value=0.0):
+    """
+    :param packed: (sum_b N_b)x*
+    :param offsets: B+1
+    :param max_len: the padded length, if None, the max length of the sets
+    :param pad_value: value filled in the padding
+    :return: BxNx*
+    """
+    lengths = offsets_to_lengths(offsets)
+    B = len(lengths)
+    max_len = int(lengths.max()) if max_len is None else max_len
+    padded = packed.new_full((B, max_len) + tuple(packed.shape[1:]), pad_value)
+    batch_index = offsets_to_batch_index(offsets)
+    position = torch.arange(len(packed), device=packed.device) - offsets[batch_index]
+    padded[batch_index, position] = packed
+    return padded
+
+
+def segment_sum(value, batch_index, nbatch):
+    """
+    :param value: (sum_b N_b)x*
+    :param batch_index: sum_b N_b
+    :param nbatch: B
+    :return: Bx*
+    """
+    output = value.new_zeros((nbatch,) + tuple(value.shape[1:]))
+    return output.index_add(0, batch_index, value)
+
+
+def segment_mean(value, batch_index, nbatch, weights=None):
+    """
+    :param value: (sum_b N_b)x*
+    :param batch_index: sum_b N_b
+    :param nbatch: B
+    :param weights: optional (sum_b N_b)x1
+    :return: Bx*
+    """
+    if weights is None:
+        weights = value.new_ones(len(value), 1)
+    weights = weights.view(len(value), *([1] * (value.dim() - 1)))
+    return segment_sum(value * weights, batch_index, nbatch) / segment_sum(
+        weights, batch_index, nbatch
+    )
+
+
+def _padding_index(offsets, max_len):
+    """
+    :param offsets: B+1
+    :param max_len: N, the padded length
+    :return: BxN index into the packed points (the padding repeats the last point of its set), BxN valid mask
+    """
+    lengths = offsets_to_lengths(offsets)
+    position = torch.arange(max_len, device=offsets.device)[None]
+    index = offsets[:-1, None] + torch.min(position, (lengths[:, None] - 1).clamp(min=0))
+    return index.clamp(max=max(int(offsets[-1]) - 1, 0)), position < lengths[:, None]
+
+
+class PackedKernel(object):
+    """
+    run a batch kernel on packed point sets in a single padded call,
+    e.g. PackedKernel("keops_kernels.LazyKeopsKernel('gauss',sigma=0.1)")(x, y, b, row_offsets=.., col_offsets=..)
+    the padded rows repeat the last row of their set and are dropped from the output,
+    the padded columns are moved far away from all the points so their (gaussian) kernel values underflow to zero
+    """
+
+    # the position of the arguments that live on the query (row) points, the others live on the column points
+    ROW_ARGS = {
+        "gauss_grad": (0, 1),
+        "multi_gauss_grad": (0, 1),
+        "fast_gauss_grad": (0, 1),
+        "fast_multi_gauss_grad": (0, 1),
+        "gauss_lin": (0, 2),
+    }
+
+    def __init__(self, kernel_obj, row_args=None):
+        from robot.utils.obj_factory import obj_factory
+
+        self.kernel = obj_factory(kernel_obj) if isinstance(kernel_obj, str) else kernel_obj
+        kernel_type = getattr(self.kernel, "kernel_type", None)
+        self.row_args = (
+            row_args if row_args is not None else self.ROW_ARGS.get(kernel_type, (0,))
+        )
+
+    def __call__(self, *args, row_offsets, col_offsets):
+        """
+        :param args: packed (sum_b N_b)x* tensors in the argument order of the kernel
+        :param row_offsets: B+1 offsets of the row arguments
+        :param col_offsets: B+1 offsets of the column arguments
+        :return: (sum_b N_b)xd
+        """
+        row_lengths = offsets_to_lengths(row_offsets)
+        row_index, _ = _padding_index(row_offsets, int(row_lengths.max()))
+        col_index, col_valid = _padding_index(
+            col_offsets, int(offsets_to_lengths(col_offsets).max())
+        )
+        far = 1e4 * (1.0 + max(float(arg.detach().abs().max()) for arg in args))
+        padded_args = []
+        for i, arg in enumerate(args):
+            if i in self.row_args:
+                padded_args.append(arg[row_index])
+            else:
+                valid = col_valid.view(col_valid.shape + (1,) * (arg.dim() - 1))
+                padded_args.append(torch.where(valid, arg[col_index], arg.new_tensor(far)))
+        output = self.kernel(*padded_args)
+        return padded_to_packed(output, row_lengths)[0]
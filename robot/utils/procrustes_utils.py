@@ -0,0 +1,198 @@
+"""
+Batched closed-form estimation of rigid / similarity / affine transforms from weighted correspondences.
+
+All the B pairs are solved together (one batched SVD or linear solve), the robust losses are minimized by
+iteratively reweighted least squares (IRLS), i.e. the correspondences are reweighted by the robust loss
+of their current residual and the weighted problem is solved again.
+The transform is in the Bx(D+1)xD form used by the prealignment, the transformed points are X @ A with X=[x, 1].
+"""
+import torch
+
+TRANSFORM_TYPES = ["rigid", "similarity", "affine"]
+ROBUST_LOSSES = ["l2", "huber", "geman_mcclure", "truncated"]
+
+
+def robust_weight(residual, robust_loss="l2", scale=1.0):
+    """
+    the irls weight of each correspondence, i.e. rho'(r)/r of the robust loss rho
+
+    :param residual: BxN, distance between the transformed source and the target
+    :param robust_loss: l2 / huber / geman_mcclure / truncated
+    :param scale: the residual scale of the robust loss, e.g. the inlier threshold
+    :return: BxN
+    """
+    if robust_loss == "l2":
+        return torch.ones_like(residual)
+    if robust_loss == "huber":
+        return (scale / residual.clamp(min=1e-12)).clamp(max=1.0)
+    if robust_loss == "geman_mcclure":
+        return (scale ** 2 / (scale ** 2 + residual ** 2)) ** 2
+    if robust_loss == "truncated":
+        return (residual < scale).to(residual.dtype)
+    raise ValueError(
+        "robust loss {} not defined, support: {}".format(robust_loss, ROBUST_LOSSES)
+    )
+
+
+def homogeneous(x):
+    return torch.cat((x, torch.ones_like(x[:, :, :1])), dim=2)
+
+
+def solve_weighted_transform(x, y, w, transform_type="rigid"):
+    """
+    closed-form weighted least squares min_A sum_i w_i |[x_i,1] A - y_i|^2
+
+    :param x: BxNxD
+    :param y: BxNxD
+    :param w: BxNx1
+    :param transform_type: rigid / similarity (rigid with an isotropic scale) / affine
+    :return: Bx(D+1)xD transform, BxNxD transformed x
+    """
+    X = homogeneous(x)  # (B,N, D+1)
+    if transform_type == "affine":
+        # A = (X^T  @ diag(w) @ X)^-1   @   (X^T  @ diag(w) @ y)
+        Xt_wX = X.transpose(2, 1) @ (w * X)  # (B,D+1, D+1)
+        Xt_wy = X.transpose(2, 1) @ (w * y)  # (B,D+1, D)
+        A = torch.linalg.solve(Xt_wX, Xt_wy)  # (B,D+1, D)
+        return A, X @ A
+    B, D = x.shape[0], x.shape[2]
+    sum_w = w.sum(1, keepdim=True)
+    mu_x = (x * w).sum(1, keepdim=True) / sum_w
+    mu_y = (y * w).sum(1, keepdim=True) / sum_w
+    x_hat = x - mu_x
+    wx_hat = x_hat * w
+    y_hat = y - mu_y
+    wy_hat = y_hat * w
+    a = wy_hat.transpose(2, 1) @ wx_hat  # BxDxN @ BxNxD  BxDxD
+    u, s, v = torch.svd(a)
+    c = torch.ones(B, D, device=x.device, dtype=x.dtype)
+    c[:, -1] = torch.det(u @ v.transpose(2, 1))  # reflection correction
+    r = (u * (c[..., None])) @ v.transpose(2, 1)
+    if transform_type == "similarity":
+        tr_atr = torch.diagonal(a.transpose(2, 1) @ r, dim1=-2, dim2=-1).sum(-1)
+        tr_xtwx = torch.diagonal(
+            wx_hat.transpose(2, 1) @ wx_hat, dim1=-2, dim2=-1
+        ).sum(-1)
+        scale = (tr_atr / tr_xtwx)[..., None][..., None]
+    else:
+        scale = 1.0
+    t = mu_y - scale * (r @ mu_x.transpose(2, 1)).transpose(2, 1)
+    A = torch.cat([r.transpose(2, 1) * scale, t], 1)
+    return A, X @ A
+
+
+class RobustTransformEstimator(object):
+    """
+    batched rigid / similarity / affine estimation with an irls robust loss
+
+    Examples:
+        >>> estimator = RobustTransformEstimator("rigid", robust_loss="geman_mcclure", robust_scale=0.05)
+        >>> A, transformed = estimator(source_points, mapped_points, weights)
+    """
+
+    def __init__(
+        self,
+        transform_type="rigid",
+        robust_loss="l2",
+        robust_scale=1.0,
+        n_irls_iter=10,
+        tol=1e-5,
+    ):
+        """
+        :param transform_type: rigid / similarity / affine
+        :param robust_loss: l2 / huber / geman_mcclure / truncated
+        :param robust_scale: the residual scale of the robust loss
+        :param n_irls_iter: max number of reweighting iterations, not used for the l2 loss
+        :param tol: stop when the transforms change by less than tol
+        """
+        assert transform_type in TRANSFORM_TYPES
+        assert robust_loss in ROBUST_LOSSES
+        self.transform_type = transform_type
+        self.robust_loss = robust_loss
+        self.robust_scale = robust_scale
+        self.n_irls_iter = n_irls_iter
+        self.tol = tol
+
+    def __call__(self, x, y, w=None):
+        """
+        :param x: BxNxD
+        :param y: BxNxD, the corresponding points
+        :param w: BxNx1, weights of the correspondences, uniform if None
+        :return: Bx(D+1)xD transform, BxNxD transformed x
+        """
+        w = torch.ones_like(x[..., :1]) if w is None else w
+        A, transformed = solve_weighted_transform(x, y, w, self.transform_type)
+        if self.robust_loss == "l2":
+            return A, transformed
+        for _ in range(self.n_irls_iter):
+            residual = (transformed - y).norm(dim=2, keepdim=True)
+            irls_w = w * robust_weight(residual, self.robust_loss, self.robust_scale)
+            # keep the problem well posed if (almost) all correspondences are rejected
+            irls_w = irls_w + 1e-8 * w
+            A_prev = A
+            A, transformed = solve_weighted_transform(
+                x, y, irls_w, self.transform_type
+            )
+            if (A - A_prev).abs().max() < self.tol:
+                break
+        return A, transformed
+
+
+def compose_transform(A_prev, A_cur):
+    """
+    :param A_prev: Bx(D+1)xD, applied first
+    :param A_cur: Bx(D+1)xD
+    :return: Bx(D+1)xD
+    """
+    D = A_prev.shape[-1]
+    A_composed_matrix = A_prev[:, :D, :] @ A_cur[:, :D, :]  # BxDxD
+    A_composed_trans = (
+        A_prev[:, D:, :] @ A_cur[:, :D, :] + A_cur[:, D:, :]
+    )  # Bx1XD @ BxDxD   Bx1xD
+    return torch.cat([A_composed_matrix, A_composed_trans], 1)
+
+
+def batch_icp(
+    transform_type="rigid",
+    robust_loss="l2",
+    robust_scale=1.0,
+    n_irls_iter=10,
+    max_iter=50,
+    tol=1e-5,
+    nn_index=None,
+):
+    """
+    iterative closest point of a batch of pairs, each iteration matches all pairs via the nearest neighbor search
+    and solves all the transforms by one RobustTransformEstimator call
+
+    :param transform_type: rigid / similarity / affine
+    :param robust_loss: l2 / huber / geman_mcclure / truncated, reject the outlier matches
+    :param robust_scale: the residual scale of the robust loss
+    :param n_irls_iter: max number of reweighting iterations in each icp iteration
+    :param max_iter: max number of icp iterations
+    :param tol: stop when the transforms change by less than tol
+    :param nn_index: spatial index of the nearest neighbor search, see knn_utils.NN
+    :return: function(source_points BxNxD, target_points BxMxD, source_weights BxNx1 or None),
+        return Bx(D+1)xD transform, BxNxD transformed source
+    """
+    from robot.utils.knn_utils import NN
+
+    estimator = RobustTransformEstimator(
+        transform_type, robust_loss, robust_scale, n_irls_iter, tol
+    )
+    nn_search = NN(return_value=False, return_pos=True, index=nn_index)
+
+    def solve(source_points, target_points, source_weights=None):
+        B, D = source_points.shape[0], source_points.shape[2]
+        A = torch.eye(D + 1, D, device=source_points.device, dtype=source_points.dtype)
+        A = A.repeat(B, 1, 1)
+        transformed = source_points
+        for _ in range(max_iter):
+            matched, _ = nn_search(transformed, target_points)
+            A_prev = A
+            A, transformed = estimator(source_points, matched, source_weights)
+            if (A - A_prev).abs().max() < tol:
+                break
+        return A, transformed
+
+    return solve
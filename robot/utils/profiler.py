@@ -0,0 +1,229 @@
+"""
+Named timing spans across the registration pipeline.
+
+A span times a block (or a function via the decorator), nested spans are recorded under their parent name,
+e.g. "solver/ot". Each record is tagged with the current context (e.g. pair, epoch, scale), so the timings can be
+aggregated per pair / epoch / scale. The records are exported as a json trace (chrome://tracing format) or
+logged into tensorboard. When the profiler is disabled, a span costs one flag check.
+
+Examples:
+    >>> enable_profiler(sync_cuda=True)
+    >>> with profile_context(pair="copd1", scale=0.08):
+    >>>     with profile_span("ot"):
+    >>>         ...
+    >>> @profile_span("prealign")
+    >>> def prealign(...):
+    >>>     ...
+    >>> get_profiler().summary(group_by="scale")
+    >>> get_profiler().write_trace("trace.json")
+"""
+import os
+import json
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+import torch
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.sync_cuda = False
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._logged = 0
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.context = {}
+        return self._local
+
+    def _sync(self):
+        if self.sync_cuda and torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def begin(self, name):
+        local = self._stack()
+        self._sync()
+        full_name = local.stack[-1][0] + "/" + name if local.stack else name
+        local.stack.append((full_name, time.perf_counter()))
+
+    def end(self):
+        local = self._stack()
+        self._sync()
+        full_name, start = local.stack.pop()
+        record = {
+            "name": full_name,
+            "start": start,
+            "duration": time.perf_counter() - start,
+            "thread": threading.get_ident(),
+            "context": dict(local.context),
+        }
+        with self._lock:
+            self.records.append(record)
+
+    def push_context(self, **tags):
+        local = self._stack()
+        previous = dict(local.context)
+        local.context.update(tags)
+        return previous
+
+    def pop_context(self, previous):
+        self._stack().context = previous
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+            self._logged = 0
+
+    def summary(self, group_by=None, records=None):
+        """
+        :param group_by: a context tag, e.g. "pair" / "epoch" / "scale", None to aggregate all the records
+        :param records: records to aggregate, all the records if None
+        :return: {span name: {"count", "total", "mean"}}, or {tag value: {span name: ...}} if group_by is set
+        """
+        records = self.records if records is None else records
+        groups = defaultdict(lambda: defaultdict(lambda: {"count": 0, "total": 0.0}))
+        for record in records:
+            group = record["context"].get(group_by) if group_by else None
+            stat = groups[group][record["name"]]
+            stat["count"] += 1
+            stat["total"] += record["duration"]
+        summary = {}
+        for group, stats in groups.items():
+            summary[group] = {
+                name: dict(stat, mean=stat["total"] / stat["count"])
+                for name, stat in sorted(stats.items())
+            }
+        return summary if group_by else summary.get(None, {})
+
+    def write_trace(self, fpath):
+        """
+        write the records as complete events of the chrome trace format, the context is kept in the args
+        """
+        folder = os.path.dirname(fpath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        origin = min([record["start"] for record in self.records], default=0.0)
+        events = [
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": (record["start"] - origin) * 1e6,
+                "dur": record["duration"] * 1e6,
+                "pid": os.getpid(),
+                "tid": record["thread"],
+                "args": {key: str(value) for key, value in record["context"].items()},
+            }
+            for record in self.records
+        ]
+        with open(fpath, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def log_to_tensorboard(self, writer, step, prefix="time"):
+        """
+        add the total time of each span recorded since the last call, e.g. once per epoch
+
+        :param writer: tensorboard writer, e.g. TensorBoardLogger, skipped if None
+        :param step: global step
+        :param prefix: tag prefix
+        """
+        if writer is None:
+            return
+        with self._lock:
+            records = self.records[self._logged :]
+            self._logged = len(self.records)
+        for name, stat in self.summary(records=records).items():
+            writer.add_scalar("{}/{}".format(prefix, name), stat["total"], step)
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def enable_profiler(enabled=True, sync_cuda=False):
+    """
+    :param enabled: record the spans
+    :param sync_cuda: synchronize cuda at the span boundaries, so the gpu time is attributed to the right span
+    """
+    _profiler.enabled = enabled
+    _profiler.sync_cuda = sync_cuda
+    return _profiler
+
+
+class profile_span(object):
+    """
+    time a block as a context manager or a function as a decorator
+    """
+
+    __slots__ = ("name", "opened")
+
+    def __init__(self, name):
+        self.name = name
+        self.opened = False
+
+    def __enter__(self):
+        self.opened = _profiler.enabled
+        if self.opened:
+            _profiler.begin(self.name)
+        return self
+
+    def __exit__(self, *args):
+        if self.opened:
+            self.opened = False
+            _profiler.end()
+
+    def __call__(self, func):
+        name = self.name
+
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            if not _profiler.enabled:
+                return func(*args, **kwargs)
+            _profiler.begin(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _profiler.end()
+
+        return profiled
+
+
+class profile_context(object):
+    """
+    tag the spans recorded inside the block, e.g. pair / epoch / scale
+    """
+
+    def __init__(self, **tags):
+        self.tags = tags
+        self.previous = None
+
+    def __enter__(self):
+        if _profiler.enabled:
+            self.previous = _profiler.push_context(**self.tags)
+        return self
+
+    def __exit__(self, *args):
+        if self.previous is not None:
+            _profiler.pop_context(self.previous)
+            self.previous = None
+
+
+def profiled_iter(iterable, name="data_loading"):
+    """
+    time each next() of the iterable, e.g. the batches fetched from a dataloader
+    """
+    iterator = iter(iterable)
+    while True:
+        with profile_span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
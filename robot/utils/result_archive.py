@@ -0,0 +1,323 @@
+"""
+Chunked binary archive of the registration results, one file per run.
+
+Each record is appended as a chunk: a fixed-size chunk header, a json record header (pair name, stage, meta,
+attribute -> offset, dtype, shape) and the raw arrays. On close, a json index of all the records and a fixed-size
+footer pointing to it are written at the end, so a single record is read by seeking into the file without
+scanning the rest. The records are keyed by (pair name, stage), e.g. ("copd1", "3d/test_epoch_-1"),
+each record holds the arrays of several shapes under "alias/attr", e.g. "flowed/points", "reg_param/reg_param_vector".
+
+An archive without a valid footer (e.g. the run was killed before close) is recovered by scanning the chunks,
+the incomplete last chunk is dropped. Reopening an archive in append mode continues after the last complete
+record, the index is rewritten on close.
+
+Examples:
+    >>> with ResultArchiveWriter("results.rba", float16=True) as writer:
+    >>>     writer.write("copd1", "iter_last", {"flowed/points": points}, meta={"score": 0.9})
+    >>> archive = ResultArchive("results.rba")
+    >>> points = archive.get("copd1", "iter_last", "flowed/points")
+    >>> archive.export_vtk("copd1", "iter_last", output_folder)
+"""
+import atexit
+import os
+import json
+import struct
+import threading
+import numpy as np
+
+MAGIC = b"RBARCHV1"
+FOOTER = struct.Struct("<8sQ")  # magic, index offset
+CHUNK_MAGIC = b"RBCHUNK1"
+CHUNK = struct.Struct("<8sQQ")  # magic, record header size, data size
+
+
+def _add_record(index, header, data_offset):
+    if "pair_name" not in header:
+        index["meta"].update(header["meta"])
+        return
+    record = index["records"].setdefault(header["pair_name"], {}).setdefault(
+        header["stage"], {"attrs": {}, "meta": {}}
+    )
+    for attr, info in header["attrs"].items():
+        record["attrs"][attr] = dict(info, offset=data_offset + info["offset"])
+    record["meta"].update(header["meta"])
+
+
+def _scan_chunks(f, size):
+    """
+    rebuild the index from the chunks, stop at the first incomplete or invalid chunk
+
+    :return: index, offset after the last complete chunk
+    """
+    index = {"meta": {}, "records": {}}
+    offset = 0
+    while offset + CHUNK.size <= size:
+        f.seek(offset)
+        magic, header_size, data_size = CHUNK.unpack(f.read(CHUNK.size))
+        data_offset = offset + CHUNK.size + header_size
+        if magic != CHUNK_MAGIC or data_offset + data_size > size:
+            break
+        try:
+            header = json.loads(f.read(header_size))
+        except ValueError:
+            break
+        _add_record(index, header, data_offset)
+        offset = data_offset + data_size
+    return index, offset
+
+
+def _read_index(f):
+    """
+    :return: index, offset where the next record is appended
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size >= FOOTER.size:
+        footer_offset = f.seek(-FOOTER.size, os.SEEK_END)
+        magic, index_offset = FOOTER.unpack(f.read(FOOTER.size))
+        if magic == MAGIC and index_offset <= footer_offset:
+            f.seek(index_offset)
+            try:
+                return json.loads(f.read(footer_offset - index_offset)), index_offset
+            except ValueError:
+                pass
+    index, offset = _scan_chunks(f, size)
+    if offset == 0 and size > 0:
+        raise ValueError("{} is not a result archive".format(f.name))
+    return index, offset
+
+
+class ResultArchiveWriter(object):
+    """
+    append the arrays of (pair name, stage) records into a single archive file, thread safe
+    """
+
+    def __init__(self, archive_path, float16=False, meta=None, append=True):
+        """
+        :param archive_path: the archive file
+        :param float16: store the floating arrays in float16, otherwise they are kept in their own precision
+        :param meta: json serializable run-level meta info
+        :param append: continue an existing archive, otherwise it is overwritten
+        """
+        self.archive_path = archive_path
+        self.float16 = float16
+        self._lock = threading.Lock()
+        folder = os.path.dirname(archive_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if append and os.path.isfile(archive_path):
+            self._file = open(archive_path, "r+b")
+            self.index, end_offset = _read_index(self._file)
+            self._file.seek(end_offset)
+            self._file.truncate()
+        else:
+            self._file = open(archive_path, "wb")
+            self.index = {"meta": {}, "records": {}}
+        if meta:
+            self._write_chunk({"meta": meta}, [])
+
+    def _write_chunk(self, header, items):
+        """
+        write a chunk and add it to the index, it is flushed so that it survives a killed run
+
+        :param header: json serializable record header, the attrs offsets are relative to the chunk data
+        :param items: the arrays of the chunk, in the order of the offsets
+        """
+        header_bytes = json.dumps(header).encode()
+        data_size = sum(item.nbytes for item in items)
+        data_offset = self._file.tell() + CHUNK.size + len(header_bytes)
+        self._file.write(CHUNK.pack(CHUNK_MAGIC, len(header_bytes), data_size))
+        self._file.write(header_bytes)
+        for item in items:
+            self._file.write(item.tobytes())
+        self._file.flush()
+        _add_record(self.index, header, data_offset)
+
+    def write(self, pair_name, stage, arrays, meta=None):
+        """
+        :param pair_name: str
+        :param stage: str
+        :param arrays: {attr: array}, the attributes of an existing record are added or replaced
+        :param meta: json serializable meta info of the record, e.g. the landmark errors
+        """
+        attrs, items, offset = {}, [], 0
+        for attr, item in arrays.items():
+            item = np.ascontiguousarray(item)
+            if self.float16 and item.dtype.kind == "f":
+                item = item.astype(np.float16)
+            attrs[attr] = {
+                "offset": offset,
+                "dtype": item.dtype.str,
+                "shape": list(item.shape),
+            }
+            items.append(item)
+            offset += item.nbytes
+        header = {
+            "pair_name": pair_name,
+            "stage": stage,
+            "attrs": attrs,
+            "meta": meta if meta is not None else {},
+        }
+        with self._lock:
+            self._write_chunk(header, items)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            index_offset = self._file.tell()
+            self._file.write(json.dumps(self.index).encode())
+            self._file.write(FOOTER.pack(MAGIC, index_offset))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ResultArchive(object):
+    """
+    read-only random access to an archive written by ResultArchiveWriter
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        with open(archive_path, "rb") as f:
+            self.index, _ = _read_index(f)
+        self.meta = self.index["meta"]
+        self.records = self.index["records"]
+
+    @property
+    def pair_names(self):
+        return list(self.records.keys())
+
+    def stages(self, pair_name):
+        return list(self.records[pair_name].keys())
+
+    def attrs(self, pair_name, stage):
+        return list(self.records[pair_name][stage]["attrs"].keys())
+
+    def record_meta(self, pair_name, stage):
+        return self.records[pair_name][stage]["meta"]
+
+    def get(self, pair_name, stage, attr=None):
+        """
+        :param pair_name: str
+        :param stage: str
+        :param attr: the attribute to read, or an alias prefix (e.g. "flowed"), None for the whole record
+        :return: array if attr is a full attribute name, otherwise {attr: array}
+        """
+        attrs = self.records[pair_name][stage]["attrs"]
+        if attr in attrs:
+            return self._read(attrs[attr])
+        prefix = "" if attr is None else attr + "/"
+        return {
+            name[len(prefix) :]: self._read(info)
+            for name, info in attrs.items()
+            if name.startswith(prefix)
+        }
+
+    def _read(self, info):
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        return np.fromfile(
+            self.archive_path, dtype=dtype, count=count, offset=info["offset"]
+        ).reshape(info["shape"])
+
+    def export_vtk(self, pair_name, stage, output_folder, ftype="vtk"):
+        """
+        write each shape (alias) of the record into output_folder/pair_name_alias.vtk
+
+        :return: list of the written files
+        """
+        from robot.utils.shape_visual_utils import write_shape_file
+
+        os.makedirs(output_folder, exist_ok=True)
+        aliases = {name.split("/")[0] for name in self.attrs(pair_name, stage)}
+        fpath_list = []
+        for alias in sorted(aliases):
+            arrays = self.get(pair_name, stage, alias)
+            if "points" not in arrays:
+                continue
+            points = arrays.pop("points").astype(np.float32)
+            faces = arrays.pop("faces", None)
+            point_arrays = {
+                key: item.astype(np.float32)
+                for key, item in arrays.items()
+                if len(item) == len(points)
+            }
+            fpath = os.path.join(
+                output_folder, "{}_{}.{}".format(pair_name, alias, ftype)
+            )
+            write_shape_file(fpath, points, faces, point_arrays)
+            fpath_list.append(fpath)
+        return fpath_list
+
+
+_result_archive = None
+_result_archive_root = None
+
+
+def open_result_archive(archive_path, root_path="", float16=False, meta=None):
+    """
+    once opened, save_shape_into_file writes into the archive instead of the vtk files,
+    the stage of a record is the saving folder relative to root_path
+
+    :param archive_path: the archive file
+    :param root_path: the record path of the run
+    :param float16: store the floating arrays in float16
+    :param meta: run-level meta info
+    :return: ResultArchiveWriter
+    """
+    global _result_archive, _result_archive_root
+    close_result_archive()
+    _result_archive = ResultArchiveWriter(archive_path, float16, meta)
+    _result_archive_root = root_path
+    return _result_archive
+
+
+def init_result_archive(opt, record_path, archive_name="results.rba"):
+    """
+    open the archive record_path/archive_name if set in opt
+
+    :param opt: ParameterDict
+    :param record_path: the record path of the run
+    :param archive_name: the archive file name, e.g. one archive per evaluation worker
+    """
+    save_as_archive = opt[
+        (
+            "save_result_as_archive",
+            False,
+            "write the shape outputs into a single binary archive (record_path/results.rba) instead of the vtk files",
+        )
+    ]
+    archive_float16 = opt[
+        ("result_archive_float16", False, "store the archived arrays in float16")
+    ]
+    if save_as_archive:
+        open_result_archive(
+            os.path.join(record_path, archive_name), record_path, archive_float16
+        )
+
+
+def get_result_archive():
+    return _result_archive
+
+
+def result_archive_stage(folder_path):
+    return os.path.relpath(folder_path, _result_archive_root or ".")
+
+
+def close_result_archive():
+    global _result_archive
+    if _result_archive is not None:
+        from robot.utils.async_writer import flush_shape_writer
+
+        flush_shape_writer()
+        _result_archive.close()
+        _result_archive = None
+
+
+atexit.register(close_result_archive)
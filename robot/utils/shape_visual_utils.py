@@ -3,12 +3,38 @@ import numpy as np
 import torch
 import pyvista as pv
 from robot.datasets.vtk_utils import convert_faces_into_file_format
+from robot.utils.async_writer import get_shape_writer
+from robot.utils.result_archive import get_result_archive, result_archive_stage
+from robot.utils.profiler import profile_span
 
 
+@profile_span("io_write")
+def write_shape_file(fpath, points, faces=None, point_arrays={}):
+    """
+    :param fpath: output path, the format is inferred from the suffix, e.g. vtk/ply
+    :param points: NxD array
+    :param faces: Fx3 array
+    :param point_arrays: dict of N-length arrays
+    """
+    if faces is not None:
+        face = convert_faces_into_file_format(faces)
+        data = pv.PolyData(points, face)
+    else:
+        data = pv.PolyData(points)
+    for key, item in point_arrays.items():
+        data.point_arrays[key] = item
+    data.save(fpath)
+
+
+@profile_span("io_snapshot")
 def save_shape_into_file(folder_path, alias, pair_name, ftype="vtk", **args):
+    """
+    the arrays are snapshot on the cpu here, the files are written by the shared writer (see async_writer),
+    if a result archive is opened (see result_archive), the arrays are appended into it instead of the vtk files
+    """
     for key, item in args.items():
         if isinstance(item, torch.Tensor):
-            args[key] = item.cpu().detach().numpy()
+            args[key] = item.detach().cpu().numpy().copy()
     points = args["points"]
     if len(points.shape) == 3:
         nbatch, _, _ = points.shape
@@ -19,21 +45,34 @@ def save_shape_into_file(folder_path, alias, pair_name, ftype="vtk", **args):
         nbatch = 1
     else:
         raise ValueError("shape not supported")
+    writer = get_shape_writer()
+    archive = get_result_archive()
+    if archive is not None:
+        stage = result_archive_stage(folder_path)
+        for b in range(nbatch):
+            arrays = {
+                alias + "/" + key: item[b]
+                for key, item in args.items()
+                if item is not None
+            }
+            writer.submit(archive.write, pair_name[b], stage, arrays)
+        return
     os.makedirs(folder_path, exist_ok=True)
     faces = args["faces"] if "faces" in args else None
     for b in range(nbatch):
-        if faces is not None:
-            face = convert_faces_into_file_format(faces[b])
-            data = pv.PolyData(points[b], face)
-        else:
-            data = pv.PolyData(points[b])
-        for key, item in args.items():
-            if key not in ["points", "faces"]:
-                data.point_arrays[key] = item[b]
+        point_arrays = {
+            key: item[b] for key, item in args.items() if key not in ["points", "faces"]
+        }
         fpath = os.path.join(
             folder_path, pair_name[b] + "_" + alias + ".{}".format(ftype)
         )
-        data.save(fpath)
+        writer.submit(
+            write_shape_file,
+            fpath,
+            points[b],
+            faces[b] if faces is not None else None,
+            point_arrays,
+        )
 
 
 def save_shape_into_files(folder_path, alias, name, shape):
@@ -88,8 +127,20 @@ def save_shape_pair_into_files(folder_path, stage_name, pair_name, shape_pair):
                 }
             )
         else:
-            reg_param = shape_pair.reg_param.detach().cpu().numpy()
-            np.save(os.path.join(folder_path, "reg_param_prealigned.npy"), reg_param)
+            reg_param = shape_pair.reg_param.detach().cpu().numpy().copy()
+            archive = get_result_archive()
+            if archive is not None:
+                for b in range(len(reg_param)):
+                    get_shape_writer().submit(
+                        archive.write,
+                        pair_name[b],
+                        result_archive_stage(folder_path),
+                        {"reg_param/prealigned": reg_param[b]},
+                    )
+                return
+            get_shape_writer().submit(
+                np.save, os.path.join(folder_path, "reg_param_prealigned.npy"), reg_param
+            )
 
 
 def make_sphere(npoints=6000, ndim=3, radius=None, center=None):
@@ -0,0 +1,696 @@
+"""
+Native log-domain (unbalanced) sinkhorn engine.
+
+The interface and the conventions follow geomloss.SamplesLoss(loss='sinkhorn', debias=False):
+cost C(x,y)=|x-y|^p/p, eps=blur^p, rho=reach^p, the plan is P_ij = a_i b_j exp((F_i+G_j-C_ij)/eps),
+so the solvers can be used anywhere a geomloss object string is expected, e.g.
+"sinkhorn_utils.SinkhornEngine(blur=0.01, scaling=0.8, reach=1)".
+
+SinkhornEngine.solve returns an OTResult, it keeps the potentials together with the inputs,
+the transport plan (dense or KeOps LazyTensor), its marginals and the barycentric map are computed from it
+without any further solve. Besides the eps-scaling, the engine supports
+    * KL or TV relaxation of the marginal constraints
+    * batch of pairs of different sizes (padded with zero weights, see solve_packed)
+    * multiscale: the problem is first solved on the grid_cluster centroids, the fine iterations only visit
+      the cluster pairs that are not negligible (block-sparse KeOps reductions), which makes large problems
+      tractable on the cpu
+
+In registration, consecutive calls solve nearly identical problems (the source only moves a little between
+two iterations), WarmStartSinkhorn keeps the potentials of the last call and, if the points have moved less than
+restart_ratio*diameter (and the weights are unchanged), starts the eps-scaling from the displacement scale
+instead of the diameter and iterates at the final eps until the potentials converge. The solvers are owned by
+the model through an OTSolverCache, which is reset before each pair.
+"""
+import numpy as np
+import torch
+from robot.utils.obj_factory import obj_factory, partial_obj_factory
+from robot.utils.packed_utils import packed_to_padded
+from robot.utils.profiler import profile_span
+
+
+def max_diameter(x, y):
+    D = x.shape[-1]
+    x, y = x.reshape(-1, D), y.reshape(-1, D)
+    mins = torch.min(x.min(0)[0], y.min(0)[0])
+    maxs = torch.max(x.max(0)[0], y.max(0)[0])
+    return (maxs - mins).norm().item()
+
+
+def epsilon_schedule(p, diameter, blur, scaling):
+    """the same exponential cooling as geomloss, from diameter^p to blur^p"""
+    return (
+        [diameter ** p]
+        + [
+            float(np.exp(e))
+            for e in np.arange(p * np.log(diameter), p * np.log(blur), p * np.log(scaling))
+        ]
+        + [blur ** p]
+    )
+
+
+def aprox(x, eps, rho, marginal="kl"):
+    """
+    proximal operator of the marginal penalty, applied on the softmin
+
+    :param rho: None for the balanced ot
+    :param marginal: "kl", rho*KL(P1|a), the softmin is dampened; "tv", rho*|P1-a|, the softmin is clamped
+    """
+    if rho is None:
+        return x
+    if marginal == "kl":
+        return x / (1.0 + eps / rho)
+    return x.clamp(-rho, rho)
+
+
+def log_weights(a):
+    a_log = a.log()
+    a_log[a <= 0] = -100000
+    return a_log
+
+
+def cost_tensorized(x, y, p):
+    """
+    :param x: BxNxD
+    :param y: BxMxD
+    :param p: 1 or 2
+    :return: BxNxM, |x-y|^p/p
+    """
+    dist2 = (
+        (x ** 2).sum(-1, keepdim=True)
+        - 2 * x @ y.transpose(2, 1)
+        + (y ** 2).sum(-1)[:, None]
+    ).clamp(min=0)
+    return dist2 / 2 if p == 2 else dist2.sqrt()
+
+
+def cost_lazy(x_i, y_j, p):
+    dist2 = x_i.sqdist(y_j)
+    return dist2 / 2 if p == 2 else dist2.sqrt()
+
+
+def softmin_tensorized(eps, C_xy, h_y):
+    """
+    :param eps: scalar
+    :param C_xy: BxNxM cost
+    :param h_y: BxM, log weights + potential/eps
+    :return: BxN, -eps*log sum_j exp(h_j - C_ij/eps)
+    """
+    return -eps * (h_y[:, None, :] - C_xy / eps).logsumexp(2)
+
+
+def softmin_keops(eps, C_xy, h_y):
+    """
+    same as softmin_tensorized, C_xy=(x, y, p) is computed on the fly via KeOps,
+    C_xy=(x, y, p, ranges) for a block-sparse reduction of a single pair, see pykeops.torch.cluster.from_matrix
+
+    :param eps: scalar
+    :param C_xy: tuple of BxNxD, BxMxD, p (NxD, MxD, p, ranges for the block-sparse reduction)
+    :param h_y: BxM (M)
+    :return: BxN (N)
+    """
+    from pykeops.torch import LazyTensor
+
+    x, y, p = C_xy[:3]
+    if len(C_xy) > 3:
+        ranges = C_xy[3]
+        x_i, y_j, h_j = LazyTensor(x[:, None]), LazyTensor(y[None]), LazyTensor(h_y[None, :, None])
+        return -eps * (h_j - cost_lazy(x_i, y_j, p) / eps).logsumexp(dim=1, ranges=ranges).view(-1)
+    B, N = x.shape[:2]
+    x_i = LazyTensor(x[:, :, None])
+    y_j = LazyTensor(y[:, None])
+    h_j = LazyTensor(h_y[:, None, :, None])
+    return -eps * (h_j - cost_lazy(x_i, y_j, p) / eps).logsumexp(dim=2).view(B, N)
+
+
+class OTResult(object):
+    """
+    the solution of a batch of ot problems, P_ij = a_i b_j exp((F_i+G_j-C_ij)/eps)
+
+    Examples:
+        >>> result = SinkhornEngine(blur=0.01, reach=1)(a, x, b, y)
+        >>> mapped, mass_ratio = result.barycentric_map(y)
+    """
+
+    def __init__(self, a, x, b, y, f, g, eps, p, lazy):
+        """
+        :param a: BxN weights
+        :param x: BxNxD
+        :param b: BxM weights
+        :param y: BxMxD
+        :param f: BxN potential F
+        :param g: BxM potential G
+        :param eps: the final temperature blur^p
+        :param p: order of the cost
+        :param lazy: compute the plan via KeOps LazyTensor, otherwise the dense BxNxM plan is built
+        """
+        self.a, self.x, self.b, self.y = a, x, b, y
+        self.f, self.g = f, g
+        self.eps = eps
+        self.p = p
+        self.lazy = lazy
+
+    @property
+    def potentials(self):
+        return self.f, self.g
+
+    def log_plan(self, lazy=None):
+        """
+        :param lazy: return a BxNxMx1 LazyTensor, otherwise a dense BxNxM tensor, the setting of the solve by default
+        :return: log P_ij
+        """
+        lazy = self.lazy if lazy is None else lazy
+        a_log, b_log = log_weights(self.a), log_weights(self.b)
+        if not lazy:
+            C_xy = cost_tensorized(self.x, self.y, self.p)
+            return (
+                a_log[:, :, None]
+                + b_log[:, None]
+                + (self.f[:, :, None] + self.g[:, None] - C_xy) / self.eps
+            )
+        from pykeops.torch import LazyTensor
+
+        B, N, M = self.x.shape[0], self.x.shape[1], self.y.shape[1]
+        x_i, y_j = LazyTensor(self.x[:, :, None]), LazyTensor(self.y[:, None])
+        h_i = LazyTensor((a_log + self.f / self.eps).view(B, N, 1, 1))
+        h_j = LazyTensor((b_log + self.g / self.eps).view(B, 1, M, 1))
+        return h_i + h_j - cost_lazy(x_i, y_j, self.p) / self.eps
+
+    def _row_reduce(self, values=None):
+        """
+        :param values: BxMxK or None
+        :return: BxN log sum_j P_ij, BxNxK sum_j P_ij v_j / sum_j P_ij
+        """
+        log_P = self.log_plan()
+        if not self.lazy:
+            log_mass = log_P.logsumexp(2)
+            return log_mass, None if values is None else log_P.softmax(2) @ values
+        from pykeops.torch import LazyTensor
+
+        B, N = self.x.shape[:2]
+        log_mass = log_P.logsumexp(dim=2).view(B, N)
+        if values is None:
+            return log_mass, None
+        return log_mass, log_P.sumsoftmaxweight(LazyTensor(values[:, None]), dim=2)
+
+    def marginals(self):
+        """
+        :return: BxN sum_j P_ij, BxM sum_i P_ij
+        """
+        row_log_mass = self._row_reduce()[0]
+        return row_log_mass.exp(), self.transpose()._row_reduce()[0].exp()
+
+    def transpose(self):
+        """
+        :return: OTResult of the transposed plan P^T, i.e. the roles of (a, x) and (b, y) are swapped
+        """
+        return OTResult(
+            self.b, self.y, self.a, self.x, self.g, self.f, self.eps, self.p, self.lazy
+        )
+
+    def apply(self, values):
+        """
+        :param values: BxMxK
+        :return: BxNxK, P @ values
+        """
+        log_mass, averaged = self._row_reduce(values)
+        return log_mass.exp()[..., None] * averaged
+
+    def barycentric_map(self, target=None):
+        """
+        :param target: BxMxd values to map, the target points y by default
+        :return: BxNxd mapped values sum_j P_ij t_j / sum_j P_ij, BxN mass ratio sum_j P_ij / a_i
+        """
+        target = self.y if target is None else target
+        log_mass, mapped = self._row_reduce(target)
+        return mapped, (log_mass - log_weights(self.a)).exp()
+
+    def fused_map(self, target=None, K=1, tile_size=2048):
+        """
+        the barycentric map, the mass ratio and the top-K matches in a single sweep over the plan,
+        the plan is computed in tile_size x tile_size blocks (see tiled_kernels.tiled_softmax_topk_reduction)
+
+        :param target: BxMxd values to map, the target points y by default
+        :param K: number of the top matches
+        :param tile_size: tile size over both N and M
+        :return: BxNxd mapped values, BxN mass ratio, BxN argmax_j P_ij, BxNxK top-K j (descending P_ij)
+        """
+        from robot.kernels.tiled_kernels import tiled_softmax_topk_reduction
+
+        target = self.y if target is None else target
+        a_log = log_weights(self.a)
+        h_i = (a_log + self.f / self.eps)[..., None]
+        h_j = (log_weights(self.b) + self.g / self.eps)[..., None]
+
+        def log_plan_block(x, h_i, y, h_j):
+            C_xy = cost_tensorized(x, y, self.p)
+            return h_i + h_j.transpose(2, 1) - C_xy / self.eps
+
+        log_mass, mapped, topk_index = tiled_softmax_topk_reduction(
+            log_plan_block, [self.x, h_i], [self.y, h_j], target, K, tile_size
+        )
+        return mapped, (log_mass - a_log).exp(), topk_index[..., 0], topk_index
+
+
+class SinkhornEngine(object):
+    """
+    (unbalanced) sinkhorn solver with eps-scaling and multiscale, support batch
+    """
+
+    def __init__(
+        self,
+        loss="sinkhorn",
+        p=2,
+        blur=0.05,
+        reach=None,
+        marginal="kl",
+        diameter=None,
+        scaling=0.5,
+        truncate=5,
+        cluster_scale=None,
+        debias=False,
+        potentials=False,
+        backend="auto",
+    ):
+        """
+        :param loss: only "sinkhorn" is supported, kept for the compatibility with the geomloss settings
+        :param p: order of the cost, 1 or 2
+        :param blur: the final temperature is blur^p
+        :param reach: the marginal constraints strength is reach^p, None for balanced ot
+        :param marginal: kl / tv, the penalty of the marginal constraints in the unbalanced ot
+        :param diameter: upper bound of the distances between the points, computed from the points if None
+        :param scaling: eps-scaling ratio of the blur between two iterations
+        :param truncate: multiscale, the cluster pairs with (F_i+G_j-C_ij) < -truncate*eps are skipped in the fine iterations
+        :param cluster_scale: multiscale, the grid size of the clustering, diameter/(sqrt(D)*2000^(1/D)) if None
+        :param debias: only False is supported
+        :param potentials: return the dual potentials F, G instead of the loss
+        :param backend: tensorized / online(KeOps) / multiscale(KeOps block-sparse) /
+            auto (tensorized if N*M<5000^2, else multiscale for D<=3 and online otherwise)
+        """
+        assert loss == "sinkhorn" and p in [1, 2]
+        assert not debias, "the debiased sinkhorn divergence is not supported"
+        assert marginal in ["kl", "tv"]
+        assert backend in ["auto", "tensorized", "online", "multiscale"]
+        self.p = p
+        self.blur = blur
+        self.reach = reach
+        self.marginal = marginal
+        self.diameter = diameter
+        self.scaling = scaling
+        self.truncate = truncate
+        self.cluster_scale = cluster_scale
+        self.potentials = potentials
+        self.backend = backend
+        self.n_iter = 0
+
+    def _rho(self):
+        return None if self.reach is None else self.reach ** self.p
+
+    def _aprox(self, x, eps):
+        return aprox(x, eps, self._rho(), self.marginal)
+
+    def _resolve_backend(self, N, M, D):
+        if self.backend != "auto":
+            return self.backend
+        if N * M <= 5000 ** 2:
+            return "tensorized"
+        return "multiscale" if D <= 3 else "online"
+
+    def _cost(self, x, y, backend):
+        if backend == "tensorized":
+            return cost_tensorized(x, y, self.p), softmin_tensorized
+        return (x, y, self.p), softmin_keops
+
+    def _diameter(self, a, x, b, y):
+        if self.diameter is not None:
+            return self.diameter
+        return max_diameter(x[a > 0], y[b > 0])  # the padded points are skipped
+
+    def _sinkhorn_loop(self, softmin, a_log, C_xy, b_log, C_yx, eps_list, init=None, n_extra=0, tol=0.0):
+        """
+        symmetric sinkhorn updates along the eps_list, no gradient is recorded
+
+        :param init: (f, g), warm start, the potentials are initialized at eps_list[0] if None
+        :param n_extra: max number of extra iterations at the final eps, stop when the potentials change by less than tol*eps
+        :return: f, g, number of iterations
+        """
+        if init is None:
+            eps = eps_list[0]
+            f_ba = self._aprox(softmin(eps, C_xy, b_log), eps)
+            g_ab = self._aprox(softmin(eps, C_yx, a_log), eps)
+        else:
+            f_ba, g_ab = init
+        n_iter = 0
+        for eps in eps_list:
+            ft_ba = self._aprox(softmin(eps, C_xy, b_log + g_ab / eps), eps)
+            gt_ab = self._aprox(softmin(eps, C_yx, a_log + f_ba / eps), eps)
+            f_ba, g_ab = 0.5 * (f_ba + ft_ba), 0.5 * (g_ab + gt_ab)
+            n_iter += 1
+        eps = eps_list[-1]
+        for _ in range(n_extra):
+            ft_ba = self._aprox(softmin(eps, C_xy, b_log + g_ab / eps), eps)
+            gt_ab = self._aprox(softmin(eps, C_yx, a_log + f_ba / eps), eps)
+            change = max(
+                (ft_ba - f_ba).abs().max().item(), (gt_ab - g_ab).abs().max().item()
+            )
+            f_ba, g_ab = 0.5 * (f_ba + ft_ba), 0.5 * (g_ab + gt_ab)
+            n_iter += 1
+            if change < tol * eps:
+                break
+        return f_ba, g_ab, n_iter
+
+    def _multiscale_pair(self, a, x, b, y, eps_list, diameter):
+        """
+        coarse-to-fine sinkhorn of a single pair, the points with zero weight are skipped
+
+        :param a: N weights
+        :param x: NxD
+        :param b: M weights
+        :param y: MxD
+        :return: N f, M g, number of iterations
+        """
+        from pykeops.torch.cluster import (
+            grid_cluster,
+            cluster_ranges_centroids,
+            from_matrix,
+            swap_axes,
+        )
+
+        D = x.shape[-1]
+        x_mask, y_mask = a > 0, b > 0
+        a_s, x_s, b_s, y_s = a[x_mask], x[x_mask], b[y_mask], y[y_mask]
+        cluster_scale = (
+            self.cluster_scale
+            if self.cluster_scale is not None
+            else diameter / (np.sqrt(D) * 2000 ** (1.0 / D))
+        )
+        # sort the points by cluster, the clusters are then contiguous ranges
+        x_lab, x_perm = torch.sort(grid_cluster(x_s, cluster_scale))
+        y_lab, y_perm = torch.sort(grid_cluster(y_s, cluster_scale))
+        a_s, x_s, b_s, y_s = a_s[x_perm], x_s[x_perm], b_s[y_perm], y_s[y_perm]
+        ranges_x, x_c, a_c = cluster_ranges_centroids(x_s, x_lab, weights=a_s)
+        ranges_y, y_c, b_c = cluster_ranges_centroids(y_s, y_lab, weights=b_s)
+        a_c_log, b_c_log = log_weights(a_c)[None], log_weights(b_c)[None]
+        x_c, y_c = x_c[None], y_c[None]
+
+        # coarse iterations until the blur reaches the cluster scale
+        n_coarse = max(1, len([eps for eps in eps_list if eps > cluster_scale ** self.p]))
+        coarse_backend = "tensorized" if x_c.shape[1] * y_c.shape[1] <= 5000 ** 2 else "online"
+        C_xy, softmin = self._cost(x_c, y_c, coarse_backend)
+        C_yx, _ = self._cost(y_c, x_c, coarse_backend)
+        f_c, g_c, n_iter = self._sinkhorn_loop(
+            softmin, a_c_log, C_xy, b_c_log, C_yx, eps_list[:n_coarse]
+        )
+
+        # extrapolate to the fine points, the negligible cluster pairs are truncated
+        eps = eps_list[n_coarse - 1]
+        keep = f_c[0][:, None] + g_c[0][None] > cost_tensorized(x_c, y_c, self.p)[0] - self.truncate * eps
+        ranges_xy = from_matrix(ranges_x, ranges_y, keep)
+        ranges_yx = swap_axes(ranges_xy)
+        f = self._aprox(softmin_keops(eps, (x_s[None], y_c, self.p), b_c_log + g_c / eps), eps)[0]
+        g = self._aprox(softmin_keops(eps, (y_s[None], x_c, self.p), a_c_log + f_c / eps), eps)[0]
+        if n_coarse < len(eps_list):
+            f, g, n_fine = self._sinkhorn_loop(
+                softmin_keops,
+                log_weights(a_s),
+                (x_s, y_s, self.p, ranges_xy),
+                log_weights(b_s),
+                (y_s, x_s, self.p, ranges_yx),
+                eps_list[n_coarse:],
+                init=(f, g),
+            )
+            n_iter += n_fine
+
+        f_out, g_out = a.new_zeros(a.shape), b.new_zeros(b.shape)
+        f_out[x_mask.nonzero()[:, 0][x_perm]] = f
+        g_out[y_mask.nonzero()[:, 0][y_perm]] = g
+        return f_out, g_out, n_iter
+
+    def _schedule(self, a, x, b, y, diameter):
+        """
+        :return: eps_list, init potentials (None for a cold start),
+            max number of extra iterations at the final eps and their stopping tolerance
+        """
+        return epsilon_schedule(self.p, diameter, self.blur, self.scaling), None, 0, 0.0
+
+    @profile_span("ot")
+    def solve(self, a, x, b, y):
+        """
+        :param a: BxN weights, zero weights for the padded points
+        :param x: BxNxD
+        :param b: BxM weights
+        :param y: BxMxD
+        :return: OTResult, the potentials carry the gradient w.r.t. x, y via the last extrapolation as in geomloss
+        """
+        B, N, M, D = x.shape[0], x.shape[1], y.shape[1], x.shape[2]
+        backend = self._resolve_backend(N, M, D)
+        a_log, b_log = log_weights(a), log_weights(b)
+        grad_enable_record = torch.is_grad_enabled()
+        torch.set_grad_enabled(False)
+        a_d, x_d, b_d, y_d = a.detach(), x.detach(), b.detach(), y.detach()
+        diameter = self._diameter(a_d, x_d, b_d, y_d)
+        eps_list, init, n_extra, tol = self._schedule(a_d, x_d, b_d, y_d, diameter)
+        if backend == "multiscale" and init is None:
+            potentials = [
+                self._multiscale_pair(a_d[i], x_d[i], b_d[i], y_d[i], eps_list, diameter)
+                for i in range(B)
+            ]
+            f_ba = torch.stack([potential[0] for potential in potentials])
+            g_ab = torch.stack([potential[1] for potential in potentials])
+            self.n_iter = max(potential[2] for potential in potentials)
+        else:
+            loop_backend = "online" if backend == "multiscale" else backend
+            C_xy, softmin = self._cost(x_d, y_d, loop_backend)
+            C_yx, _ = self._cost(y_d, x_d, loop_backend)
+            f_ba, g_ab, self.n_iter = self._sinkhorn_loop(
+                softmin, a_log, C_xy, b_log, C_yx, eps_list, init, n_extra, tol
+            )
+        self._update_state(a_d, x_d, b_d, y_d, f_ba, g_ab)
+        torch.set_grad_enabled(True)
+        # last extrapolation, the gradients only flow through this step (envelope theorem)
+        eps = self.blur ** self.p
+        lazy = backend != "tensorized"
+        backend = "online" if lazy else backend
+        C_xy, softmin = self._cost(x, y.detach(), backend)
+        C_yx, _ = self._cost(y, x.detach(), backend)
+        f_ba, g_ab = (
+            self._aprox(softmin(eps, C_xy, (b_log + g_ab / eps).detach()), eps),
+            self._aprox(softmin(eps, C_yx, (a_log + f_ba / eps).detach()), eps),
+        )
+        torch.set_grad_enabled(grad_enable_record)
+        return OTResult(a, x, b, y, f_ba, g_ab, eps, self.p, lazy)
+
+    def solve_packed(self, a, x, x_offsets, b, y, y_offsets):
+        """
+        solve a batch of pairs of different sizes in the packed form (see packed_utils)
+
+        :param a: (sum_b N_b) weights
+        :param x: (sum_b N_b)xD
+        :param x_offsets: B+1
+        :param b: (sum_b M_b) weights
+        :param y: (sum_b M_b)xD
+        :param y_offsets: B+1
+        :return: OTResult of the padded BxN_max, BxM_max problems, the padded points have zero weights
+        """
+        a = packed_to_padded(a, x_offsets)
+        b = packed_to_padded(b, y_offsets)
+        x = packed_to_padded(x, x_offsets)
+        y = packed_to_padded(y, y_offsets)
+        return self.solve(a, x, b, y)
+
+    def _update_state(self, a, x, b, y, f_ba, g_ab):
+        pass
+
+    def cost(self, result):
+        """the (biased) entropic ot cost from the potentials, same as geomloss sinkhorn_cost for the kl relaxation"""
+        a, b, f_ba, g_ab = result.a, result.b, result.f, result.g
+        if self.reach is None:
+            return (a * f_ba).sum(-1) + (b * g_ab).sum(-1)
+        eps, rho = self.blur ** self.p, self.reach ** self.p
+        if self.marginal == "kl":
+            weight = rho + eps / 2
+            return (a * weight * (1 - (-f_ba / rho).exp())).sum(-1) + (
+                b * weight * (1 - (-g_ab / rho).exp())
+            ).sum(-1)
+        # tv, the potentials lie in [-rho, rho], the entropic term is not vanishing for the unbalanced marginals
+        mass = result.marginals()[0].sum(-1)
+        return (
+            (a * f_ba).sum(-1)
+            + (b * g_ab).sum(-1)
+            - eps * (mass - a.sum(-1) * b.sum(-1))
+        )
+
+    def __call__(self, a, x, b, y):
+        """
+        :param a: BxN or N weights
+        :param x: BxNxD or NxD
+        :param b: BxM or M weights
+        :param y: BxMxD or MxD
+        :return: loss B (or scalar), or the potentials F, G in the shape of a, b
+        """
+        batch = x.dim() == 3
+        if not batch:
+            a, x, b, y = a[None], x[None], b[None], y[None]
+        result = self.solve(a, x, b, y)
+        if self.potentials:
+            return (result.f, result.g) if batch else (result.f[0], result.g[0])
+        loss = self.cost(result)
+        return loss if batch else loss[0]
+
+
+class WarmStartSinkhorn(SinkhornEngine):
+    """
+    Stateful (unbalanced) sinkhorn solver, support batch
+    """
+
+    def __init__(
+        self,
+        loss="sinkhorn",
+        p=2,
+        blur=0.05,
+        reach=None,
+        marginal="kl",
+        diameter=None,
+        scaling=0.5,
+        truncate=5,
+        cluster_scale=None,
+        debias=False,
+        potentials=False,
+        backend="auto",
+        warm_start=True,
+        restart_ratio=0.1,
+        tol=0.2,
+        max_iter=1000,
+    ):
+        """
+        see SinkhornEngine for the ot settings
+
+        :param warm_start: reuse the potentials of the last call if the weights are unchanged
+        :param restart_ratio: solve from scratch if the points moved more than restart_ratio*diameter
+        :param tol: a warm-started solve iterates at the final eps until the potentials change by less than tol*eps
+        :param max_iter: safety cap of the iterations at the final eps of a warm-started solve
+        """
+        super(WarmStartSinkhorn, self).__init__(
+            loss, p, blur, reach, marginal, diameter, scaling, truncate, cluster_scale, debias, potentials, backend
+        )
+        self.warm_start = warm_start
+        self.restart_ratio = restart_ratio
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_warm = 0
+        self.n_cold = 0
+        self.reset()
+
+    def reset(self):
+        self._state = None
+
+    def _warm_start_scale(self, a, x, b, y, diameter):
+        """
+        :return: the displacement since the last call, None if the last potentials can't be reused
+        """
+        if not self.warm_start or self._state is None:
+            return None
+        prev_a, prev_x, prev_b, prev_y, _, _ = self._state
+        if prev_x.shape != x.shape or prev_y.shape != y.shape or prev_x.device != x.device:
+            return None
+        # the potentials of other weights belong to another problem
+        if not (torch.equal(prev_a, a) and torch.equal(prev_b, b)):
+            return None
+        disp = max(
+            (x - prev_x).norm(dim=-1).max().item(),
+            (y - prev_y).norm(dim=-1).max().item(),
+        )
+        return disp if disp <= self.restart_ratio * diameter else None
+
+    def _schedule(self, a, x, b, y, diameter):
+        disp = self._warm_start_scale(a, x, b, y, diameter)
+        if disp is None:
+            self.n_cold += 1
+            return super(WarmStartSinkhorn, self)._schedule(a, x, b, y, diameter)
+        # anneal from the displacement scale, the structure coarser than that is already in the potentials
+        self.n_warm += 1
+        eps_list = epsilon_schedule(self.p, max(disp, self.blur), self.blur, self.scaling)
+        return eps_list, (self._state[4], self._state[5]), self.max_iter, self.tol
+
+    def _update_state(self, a, x, b, y, f_ba, g_ab):
+        self._state = (a.clone(), x.clone(), b.clone(), y.clone(), f_ba, g_ab)
+
+    def stats(self):
+        return {"warm": self.n_warm, "cold": self.n_cold, "last_n_iter": self.n_iter}
+
+
+GEOMLOSS_ARGS = [
+    "loss",
+    "p",
+    "blur",
+    "reach",
+    "diameter",
+    "scaling",
+    "truncate",
+    "cost",
+    "kernel",
+    "cluster_scale",
+    "debias",
+    "potentials",
+    "verbose",
+    "backend",
+]
+ENGINE_ARGS = ["p", "blur", "reach", "diameter", "scaling", "truncate", "cluster_scale", "backend"]
+
+
+def sinkhorn_engine(geom_obj):
+    """
+    build the SinkhornEngine of the obj string, a "geomloss.SamplesLoss(loss='sinkhorn', ...)" string is translated
+    into the engine with the same setting, the arguments only used by geomloss (e.g. cost, verbose) are dropped,
+    the potentials are always the (biased) transport potentials
+
+    :param geom_obj: obj string of a SinkhornEngine (or its subclass) or of a geomloss sinkhorn loss
+    :return: SinkhornEngine
+    """
+    if geom_obj.startswith("geomloss."):
+        geomloss_partial = partial_obj_factory(geom_obj)
+        kwargs = dict(geomloss_partial.keywords)
+        kwargs.update(dict(zip(GEOMLOSS_ARGS, geomloss_partial.args)))
+        assert kwargs.get("loss", "sinkhorn") == "sinkhorn", "only the sinkhorn loss is supported"
+        kwargs = {key: kwargs[key] for key in ENGINE_ARGS if key in kwargs}
+        geom_obj = "sinkhorn_utils.SinkhornEngine({})".format(
+            ",".join("{}={!r}".format(key, item) for key, item in kwargs.items())
+        )
+    solver = obj_factory(geom_obj)
+    assert isinstance(solver, SinkhornEngine), "{} is not a SinkhornEngine".format(geom_obj)
+    return solver
+
+
+class OTSolverCache(object):
+    """
+    The ot solvers of a model, built once per obj string and reused in the later calls,
+    so that a stateful solver (e.g. WarmStartSinkhorn) keeps its potentials across the iterations of a pair.
+    The owner calls reset() before a new pair (e.g. in model.clean()).
+    """
+
+    def __init__(self):
+        self.solvers = {}
+
+    def get(self, geom_obj):
+        """
+        :param geom_obj: obj string, e.g. "sinkhorn_utils.WarmStartSinkhorn(blur=0.01)"
+        :return: the solver
+        """
+        if geom_obj not in self.solvers:
+            self.solvers[geom_obj] = obj_factory(geom_obj)
+        return self.solvers[geom_obj]
+
+    def get_engine(self, geom_obj):
+        """
+        :param geom_obj: obj string of a SinkhornEngine or of a geomloss sinkhorn loss, see sinkhorn_engine
+        :return: SinkhornEngine
+        """
+        key = ("engine", geom_obj)
+        if key not in self.solvers:
+            self.solvers[key] = sinkhorn_engine(geom_obj)
+        return self.solvers[key]
+
+    def reset(self):
+        """drop the state of the stateful solvers, the solvers themselves stay shared with their users"""
+        for solver in self.solvers.values():
+            if hasattr(solver, "reset"):
+                solver.reset()
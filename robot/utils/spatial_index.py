@@ -0,0 +1,471 @@
+"""
+Spatial index for batched point clouds.
+
+The index is built once per shape (e.g. the target, which is fixed during a registration)
+and answers batched knn and radius queries without going through all the pairs.
+The points are hashed into a uniform grid (cell list), a query only visits the cells around it,
+the search ring grows until the knn result is guaranteed to be exact, the rare queries that are
+still unresolved after max_ring fall back to a brute force search.
+All operations are vectorized torch ops, so they run multi-threaded on cpu and also work on gpu.
+"""
+import itertools
+import numpy as np
+import torch
+
+
+class CellList(object):
+    """
+    a uniform grid over a batch of point clouds, the batch index is hashed together with the cell index,
+    the grid is built once and can be queried by any point set, queries out of the grid are clamped to the border cells
+    """
+
+    def __init__(self, points, cell_size, low=None, high=None):
+        """
+        :param points: torch.Tensor, BxMxD
+        :param cell_size: scalar, the size of the grid cell
+        :param low: optional torch.Tensor, D, lower corner of the domain that the queries live in
+        :param high: optional torch.Tensor, D, upper corner of the domain that the queries live in
+        """
+        B, M, D = points.shape
+        self.nbatch, self.npoints, self.dimension = B, M, D
+        self.cell_size = cell_size
+        with torch.no_grad():
+            points_low = points.reshape(-1, D).min(0)[0]
+            points_high = points.reshape(-1, D).max(0)[0]
+            self.low = points_low if low is None else torch.min(low, points_low)
+            high = points_high if high is None else torch.max(high, points_high)
+            # one padding cell on each side, the occupied cells are in [1, grid_size-2]
+            self.grid_size = ((high - self.low) / cell_size).floor().long() + 3
+            if float(np.prod(self.grid_size.tolist())) * B > 2 ** 62:
+                raise ValueError(
+                    "the cell size {} is too small for the domain, the grid can not be hashed".format(
+                        cell_size
+                    )
+                )
+            strides = [1] * D
+            for d in range(D - 2, -1, -1):
+                strides[d] = strides[d + 1] * int(self.grid_size[d + 1])
+            self.batch_stride = strides[0] * int(self.grid_size[0])
+            self.strides = torch.tensor(strides, device=points.device)
+            point_hash = self.hash(self.cell_index(points)).view(-1)
+            sorted_hash, self.order = torch.sort(point_hash)
+            self.cell_hash, self.cell_count = torch.unique_consecutive(
+                sorted_hash, return_counts=True
+            )
+            self.cell_start = torch.cumsum(self.cell_count, 0) - self.cell_count
+        self._offsets = {}
+
+    def neighbor_offsets(self, ring=1):
+        if ring not in self._offsets:
+            self._offsets[ring] = torch.tensor(
+                list(itertools.product(range(-ring, ring + 1), repeat=self.dimension)),
+                device=self.strides.device,
+            )
+        return self._offsets[ring]
+
+    def cell_index(self, points):
+        """
+        :param points: torch.Tensor, ...xD
+        :return: torch.Tensor, ...xD, clamped into the occupied cells
+        """
+        cell_index = ((points - self.low) / self.cell_size).floor().long() + 1
+        return torch.min(cell_index.clamp(min=1), self.grid_size - 2)
+
+    def hash(self, cell_index, batch_index=None):
+        """
+        :param cell_index: torch.Tensor, BxNxD or (if batch_index is given) ...xD
+        :param batch_index: optional torch.Tensor, batch index of each cell
+        :return: torch.Tensor, BxN (or ...)
+        """
+        if batch_index is None:
+            B = cell_index.shape[0]
+            batch_index = torch.arange(B, device=cell_index.device)[:, None]
+        return (cell_index * self.strides).sum(-1) + batch_index * self.batch_stride
+
+    def neighbor_pairs(self, points, rows=None, ring=1):
+        """
+        enumerate the (query, point) pairs within the (2*ring+1)^D neighboring cells,
+        the query points are flattened over batch, only the given query rows are enumerated
+
+        :param points: torch.Tensor, BxNxD, query points
+        :param rows: optional torch.Tensor, flattened query rows (into B*N) to enumerate, all rows if None
+        :param ring: int, number of cell layers around the query cell
+        :return: (torch.Tensor, torch.Tensor), flattened query index (into B*N), flattened point index (into B*M)
+        """
+        B, N, D = points.shape
+        device = points.device
+        if rows is None:
+            rows = torch.arange(B * N, device=device)
+        with torch.no_grad():
+            offsets = self.neighbor_offsets(ring)  # KxD
+            query_cell = self.cell_index(points.reshape(-1, D)[rows])  # RxD
+            neighbor_cell = query_cell[:, None] + offsets  # RxKxD
+            valid = (
+                (neighbor_cell >= 0) & (neighbor_cell < self.grid_size)
+            ).all(-1)  # RxK
+            query_hash = self.hash(neighbor_cell, (rows // N)[:, None]).view(-1)
+            pos = torch.searchsorted(self.cell_hash, query_hash).clamp(
+                max=len(self.cell_hash) - 1
+            )
+            found = (self.cell_hash[pos] == query_hash) & valid.view(-1)
+            count = torch.where(
+                found, self.cell_count[pos], torch.zeros_like(query_hash)
+            )
+            cell_start = self.cell_start[pos]
+            pair_query = rows.repeat_interleave(len(offsets)).repeat_interleave(count)
+            seg_start = torch.cumsum(count, 0) - count
+            pair_rank = torch.arange(int(count.sum()), device=device)
+            pair_rank = pair_rank - seg_start.repeat_interleave(count)
+            pair_point = self.order[cell_start.repeat_interleave(count) + pair_rank]
+        return pair_query, pair_point
+
+    def guaranteed_radius(self, points, rows, ring=1):
+        """
+        the radius around each query within which every point has been visited by a search of the given ring
+
+        :param points: torch.Tensor, BxNxD, query points
+        :param rows: torch.Tensor, flattened query rows (into B*N)
+        :param ring: int, number of cell layers around the query cell
+        :return: torch.Tensor, R
+        """
+        D = points.shape[-1]
+        query = points.reshape(-1, D)[rows]
+        query_cell = self.cell_index(query)
+        block_low = self.low + (query_cell - ring - 1) * self.cell_size
+        block_high = self.low + (query_cell + ring) * self.cell_size
+        inf = torch.full_like(query, float("inf"))
+        # no points live beyond the border of the grid, those sides never need to be searched
+        low_gap = torch.where(query_cell - ring <= 1, inf, query - block_low)
+        high_gap = torch.where(
+            query_cell + ring >= self.grid_size - 2, inf, block_high - query
+        )
+        return torch.min(low_gap, high_gap).min(-1)[0].clamp(min=0)
+
+
+def _segment_rank(segment, value):
+    """
+    sort the pairs by (segment, value) and return the rank of each pair inside its segment
+
+    :param segment: torch.Tensor, P, segment id of each pair
+    :param value: torch.Tensor, P, value to sort in ascending order
+    :return: (torch.Tensor, torch.Tensor), the sorting order, the rank of the sorted pairs
+    """
+    order = torch.argsort(value)
+    order = order[torch.argsort(segment[order], stable=True)]
+    sorted_segment = segment[order]
+    _, count = torch.unique_consecutive(sorted_segment, return_counts=True)
+    seg_start = torch.cumsum(count, 0) - count
+    rank = torch.arange(len(order), device=segment.device) - seg_start.repeat_interleave(
+        count
+    )
+    return order, rank
+
+
+def gather_points(points, index):
+    """
+    :param points: torch.Tensor, BxMxD
+    :param index: torch.Tensor, BxNxK
+    :return: torch.Tensor, BxNxKxD
+    """
+    B, N, K = index.shape
+    batch_index = torch.arange(B, device=points.device).view(B, 1, 1)
+    return points[batch_index, index]
+
+
+class GridIndex(object):
+    """
+    uniform grid spatial index, support batch
+
+    Examples:
+        >>> index = GridIndex(target_points)
+        >>> dist2, knn_index = index.knn(source_points, K=5)
+        >>> ball_index, count = index.radius_search(source_points, radius=0.01, nsample=16)
+    """
+
+    def __init__(
+        self, points, cell_size=None, k_hint=8, max_ring=2, chunk_size=16384
+    ):
+        """
+        :param points: torch.Tensor, BxMxD, the points to be indexed
+        :param cell_size: the grid cell size, if None, it is set as the median distance to the k_hint-th neighbor
+        :param k_hint: the typical K of the knn query, used to set the cell size
+        :param max_ring: the max number of cell layers searched before falling back to the brute force search
+        :param chunk_size: number of query points processed at a time, bounds the memory of the pair list
+        """
+        self.points = points.detach()
+        self.version = points._version
+        self.nbatch, self.npoints, self.dimension = points.shape
+        self.max_ring = max_ring
+        self.chunk_size = chunk_size
+        self.cell_size = (
+            cell_size if cell_size is not None else self.estimate_cell_size(k_hint)
+        )
+        self.cell_list = CellList(self.points, self.cell_size)
+
+    def estimate_cell_size(self, k_hint, nsample=512):
+        """
+        the median distance to the k-th neighbor over a small random subset of the points,
+        unlike a volume based estimation, it is robust to points living on curves/surfaces (e.g. vessel trees)
+        """
+        B, M, D = self.points.shape
+        k = min(k_hint, M - 1) + 1
+        generator = torch.Generator(device="cpu").manual_seed(0)
+        sample = torch.randperm(M, generator=generator)[: min(nsample, M)].to(
+            self.points.device
+        )
+        kth_dist = []
+        for b in range(B):
+            dist = torch.cdist(self.points[b, sample], self.points[b])
+            kth_dist.append(dist.topk(k, dim=1, largest=False)[0][:, -1])
+        cell_size = float(torch.cat(kth_dist).median())
+        if cell_size <= 0:
+            extent = self.points.reshape(-1, D).max(0)[0] - self.points.reshape(
+                -1, D
+            ).min(0)[0]
+            cell_size = max(float(extent.max()), 1e-6)
+        return cell_size
+
+    def is_built_on(self, points):
+        return (
+            points.data_ptr() == self.points.data_ptr()
+            and points.shape == self.points.shape
+            and points._version == self.version
+        )
+
+    def knn(self, query, K, rows=None):
+        """
+        exact k nearest neighbors
+
+        :param query: torch.Tensor, BxNxD
+        :param K: int
+        :param rows: optional torch.Tensor, the flattened (b*N+n) query rows to be searched, if set,
+         only these rows are searched and the results are returned in the shape of len(rows)xK
+        :return: (torch.Tensor, torch.Tensor), BxNxK squared distance, BxNxK index (into M), sorted ascending
+        """
+        B, N, D = query.shape
+        assert B == self.nbatch, "the query batch size should be the same as the index"
+        query = query.detach()
+        device = query.device
+        query_flat = query.reshape(-1, D)
+        points_flat = self.points.reshape(-1, D)
+        knn_dist2 = torch.full((B * N, K), float("inf"), device=device, dtype=query.dtype)
+        knn_index = torch.zeros(B * N, K, dtype=torch.long, device=device)
+        pending = torch.arange(B * N, device=device) if rows is None else rows
+        for ring in range(1, self.max_ring + 1):
+            unresolved = []
+            for chunk in torch.split(pending, self.chunk_size):
+                pair_query, pair_point = self.cell_list.neighbor_pairs(
+                    query, chunk, ring
+                )
+                dist2 = ((query_flat[pair_query] - points_flat[pair_point]) ** 2).sum(-1)
+                order, rank = _segment_rank(pair_query, dist2)
+                keep = rank < K
+                sorted_query, sorted_point = pair_query[order][keep], pair_point[order][keep]
+                knn_dist2[sorted_query, rank[keep]] = dist2[order][keep]
+                knn_index[sorted_query, rank[keep]] = sorted_point % self.npoints
+                radius = self.cell_list.guaranteed_radius(query, chunk, ring)
+                resolved = knn_dist2[chunk, -1] <= radius ** 2
+                unresolved.append(chunk[~resolved])
+            pending = torch.cat(unresolved)
+            if len(pending) == 0:
+                break
+        if len(pending):
+            self._brute_force_knn(query_flat, pending, N, K, knn_dist2, knn_index)
+        if rows is not None:
+            return knn_dist2[rows], knn_index[rows]
+        return knn_dist2.view(B, N, K), knn_index.view(B, N, K)
+
+    def _brute_force_knn(self, query_flat, rows, N, K, knn_dist2, knn_index):
+        batch_of_rows = rows // N
+        for b in torch.unique(batch_of_rows).tolist():
+            b_rows = rows[batch_of_rows == b]
+            for chunk in torch.split(b_rows, max(1, self.chunk_size * 64 // self.npoints)):
+                dist2 = torch.cdist(query_flat[chunk], self.points[b]) ** 2
+                k_dist2, k_index = dist2.topk(min(K, self.npoints), dim=1, largest=False)
+                knn_dist2[chunk, : k_dist2.shape[1]] = k_dist2
+                knn_index[chunk, : k_index.shape[1]] = k_index
+
+    def nn(self, query):
+        """
+        :param query: torch.Tensor, BxNxD
+        :return: (torch.Tensor, torch.Tensor), BxNx1 squared distance, BxNx1 index (into M)
+        """
+        return self.knn(query, 1)
+
+    def radius_search(self, query, radius, nsample):
+        """
+        the (at most) nsample nearest points within the radius, sorted ascending,
+        the empty slots are filled with the nearest index (or 0 if no point is found), same as the ball query in pointnet2
+
+        :param query: torch.Tensor, BxNxD
+        :param radius: scalar
+        :param nsample: int, max number of points returned for each query
+        :return: (torch.Tensor, torch.Tensor), BxNxnsample index (into M), BxN number of points found
+        """
+        B, N, D = query.shape
+        query = query.detach()
+        device = query.device
+        query_flat = query.reshape(-1, D)
+        points_flat = self.points.reshape(-1, D)
+        ring = max(1, int(np.ceil(radius / self.cell_size)))
+        ball_index = torch.full((B * N, nsample), -1, dtype=torch.long, device=device)
+        for rows in torch.split(torch.arange(B * N, device=device), self.chunk_size):
+            pair_query, pair_point = self.cell_list.neighbor_pairs(query, rows, ring)
+            dist2 = ((query_flat[pair_query] - points_flat[pair_point]) ** 2).sum(-1)
+            within = dist2 <= radius ** 2
+            pair_query, pair_point, dist2 = (
+                pair_query[within],
+                pair_point[within],
+                dist2[within],
+            )
+            if len(pair_query) == 0:
+                continue
+            order, rank = _segment_rank(pair_query, dist2)
+            keep = rank < nsample
+            ball_index[pair_query[order][keep], rank[keep]] = (
+                pair_point[order][keep] % self.npoints
+            )
+        count = (ball_index >= 0).sum(-1)
+        first = ball_index[:, :1].clamp(min=0)
+        ball_index = torch.where(ball_index >= 0, ball_index, first)
+        return ball_index.view(B, N, nsample), count.view(B, N)
+
+
+SPATIAL_INDEX_POOL = {"grid": GridIndex}
+
+
+class SpatialIndexCache(object):
+    """
+    keep the index of the last indexed points, the index is rebuilt only if the points change,
+    e.g. the target shape is fixed over all the iterations of a registration and is indexed only once
+    """
+
+    def __init__(self, index_type="grid", **index_args):
+        assert index_type in SPATIAL_INDEX_POOL, "index type {} not in {}".format(
+            index_type, list(SPATIAL_INDEX_POOL.keys())
+        )
+        self.index_class = SPATIAL_INDEX_POOL[index_type]
+        self.index_args = index_args
+        self.index = None
+        self.n_build = 0
+
+    def get(self, points):
+        if self.index is None or not self.index.is_built_on(points):
+            self.index = self.index_class(points, **self.index_args)
+            self.n_build += 1
+        return self.index
+
+
+class IncrementalKNN(object):
+    """
+    kNN that reuses the result of the last call when the points only move slightly, e.g. over the iterations of an optimization.
+    For each query, the gap between its K-th and (K+1)-th neighbor distance is stored,
+    the distance of any query/point pair changes at most by the displacement of the query plus the displacement of the point,
+    so the knn set is unchanged as long as this bound stays below half of the gap, only the queries exceeding it are searched again.
+    The displacement of the indexed points is accumulated per row from the largest point displacement of each call,
+    so the bound of a row is the displacement since its own search and does not grow with the age of the index.
+    The returned result is always exact, the hit/miss counters record how many queries are reused/searched.
+
+    Examples:
+        >>> knn = IncrementalKNN("grid")
+        >>> for i in range(niter):
+        >>>     dist2, index = knn(flowed_points, target_points, K=5)
+        >>> print(knn.n_hit, knn.n_miss)
+    """
+
+    def __init__(self, index_type="grid", rebuild_ratio=0.5, **index_args):
+        """
+        :param index_type: spatial index type, see SPATIAL_INDEX_POOL
+        :param rebuild_ratio: all the rows are searched again if more than this fraction is stale
+        :param index_args: settings for the spatial index
+        """
+        self.index_cache = SpatialIndexCache(index_type, **index_args)
+        self.rebuild_ratio = rebuild_ratio
+        self.n_hit = 0
+        self.n_miss = 0
+        self.reset()
+
+    def reset(self):
+        self.K = None
+        self.knn_index = None  # (B*N)xK
+        self.gap = None  # B*N
+        self.query_anchor = None  # (B*N)xD, query positions when the row was searched
+        self.ref_anchor = None  # BxMxD, indexed positions at the last call
+        self.row_ref_shift = None  # B*N, bound of the displacement of the indexed points since the row was searched
+
+    @property
+    def hit_rate(self):
+        n_total = self.n_hit + self.n_miss
+        return self.n_hit / n_total if n_total else 0.0
+
+    def _search(self, query, points, K, rows=None):
+        index = self.index_cache.get(points)
+        # the indexed points keep moving, fix the cell size to save the estimation in every rebuild
+        self.index_cache.index_args.setdefault("cell_size", index.cell_size)
+        M = points.shape[1]
+        knn_dist2, knn_index = index.knn(query, min(K + 1, M), rows)
+        if M > K:
+            gap = knn_dist2[..., K].sqrt() - knn_dist2[..., K - 1].sqrt()
+        else:
+            gap = torch.full_like(knn_dist2[..., 0], float("inf"))
+        return knn_index[..., :K].reshape(-1, K), gap.reshape(-1)
+
+    def _compatible(self, query, points, K):
+        return (
+            self.knn_index is not None
+            and self.K == K
+            and self.query_anchor.shape == query.reshape(-1, query.shape[-1]).shape
+            and self.ref_anchor.shape == points.shape
+        )
+
+    def _rebuild(self, query, points, K):
+        self.K = K
+        self.knn_index, self.gap = self._search(query, points, K)
+        self.query_anchor = query.reshape(-1, query.shape[-1]).clone()
+        self.ref_anchor = points.clone()
+        self.row_ref_shift = torch.zeros_like(self.gap)
+
+    def _update(self, query, points, K):
+        """
+        search the stale rows again
+
+        :return: number of the searched rows
+        """
+        B, N, D = query.shape
+        query_flat = query.reshape(-1, D)
+        # |p - p_row| <= |p - p_last| + |p_last - p_row|, the anchor moves to the current points in every call
+        ref_shift = (points - self.ref_anchor).norm(dim=-1).max(1)[0]
+        self.row_ref_shift += ref_shift.repeat_interleave(N)
+        self.ref_anchor = points.clone()
+        query_shift = (query_flat - self.query_anchor).norm(dim=-1)
+        stale = query_shift + self.row_ref_shift >= 0.5 * self.gap
+        rows = stale.nonzero()[:, 0]
+        if len(rows) > self.rebuild_ratio * B * N:
+            self._rebuild(query, points, K)
+            return B * N
+        if len(rows):
+            self.knn_index[rows], self.gap[rows] = self._search(query, points, K, rows)
+            self.query_anchor[rows] = query_flat[rows]
+            self.row_ref_shift[rows] = 0
+        return len(rows)
+
+    def __call__(self, query, points, K):
+        """
+        :param query: torch.Tensor, BxNxD
+        :param points: torch.Tensor, BxMxD
+        :param K: int
+        :return: (torch.Tensor, torch.Tensor), BxNxK squared distance, BxNxK index (into M), sorted ascending
+        """
+        B, N, D = query.shape
+        query, points = query.detach(), points.detach()
+        if not self._compatible(query, points, K):
+            self._rebuild(query, points, K)
+            n_searched = B * N
+        else:
+            n_searched = self._update(query, points, K)
+        self.n_miss += n_searched
+        self.n_hit += B * N - n_searched
+        knn_index = self.knn_index.view(B, N, K)
+        knn_dist2 = ((query.unsqueeze(2) - gather_points(points, knn_index)) ** 2).sum(-1)
+        knn_dist2, order = knn_dist2.sort(-1)
+        return knn_dist2, knn_index.gather(-1, order)
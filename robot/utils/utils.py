@@ -514,38 +514,23 @@ def index_points(points, idx):
     return new_points
 
 
-def timming(func, message=""):
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
-
-    def time_diff(*args, **kwargs):
-        try:
-            start.record()
-            res = func(*args, **kwargs)
-            end.record()
-            torch.cuda.synchronize()
-            print("{}, it takes {} ms".format(message, start.elapsed_time(end)))
-        except:
-            res = func(*args, **kwargs)
-        return res
-
-    return time_diff
-
-
 def timming(func, message="", return_t=False):
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
+    """
+    print the run time (ms) of func, the call is also recorded as a span of the profiler (see utils/profiler)
+    """
+    import time
+    from robot.utils.profiler import profile_span
 
     def time_diff(*args, **kwargs):
-        try:
-            start.record()
-            res = func(*args, **kwargs)
-            end.record()
+        if torch.cuda.is_available():
             torch.cuda.synchronize()
-            t = start.elapsed_time(end)
-            print("{}, it takes {} ms".format(message, t))
-        except:
+        start = time.perf_counter()
+        with profile_span(message if message else func.__name__):
             res = func(*args, **kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        t = (time.perf_counter() - start) * 1000
+        print("{}, it takes {} ms".format(message, t))
         if not return_t:
             return res
         else: